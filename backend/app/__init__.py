@@ -6,12 +6,13 @@ from flask_bcrypt import Bcrypt
 from flask_migrate import Migrate
 from dotenv import load_dotenv
 from app.config import Config
+from app.services.socketio_backplane import socketio_options
 import os
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
 migrate = Migrate()
-socketio = SocketIO(cors_allowed_origins="*")  # Add this line
+socketio = SocketIO()  # configured in create_app() from the SOCKETIO_* settings
 
 def create_app():
     load_dotenv()
@@ -27,7 +28,7 @@ def create_app():
     # Extensions
     db.init_app(app)
     bcrypt.init_app(app)
-    socketio.init_app(app)  # Initialize socketio with app
+    socketio.init_app(app, **socketio_options(app.config))  # Initialize socketio with app
     
     # Enhanced CORS configuration
     CORS(
@@ -53,6 +54,9 @@ def create_app():
     from app.routes.orders.chatbot_orders import chatbot_bp
     app.register_blueprint(chatbot_bp, url_prefix='/api')
 
+    from app.routes.orders.mpesa_callback import mpesa_bp
+    app.register_blueprint(mpesa_bp, url_prefix='/api')
+
     
     app.register_blueprint(orders_bp, url_prefix='/api')
     app.register_blueprint(register_bp, url_prefix='/api/auth')
@@ -63,4 +67,23 @@ def create_app():
     with app.app_context():
         db.create_all()
 
+    # Chatbot product matching index (see app/services/product_index.py)
+    from app.services.product_index import product_index
+    product_index.refresh_seconds = app.config['PRODUCT_INDEX_REFRESH_SECONDS']
+
+    # Background STK push dispatch (see app/services/mpesa_outbox.py)
+    if app.config['MPESA_OUTBOX_WORKERS'] > 0:
+        from app.services.mpesa_outbox import start_outbox_dispatcher
+        start_outbox_dispatcher(app)
+
+    # Background bulk product imports (see app/services/import_jobs.py)
+    if app.config['IMPORT_JOB_WORKERS'] > 0:
+        from app.services.import_jobs import start_import_runner
+        start_import_runner(app)
+
+    # Periodic STK Query sweep for orders whose callback never arrived
+    if app.config['MPESA_RECONCILE_INTERVAL'] > 0:
+        from app.services.mpesa_reconciler import start_reconciler
+        start_reconciler(app)
+
     return app
\ No newline at end of file
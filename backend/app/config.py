@@ -18,8 +18,90 @@ class Config:
     
     # Allowed extensions
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+    # Authentication cache (verified tokens and the users they map to). A user change is dropped from this
+    # process's cache when it commits; other processes may serve the old row for up to the TTL
+    AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 10))  # seconds
+    AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 10000))
+    AUTH_USER_CACHE_SIZE = int(os.environ.get('AUTH_USER_CACHE_SIZE', 10000))
+
+    # M-Pesa STK push outbox worker (0 workers disables it in this process)
+    MPESA_OUTBOX_WORKERS = int(os.environ.get('MPESA_OUTBOX_WORKERS', 4))
+    MPESA_OUTBOX_POLL_INTERVAL = float(os.environ.get('MPESA_OUTBOX_POLL_INTERVAL', 2))  # seconds
+    MPESA_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('MPESA_OUTBOX_MAX_ATTEMPTS', 5))
+    MPESA_OUTBOX_BACKOFF_SECONDS = float(os.environ.get('MPESA_OUTBOX_BACKOFF_SECONDS', 5))
+    # Pushes that may have been accepted (timeouts, interrupted dispatch) wait this long for their callback
+    MPESA_OUTBOX_UNKNOWN_EXPIRY = int(os.environ.get('MPESA_OUTBOX_UNKNOWN_EXPIRY', 900))  # seconds
+
+    # M-Pesa callback settlement: results are coalesced into batches of up to this size
+    MPESA_CALLBACK_BATCH_SIZE = int(os.environ.get('MPESA_CALLBACK_BATCH_SIZE', 200))
+    MPESA_CALLBACK_MAX_WAIT = float(os.environ.get('MPESA_CALLBACK_MAX_WAIT', 0.2))  # seconds
+
+    # STK push reconciliation: orders left in processing this long are checked via STK Query
+    MPESA_RECONCILE_INTERVAL = float(os.environ.get('MPESA_RECONCILE_INTERVAL', 60))  # seconds; 0 disables
+    MPESA_RECONCILE_STALE_AFTER = int(os.environ.get('MPESA_RECONCILE_STALE_AFTER', 120))  # seconds
+    MPESA_RECONCILE_BATCH_SIZE = int(os.environ.get('MPESA_RECONCILE_BATCH_SIZE', 100))
+    MPESA_RECONCILE_CONCURRENCY = int(os.environ.get('MPESA_RECONCILE_CONCURRENCY', 4))
+    MPESA_RECONCILE_RATE = float(os.environ.get('MPESA_RECONCILE_RATE', 5))  # queries per second, all processes together
+    # Processes running the sweeper (e.g. gunicorn workers); each gets MPESA_RECONCILE_RATE / this
+    MPESA_RECONCILE_PROCESSES = int(os.environ.get('MPESA_RECONCILE_PROCESSES', 1))
+
+    # Chat messages: group-committed in batches; history capped per conversation (0 keeps everything)
+    MESSAGE_WRITE_BATCH_SIZE = int(os.environ.get('MESSAGE_WRITE_BATCH_SIZE', 100))
+    MESSAGE_WRITE_MAX_WAIT = float(os.environ.get('MESSAGE_WRITE_MAX_WAIT', 0.01))  # seconds
+    MESSAGE_RETENTION_PER_CONVERSATION = int(os.environ.get('MESSAGE_RETENTION_PER_CONVERSATION', 5000))
+    MESSAGE_PRUNE_EVERY = int(os.environ.get('MESSAGE_PRUNE_EVERY', 100))  # writes between retention checks
+
+    # Socket.IO across several processes (see app/services/socketio_backplane.py)
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE', '')  # e.g. redis://localhost:6379/0, memory://
+    SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL', 'flask-socketio')
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE') or None  # threading, eventlet, gevent; None picks the best installed
+    SOCKETIO_CORS_ORIGINS = os.environ.get('SOCKETIO_CORS_ORIGINS', '*')
+    if SOCKETIO_CORS_ORIGINS != '*':
+        SOCKETIO_CORS_ORIGINS = [origin.strip() for origin in SOCKETIO_CORS_ORIGINS.split(',')]
+    # The load balancer pins a client to one process; when it doesn't, clients must use websocket only
+    SOCKETIO_STICKY_SESSIONS = os.environ.get('SOCKETIO_STICKY_SESSIONS', 'true').lower() in ('1', 'true', 'yes')
+    SOCKETIO_PING_INTERVAL = int(os.environ.get('SOCKETIO_PING_INTERVAL', 25))  # seconds
+    SOCKETIO_PING_TIMEOUT = int(os.environ.get('SOCKETIO_PING_TIMEOUT', 20))  # seconds
+
+    # Typing indicators: changes are broadcast in batches at this cadence; typing lapses after the timeout
+    TYPING_BROADCAST_INTERVAL = float(os.environ.get('TYPING_BROADCAST_INTERVAL', 0.5))  # seconds
+    TYPING_TIMEOUT = float(os.environ.get('TYPING_TIMEOUT', 5))  # seconds
+
+    # Presence: '' keeps it per process, redis://... shares it; sockets lapse unless refreshed within the TTL
+    PRESENCE_STORE_URL = os.environ.get('PRESENCE_STORE_URL', '')
+    PRESENCE_TTL = int(os.environ.get('PRESENCE_TTL', 60))  # seconds
+    PRESENCE_HEARTBEAT_INTERVAL = int(os.environ.get('PRESENCE_HEARTBEAT_INTERVAL', 20))  # seconds
+
+    # Chatbot product index: kept current from this process's commits, fully rebuilt at this age
+    PRODUCT_INDEX_REFRESH_SECONDS = int(os.environ.get('PRODUCT_INDEX_REFRESH_SECONDS', 300))
+    # Runner-up products returned with each chatbot match
+    CHATBOT_MATCH_ALTERNATIVES = int(os.environ.get('CHATBOT_MATCH_ALTERNATIVES', 3))
+    # Chatbot follow-up state per user: '' keeps it per process, redis://... shares it
+    CHATBOT_SESSION_STORE_URL = os.environ.get('CHATBOT_SESSION_STORE_URL', '')
+    CHATBOT_SESSION_TTL = int(os.environ.get('CHATBOT_SESSION_TTL', 600))  # seconds
+
+    # Background bulk imports (0 workers disables the runner in this process; jobs wait for another one)
+    IMPORT_JOB_WORKERS = int(os.environ.get('IMPORT_JOB_WORKERS', 2))
+    # Where queued uploads wait. Local by default, so a job is only run on the host that saved it;
+    # set IMPORT_JOB_SHARED_FOLDER when every host mounts the same storage here
+    IMPORT_JOB_FOLDER = os.environ.get('IMPORT_JOB_FOLDER') or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'imports')
+    IMPORT_JOB_SHARED_FOLDER = os.environ.get('IMPORT_JOB_SHARED_FOLDER', 'false').lower() in ('1', 'true', 'yes')
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))  # rows per transaction
+    IMPORT_JOB_POLL_INTERVAL = float(os.environ.get('IMPORT_JOB_POLL_INTERVAL', 2))  # seconds
+    IMPORT_JOB_LEASE_SECONDS = int(os.environ.get('IMPORT_JOB_LEASE_SECONDS', 300))  # a running job without progress for this long is resumed elsewhere
+    IMPORT_JOB_MAX_ATTEMPTS = int(os.environ.get('IMPORT_JOB_MAX_ATTEMPTS', 3))
+    IMPORT_JOB_MAX_ERRORS = int(os.environ.get('IMPORT_JOB_MAX_ERRORS', 1000))  # row error messages kept per job
+
+    # Product lists showing stock may be served from cache this long after an order changes it
+    PRODUCT_STOCK_MAX_AGE = int(os.environ.get('PRODUCT_STOCK_MAX_AGE', 30))  # seconds
+
+    # Product/order exports: rows fetched per server-side cursor batch
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
     
     # Ensure upload directory exists
     @staticmethod
     def init_upload_dirs(app):
-        os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
\ No newline at end of file
+        os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+        os.makedirs(app.config['IMPORT_JOB_FOLDER'], exist_ok=True)
\ No newline at end of file
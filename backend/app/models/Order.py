@@ -1,4 +1,5 @@
 from app import db
+from sqlalchemy.orm import joinedload, selectinload
 from datetime import datetime
 from decimal import Decimal
 
@@ -14,18 +15,35 @@ class Order(db.Model):
     
     # M-Pesa specific fields
     mpesa_phone_number = db.Column(db.String(20), nullable=True)
-    mpesa_checkout_request_id = db.Column(db.String(100), nullable=True)
+    mpesa_checkout_request_id = db.Column(db.String(100), nullable=True, index=True)
     mpesa_merchant_request_id = db.Column(db.String(100), nullable=True)
     mpesa_response_code = db.Column(db.String(10), nullable=True)
     mpesa_result_code = db.Column(db.String(10), nullable=True)
     mpesa_result_desc = db.Column(db.String(255), nullable=True)
+    mpesa_receipt_number = db.Column(db.String(50), nullable=True)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Composite indexes backing the keyset-paginated admin listing
+    __table_args__ = (
+        db.Index('idx_orders_created_id', 'created_at', 'id'),
+        db.Index('idx_orders_status_created_id', 'status', 'created_at', 'id'),
+        db.Index('idx_orders_payment_created_id', 'payment_method', 'created_at', 'id'),
+        db.Index('idx_orders_customer_created_id', 'customer_id', 'created_at', 'id'),
+    )
+
     # Relationships
     customer = db.relationship("User", backref=db.backref("orders", lazy=True))
     items = db.relationship("OrderItem", backref="order", cascade="all, delete-orphan", lazy=True)
 
+    @staticmethod
+    def detail_options():
+        """Loader options for to_dict(): items+products in one batched query, customer joined"""
+        return (
+            selectinload(Order.items).joinedload(OrderItem.product),
+            joinedload(Order.customer),
+        )
+
     def calculate_totals(self):
         """Recalculate the order total and quantity based on items"""
         total_amount = Decimal('0.00')
@@ -57,6 +75,7 @@ class Order(db.Model):
             "mpesa_checkout_request_id": self.mpesa_checkout_request_id,
             "mpesa_merchant_request_id": self.mpesa_merchant_request_id,
             "mpesa_response_code": self.mpesa_response_code,
+            "mpesa_receipt_number": self.mpesa_receipt_number,
             "created_at": self.created_at.isoformat(),
             "items": [item.to_dict() for item in self.items]
         }
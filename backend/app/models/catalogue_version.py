@@ -0,0 +1,11 @@
+from app import db
+from datetime import datetime
+
+
+class CatalogueVersion(db.Model):
+    """Single-row counter bumped by every transaction that changes products; keys the /api/products ETag"""
+    __tablename__ = "catalogue_version"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,64 @@
+from app import db
+from datetime import datetime
+import json
+
+
+class ImportJob(db.Model):
+    """A bulk product upload imported in the background, chunk by chunk, by the import workers"""
+    __tablename__ = "import_jobs"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    status = db.Column(db.String(20), nullable=False, default="queued")  # queued, running, completed, failed
+    mode = db.Column(db.String(10), nullable=False, default="insert")  # insert, upsert
+    filename = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)
+    file_type = db.Column(db.String(10), nullable=False)  # csv, xlsx, xls
+    host = db.Column(db.String(255), nullable=True)  # where file_path lives, unless the folder is shared
+    created_by = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+
+    # Progress, committed together with each chunk's products
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    inserted = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.Integer, nullable=False, default=0)
+    unchanged = db.Column(db.Integer, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Text, nullable=True)  # JSON list of the first IMPORT_JOB_MAX_ERRORS messages
+    processing_seconds = db.Column(db.Float, nullable=False, default=0)
+    message = db.Column(db.String(255), nullable=True)
+
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    locked_at = db.Column(db.DateTime, nullable=True)  # refreshed after every chunk while running
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('idx_import_jobs_status_created', 'status', 'created_at'),
+    )
+
+    def error_messages(self):
+        return json.loads(self.errors) if self.errors else []
+
+    def to_dict(self, include_errors=True):
+        data = {
+            "id": self.id,
+            "status": self.status,
+            "mode": self.mode,
+            "filename": self.filename,
+            "rows_processed": self.rows_processed,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "success_count": self.inserted + self.updated,
+            "error_count": self.error_count,
+            "rows_per_second": round(self.rows_processed / self.processing_seconds) if self.processing_seconds else None,
+            "message": self.message,
+            "attempts": self.attempts,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+        if include_errors:
+            data["errors"] = self.error_messages()
+        return data
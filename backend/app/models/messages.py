@@ -6,17 +6,47 @@ class Conversation(db.Model):
     __tablename__ = 'conversations'
     
     id = db.Column(db.Integer, primary_key=True)
-    retailer_id = db.Column(db.String(100), nullable=False)
-    retailer_name = db.Column(db.String(200), nullable=False)
+    title = db.Column(db.String(200))
+    conversation_type = db.Column(db.String(20), default='direct')  # 'direct', 'group'
+    retailer_id = db.Column(db.String(100))
+    retailer_name = db.Column(db.String(200))
     retailer_avatar = db.Column(db.String(10), default='R')
-    customer_id = db.Column(db.String(100), nullable=False)
-    customer_name = db.Column(db.String(200), nullable=False)
+    customer_id = db.Column(db.String(100))
+    customer_name = db.Column(db.String(200))
     customer_avatar = db.Column(db.String(10), default='C')
     last_message = db.Column(db.Text)
-    unread_count = db.Column(db.Integer, default=0)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    unread_count = db.Column(db.Integer, default=0)  # messages not yet marked read
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)  # last activity
     
     messages = db.relationship('Message', backref='conversation', lazy=True, cascade='all, delete-orphan')
+    participants = db.relationship('ConversationParticipant', backref='conversation', lazy=True, cascade='all, delete-orphan')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'participant_ids': [p.user_id for p in self.participants],
+            'conversation_type': self.conversation_type,
+            'last_message': self.last_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.timestamp.isoformat() if self.timestamp else None
+        }
+
+class ConversationParticipant(db.Model):
+    __tablename__ = 'conversation_participants'
+    
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), primary_key=True)
+    user_id = db.Column(db.String(100), primary_key=True)
+    joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Inbox row for this participant, kept up to date by every send and read
+    last_message_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    unread_count = db.Column(db.Integer, default=0, nullable=False)
+    last_read_message_id = db.Column(db.Integer)
+    
+    __table_args__ = (
+        db.Index('idx_participant_inbox', 'user_id', 'last_message_at', 'conversation_id'),
+    )
 
 class Message(db.Model):
     __tablename__ = 'messages'
@@ -36,6 +66,18 @@ class Message(db.Model):
         db.Index('idx_sender_read', 'sender_id', 'read'),
         db.Index('idx_message_language', 'language'),
     )
+    
+    def to_dict(self, sender=None):
+        return {
+            'id': self.id,
+            'conversation_id': self.conversation_id,
+            'sender_id': self.sender_id,
+            'content': self.content,
+            'message_type': self.message_type,
+            'status': 'read' if self.read else 'sent',
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'sender': sender
+        }
 
 class SupportQA(db.Model):
     __tablename__ = 'support_qa'
@@ -0,0 +1,40 @@
+from app import db
+from datetime import datetime
+
+
+class MpesaOutbox(db.Model):
+    """STK push requests written in the order's transaction and sent later by the outbox worker"""
+    __tablename__ = "mpesa_outbox"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False, index=True)
+    phone_number = db.Column(db.String(20), nullable=False)
+    amount = db.Column(db.Integer, nullable=False)
+    account_reference = db.Column(db.String(50), nullable=False)
+    transaction_desc = db.Column(db.String(100), nullable=False)
+
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, in_progress, sent, unknown, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.String(255), nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    order = db.relationship("Order", backref=db.backref("mpesa_outbox", lazy=True))
+
+    __table_args__ = (
+        db.Index('idx_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "order_id": self.order_id,
+            "status": self.status,
+            "attempts": self.attempts,
+            "next_attempt_at": self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            "last_error": self.last_error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
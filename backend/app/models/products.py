@@ -18,22 +18,37 @@ class Product(db.Model):
     image_filename = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "sku": self.sku,
-            "description": self.description,
-            "category": self.category,  # Include category in response
-            "unit": self.unit,
-            "price": str(self.price),  # convert Decimal to string
-            "stock": self.stock,
-            "threshold": self.threshold,
-            "expiry_date": self.expiry_date.isoformat() if self.expiry_date else None,
-            "image_filename": self.image_filename,
-            "image_url": self.get_image_url() if self.image_filename else None,
-            "created_at": self.created_at.isoformat(),
-        }
+    # Response field -> columns it reads, for sparse fieldsets (?fields=id,name,price)
+    FIELD_COLUMNS = {
+        "id": ("id",),
+        "name": ("name",),
+        "sku": ("sku",),
+        "description": ("description",),
+        "category": ("category",),
+        "unit": ("unit",),
+        "price": ("price",),
+        "stock": ("stock",),
+        "threshold": ("threshold",),
+        "expiry_date": ("expiry_date",),
+        "image_filename": ("image_filename",),
+        "image_url": ("image_filename",),
+        "created_at": ("created_at",),
+    }
+
+    def to_dict(self, fields=None):
+        """All fields, or only those named in `fields` (keys of FIELD_COLUMNS)"""
+        return {field: self._field(field) for field in (fields or self.FIELD_COLUMNS)}
+
+    def _field(self, field):
+        if field == "price":
+            return str(self.price)  # convert Decimal to string
+        if field == "expiry_date":
+            return self.expiry_date.isoformat() if self.expiry_date else None
+        if field == "image_url":
+            return self.get_image_url() if self.image_filename else None
+        if field == "created_at":
+            return self.created_at.isoformat()
+        return getattr(self, field)
 
     def get_image_url(self):
         """Generate the full URL for the product image"""
@@ -1,53 +1,15 @@
 from flask import Blueprint, request, jsonify, make_response
 from app import db, bcrypt
 from app.models.User import User
+from app.services.auth_service import (
+    token_required, admin_required, get_cache_stats,
+    JWT_SECRET_KEY, JWT_ALGORITHM, JWT_EXPIRY_HOURS
+)
 import jwt
 import datetime
-from functools import wraps
 
 login_bp = Blueprint('login', __name__)
 
-# JWT Configuration
-JWT_SECRET_KEY = 'super-secret-jwt'  
-JWT_ALGORITHM = 'HS256'
-JWT_EXPIRY_HOURS = 24
-
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = request.cookies.get('access_token')
-        
-        if not token:
-            return jsonify({
-                'success': False,
-                'message': 'Token is missing'
-            }), 401
-        
-        try:
-            data = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-            current_user = User.query.get(data['user_id'])
-            
-            if not current_user:
-                return jsonify({
-                    'success': False,
-                    'message': 'Invalid token'
-                }), 401
-                
-        except jwt.ExpiredSignatureError:
-            return jsonify({
-                'success': False,
-                'message': 'Token has expired'
-            }), 401
-        except jwt.InvalidTokenError:
-            return jsonify({
-                'success': False,
-                'message': 'Invalid token'
-            }), 401
-        
-        return f(current_user, *args, **kwargs)
-    
-    return decorated
-
 @login_bp.route('/login', methods=['POST'])
 def login():
     try:
@@ -137,7 +99,7 @@ def logout():
         'message': 'Logged out successfully'
     }))
     
-    # Clear the access token cookie
+    # Clear the access token cookie (the JWT itself stays valid until it expires)
     response.set_cookie('access_token', '', expires=0)
     return response
 
@@ -147,4 +109,12 @@ def get_current_user(current_user):
     return jsonify({
         'success': True,
         'user': current_user.to_dict()
-    })
\ No newline at end of file
+    })
+
+@login_bp.route('/cache-stats', methods=['GET'])
+@admin_required
+def get_auth_cache_stats(current_user):
+    return jsonify({
+        'success': True,
+        'stats': get_cache_stats()
+    })
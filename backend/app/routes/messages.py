@@ -1,80 +1,61 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_socketio import emit, join_room, leave_room
-from app import socketio
+from app import db, socketio
+from app.models.messages import Message
+from app.services.message_store import (
+    ConversationNotFound, InvalidMessage, check_message, parse_id, conversation_room, get_profiles, create_conversation as store_conversation,
+    get_inbox_page, get_history_page, serialize_messages, store_message, mark_read_up_to, mark_one_read,
+    get_message_writer
+)
+from app.services.typing_indicator import TypingTracker
+from app.services.presence import PresenceTracker, create_presence_store
+from app.services.auth_service import admin_required
+from app.utils.pagination import parse_limit, encode_cursor, InvalidCursor
 from datetime import datetime
-import uuid
 
 messages_bp = Blueprint('messages', __name__)
 
-# Mock data storage (in-memory for testing)
-conversations_store = {}
-messages_store = {}
-users_store = {
-    'customer_1': {
-        'id': 'customer_1',
-        'name': 'Sarah Johnson',
-        'avatar': 'SJ',
-        'online': True,
-        'user_type': 'customer'
-    },
-    'retailer_1': {
-        'id': 'retailer_1',
-        'name': 'Tech Store',
-        'avatar': 'TS',
-        'online': True,
-        'user_type': 'retailer'
-    },
-    'ai_support': {
-        'id': 'ai_support',
-        'name': 'AI Assistant',
-        'avatar': 'AI',
-        'online': True,
-        'user_type': 'ai'
-    }
-}
-
-# Initialize with some mock data
-conversations_store['conv_1'] = {
-    'id': 'conv_1',
-    'title': 'Tech Store',
-    'participant_ids': ['customer_1', 'retailer_1'],
-    'conversation_type': 'direct',
-    'created_at': datetime.utcnow().isoformat(),
-    'updated_at': datetime.utcnow().isoformat()
-}
-
-messages_store['conv_1'] = [
-    {
-        'id': 'msg_1',
-        'conversation_id': 'conv_1',
-        'sender_id': 'customer_1',
-        'content': 'Hi, I have questions about investment strategies',
-        'message_type': 'text',
-        'status': 'read',
-        'timestamp': datetime.utcnow().isoformat(),
-        'sender': users_store['customer_1']
-    },
-    {
-        'id': 'msg_2',
-        'conversation_id': 'conv_1',
-        'sender_id': 'ai_support',
-        'content': 'Hello! I\'d be happy to help you with investment strategies. For beginners, I recommend starting with a diversified portfolio.',
-        'message_type': 'text',
-        'status': 'read',
-        'timestamp': datetime.utcnow().isoformat(),
-        'sender': users_store['ai_support']
-    }
-]
+_typing_tracker = None
+_presence = None
+
+
+def get_typing_tracker():
+    global _typing_tracker
+    if _typing_tracker is None:
+        _typing_tracker = TypingTracker(
+            socketio,
+            interval=current_app.config['TYPING_BROADCAST_INTERVAL'],
+            timeout=current_app.config['TYPING_TIMEOUT']
+        )
+    return _typing_tracker
+
+
+def get_presence():
+    global _presence
+    if _presence is None:
+        _presence = PresenceTracker(
+            socketio,
+            create_presence_store(current_app.config['PRESENCE_STORE_URL']),
+            ttl=current_app.config['PRESENCE_TTL'],
+            heartbeat_interval=current_app.config['PRESENCE_HEARTBEAT_INTERVAL']
+        )
+    return _presence
+
 
 # Socket.IO event handlers
 @socketio.on('connect')
-def handle_connect():
+def handle_connect(auth=None):
     print(f'Client connected: {request.sid}')
+    # Clients may identify themselves up front with io({auth: {user_id}})
+    if isinstance(auth, dict) and auth.get('user_id'):
+        get_presence().connect(request.sid, auth['user_id'])
     emit('connected', {'status': 'connected', 'sid': request.sid})
 
 @socketio.on('disconnect')
-def handle_disconnect():
+def handle_disconnect(*args):
     print(f'Client disconnected: {request.sid}')
+    get_typing_tracker().drop_sid(request.sid)
+    get_presence().disconnect(request.sid)
 
 @socketio.on('join_conversation')
 def handle_join_conversation(data):
@@ -82,19 +63,17 @@ def handle_join_conversation(data):
     user_id = data.get('user_id')
 
     if conversation_id and user_id:
-        join_room(conversation_id)
+        join_room(conversation_room(conversation_id))
         print(f"User {user_id} joined conversation {conversation_id}")
 
-        # Update user online status
-        if user_id in users_store:
-            users_store[user_id]['online'] = True
-            users_store[user_id]['last_seen'] = datetime.utcnow().isoformat()
+        # This socket now counts towards the user being online
+        get_presence().connect(request.sid, user_id)
 
         emit('user_joined', {
             'user_id': user_id,
             'conversation_id': conversation_id,
             'timestamp': datetime.utcnow().isoformat()
-        }, room=conversation_id)
+        }, room=conversation_room(conversation_id))
 
 @socketio.on('leave_conversation')
 def handle_leave_conversation(data):
@@ -102,26 +81,17 @@ def handle_leave_conversation(data):
     user_id = data.get('user_id')
 
     if conversation_id:
-        leave_room(conversation_id)
+        leave_room(conversation_room(conversation_id))
         print(f"User {user_id} left conversation {conversation_id}")
 
-        if user_id:
-            if user_id in users_store:
-                users_store[user_id]['online'] = False
-                users_store[user_id]['last_seen'] = datetime.utcnow().isoformat()
-
 @socketio.on('typing_start')
 def handle_typing_start(data):
     conversation_id = data.get('conversation_id')
     user_id = data.get('user_id')
 
     if conversation_id and user_id:
-        emit('user_typing', {
-            'user_id': user_id,
-            'conversation_id': conversation_id,
-            'is_typing': True,
-            'timestamp': datetime.utcnow().isoformat()
-        }, room=conversation_id)
+        # Coalesced into a periodic typing_update event for the room
+        get_typing_tracker().start(conversation_room(conversation_id), conversation_id, str(user_id), request.sid)
 
 @socketio.on('typing_stop')
 def handle_typing_stop(data):
@@ -129,49 +99,27 @@ def handle_typing_stop(data):
     user_id = data.get('user_id')
 
     if conversation_id and user_id:
-        emit('user_typing', {
-            'user_id': user_id,
-            'conversation_id': conversation_id,
-            'is_typing': False,
-            'timestamp': datetime.utcnow().isoformat()
-        }, room=conversation_id)
+        get_typing_tracker().stop(conversation_room(conversation_id), conversation_id, str(user_id))
 
 @socketio.on('send_message')
 def handle_send_message(data):
     try:
-        conversation_id = data.get('conversation_id')
-        sender_id = data.get('sender_id')
-        content = data.get('content')
-        message_type = data.get('message_type', 'text')
-
-        # Create new message
-        new_message = {
-            'id': f'msg_{uuid.uuid4().hex[:8]}',
-            'conversation_id': conversation_id,
-            'sender_id': sender_id,
-            'content': content,
-            'message_type': message_type,
-            'status': 'sent',
-            'timestamp': datetime.utcnow().isoformat(),
-            'sender': users_store.get(sender_id, {
-                'id': sender_id,
-                'name': 'Unknown User',
-                'avatar': 'UU'
-            })
-        }
-
-        # Store message
-        if conversation_id not in messages_store:
-            messages_store[conversation_id] = []
-        messages_store[conversation_id].append(new_message)
-
-        # Update conversation
-        if conversation_id in conversations_store:
-            conversations_store[conversation_id]['updated_at'] = datetime.utcnow().isoformat()
-            conversations_store[conversation_id]['last_message'] = content
+        conversation_id = parse_id(data.get('conversation_id'), 'conv_')
+        if conversation_id is None:
+            raise ConversationNotFound("Conversation not found")
+        check_message(data.get('sender_id'), data.get('content'))
+
+        # Stored through the batching writer; returns once the message is committed
+        new_message = store_message(
+            current_app._get_current_object(), conversation_id,
+            data.get('sender_id'), data.get('content'), data.get('message_type', 'text')
+        )
+
+        # Sending ends the sender's typing indicator
+        get_typing_tracker().message_sent(conversation_room(conversation_id), data.get('conversation_id'), str(data.get('sender_id')))
 
         # Broadcast to conversation room
-        emit('new_message', new_message, room=conversation_id)
+        emit('new_message', new_message, room=conversation_room(conversation_id))
 
     except Exception as e:
         print(f"Error sending message: {e}")
@@ -183,37 +131,46 @@ def handle_send_message(data):
 # REST API Routes
 @messages_bp.route('/conversations', methods=['GET'])
 def get_conversations():
+    """The user's inbox, most recent first; pass `cursor=<next_cursor>` for the next page"""
     user_id = request.args.get('user_id', 'customer_1')
+    limit = parse_limit(request.args.get('limit'))
+
+    try:
+        rows, participants, next_cursor = get_inbox_page(user_id, limit, request.args.get('cursor'))
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+
+    participant_ids = {pid for pids in participants.values() for pid in pids}
+    profiles = get_profiles(participant_ids)
+    online = get_presence().online(participant_ids)
 
-    # Get conversations for the user
     user_conversations = []
-    for conv_id, conv in conversations_store.items():
-        if user_id in conv.get('participant_ids', []):
-            # Get last message
-            last_message = ''
-            if conv_id in messages_store and messages_store[conv_id]:
-                last_message = messages_store[conv_id][-1]['content']
-
-            # Get other participant
-            other_participant_id = next(
-                (pid for pid in conv['participant_ids'] if pid != user_id),
-                None
-            )
-            other_user = users_store.get(other_participant_id, {})
-
-            user_conversations.append({
-                'id': conv_id,
-                'title': conv.get('title', other_user.get('name', 'Unknown')),
-                'last_message': last_message,
-                'timestamp': conv.get('updated_at', conv.get('created_at')),
-                'unread_count': 0,  # Mock value
-                'avatar': other_user.get('avatar', 'UU'),
-                'online': other_user.get('online', False),
-                'participant_name': other_user.get('name', 'Unknown'),
-                'conversation_type': conv.get('conversation_type', 'direct')
-            })
-
-    return jsonify(user_conversations)
+    for inbox, conv in rows:
+        # Get other participant
+        other_participant_id = next(
+            (pid for pid in participants.get(conv.id, []) if pid != str(user_id)),
+            None
+        )
+        other_user = profiles.get(other_participant_id, {})
+
+        user_conversations.append({
+            'id': conv.id,
+            'title': conv.title or other_user.get('name', 'Unknown'),
+            'last_message': conv.last_message or '',
+            'timestamp': inbox.last_message_at.isoformat(),
+            'unread_count': inbox.unread_count,
+            'avatar': other_user.get('avatar', 'UU'),
+            'online': other_participant_id in online,
+            'participant_name': other_user.get('name', 'Unknown'),
+            'conversation_type': conv.conversation_type or 'direct'
+        })
+
+    return jsonify({
+        'conversations': user_conversations,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
+        'limit': limit
+    })
 
 @messages_bp.route('/conversations', methods=['POST'])
 def create_conversation():
@@ -221,37 +178,49 @@ def create_conversation():
     participant_ids = data.get('participant_ids', ['customer_1', 'retailer_1'])
     title = data.get('title', 'New Conversation')
 
-    # Create new conversation
-    new_conv_id = f'conv_{uuid.uuid4().hex[:8]}'
-    new_conversation = {
-        'id': new_conv_id,
-        'title': title,
-        'participant_ids': participant_ids,
-        'conversation_type': 'direct' if len(participant_ids) == 2 else 'group',
-        'created_at': datetime.utcnow().isoformat(),
-        'updated_at': datetime.utcnow().isoformat()
-    }
-
-    conversations_store[new_conv_id] = new_conversation
-    messages_store[new_conv_id] = []
+    try:
+        new_conversation = store_conversation(participant_ids, title)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error creating conversation: {e}")
+        return jsonify({'error': str(e)}), 500
 
     return jsonify({
         'message': 'Conversation created',
-        'conversation_id': new_conv_id,
-        'conversation': new_conversation
+        'conversation_id': new_conversation.id,
+        'conversation': new_conversation.to_dict()
     }), 201
 
 @messages_bp.route('/conversations/<conversation_id>/messages', methods=['GET'])
 def get_messages(conversation_id):
+    """
+    Newest page first; pass `before=<before_cursor>` to load older messages
+    and `after=<after_cursor>` to fetch anything newer than what is shown.
+    `has_more` says whether another page exists in the direction walked.
+    """
     user_id = request.args.get('user_id', 'customer_1')
+    limit = parse_limit(request.args.get('limit'))
+    before = request.args.get('before')
+    after = request.args.get('after')
+    if before and after:
+        return jsonify({'error': 'Use either before or after, not both'}), 400
+
+    conversation_pk = parse_id(conversation_id, 'conv_')
+    if conversation_pk is None:
+        return jsonify({'error': 'Conversation not found'}), 404
 
-    messages = messages_store.get(conversation_id, [])
+    try:
+        rows, has_more = get_history_page(conversation_pk, limit, before=before, after=after)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
 
+    oldest, newest = (rows[0], rows[-1]) if rows else (None, None)
     return jsonify({
-        'messages': messages,
-        'total': len(messages),
-        'pages': 1,
-        'current_page': 1
+        'messages': serialize_messages(rows),
+        'limit': limit,
+        'has_more': has_more,
+        'before_cursor': encode_cursor(oldest.timestamp, oldest.id) if oldest else None,
+        'after_cursor': encode_cursor(newest.timestamp, newest.id) if newest else after
     })
 
 @messages_bp.route('/messages/<message_id>/read', methods=['POST'])
@@ -259,56 +228,114 @@ def mark_message_read(message_id):
     data = request.get_json()
     user_id = data.get('user_id', 'customer_1')
 
-    # Find and update message status
-    for conv_id, messages in messages_store.items():
-        for msg in messages:
-            if msg['id'] == message_id and msg['sender_id'] != user_id:
-                msg['status'] = 'read'
-
-                # Emit read receipt
-                socketio.emit('message_read', {
-                    'message_id': message_id,
-                    'user_id': user_id,
-                    'conversation_id': conv_id,
-                    'read_at': datetime.utcnow().isoformat()
-                }, room=conv_id)
+    message_pk = parse_id(message_id, 'msg_')
+    msg = db.session.get(Message, message_pk) if message_pk is not None else None
+    if not msg or msg.sender_id == str(user_id):
+        return jsonify({'error': 'Message not found'}), 404
+    if msg.read:
+        return jsonify({'message': 'Message marked as read'})
+
+    mark_one_read(user_id, msg)
+    db.session.commit()
+
+    # Emit read receipt
+    socketio.emit('message_read', {
+        'message_id': msg.id,
+        'user_id': user_id,
+        'conversation_id': msg.conversation_id,
+        'read_at': datetime.utcnow().isoformat()
+    }, room=conversation_room(msg.conversation_id))
+
+    return jsonify({'message': 'Message marked as read'})
+
+@messages_bp.route('/messages/read', methods=['POST'])
+def mark_messages_read():
+    """
+    Bulk read receipt: {"user_id": ..., "up_to": <message id or list of ids>}.
+    Marks every unread message from other participants up to each given
+    message and emits one message_read event per conversation.
+    """
+    data = request.get_json() or {}
+    user_id = data.get('user_id', 'customer_1')
+    up_to = data.get('up_to')
+    if not isinstance(up_to, list):
+        up_to = [up_to]
 
-                return jsonify({'message': 'Message marked as read'})
+    message_ids = [pk for pk in (parse_id(value, 'msg_') for value in up_to) if pk is not None]
+    if not message_ids:
+        return jsonify({'error': 'up_to must be one or more message ids'}), 400
 
-    return jsonify({'error': 'Message not found'}), 404
+    try:
+        receipts = mark_read_up_to(user_id, message_ids)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error marking messages read: {e}")
+        return jsonify({'error': str(e)}), 500
+    if not receipts:
+        return jsonify({'error': 'Message not found'}), 404
+
+    read_at = datetime.utcnow().isoformat()
+    for receipt in receipts:
+        if receipt['count']:
+            socketio.emit('message_read', {
+                'message_id': receipt['message_id'],
+                'up_to': True,
+                'count': receipt['count'],
+                'user_id': user_id,
+                'conversation_id': receipt['conversation_id'],
+                'read_at': read_at
+            }, room=conversation_room(receipt['conversation_id']))
+
+    return jsonify({'message': 'Messages marked as read', 'conversations': receipts})
 
 @messages_bp.route('/send-message', methods=['POST'])
 def send_message_http():
     """HTTP endpoint for sending messages"""
-    data = request.get_json()
+    data = request.get_json() or {}
     conversation_id = data.get('conversation_id', 'conv_1')
-    sender_id = data.get('sender_id', 'customer_1')
-    content = data.get('content', '')
-
-    # Create message
-    new_message = {
-        'id': f'msg_{uuid.uuid4().hex[:8]}',
-        'conversation_id': conversation_id,
-        'sender_id': sender_id,
-        'content': content,
-        'message_type': 'text',
-        'status': 'sent',
-        'timestamp': datetime.utcnow().isoformat(),
-        'sender': users_store.get(sender_id, {
-            'id': sender_id,
-            'name': 'You' if sender_id == 'customer_1' else 'AI Assistant',
-            'avatar': 'SJ' if sender_id == 'customer_1' else 'AI'
-        })
-    }
+    sender_id = data.get('sender_id')
+    content = data.get('content')
+
+    conversation_pk = parse_id(conversation_id, 'conv_')
+    try:
+        check_message(sender_id, content)
+        if conversation_pk is None:
+            raise ConversationNotFound("Conversation not found")
+        new_message = store_message(current_app._get_current_object(), conversation_pk, sender_id, content)
+    except InvalidMessage as e:
+        return jsonify({'error': str(e)}), 400
+    except ConversationNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f"Error sending message: {e}")
+        return jsonify({'error': str(e)}), 500
 
-    # Store message
-    if conversation_id not in messages_store:
-        messages_store[conversation_id] = []
-    messages_store[conversation_id].append(new_message)
+    get_typing_tracker().message_sent(conversation_room(conversation_pk), conversation_id, str(sender_id))
 
     result = {'user_message': new_message}
 
     # Emit via SocketIO if available
-    socketio.emit('new_message', new_message, room=conversation_id)
+    socketio.emit('new_message', new_message, room=conversation_room(conversation_pk))
+
+    return jsonify(result)
+
+@messages_bp.route('/presence', methods=['GET'])
+def get_presence_status():
+    """Online status for ?user_ids=a,b,c in one store lookup"""
+    user_ids = [uid for uid in request.args.get('user_ids', '').split(',') if uid]
+    if not user_ids:
+        return jsonify({'error': 'user_ids is required'}), 400
+    if len(user_ids) > 500:
+        return jsonify({'error': 'At most 500 user_ids per request'}), 400
 
-    return jsonify(result)
\ No newline at end of file
+    return jsonify({'presence': get_presence().get_status(user_ids)})
+
+@messages_bp.route('/messages/stats', methods=['GET'])
+@admin_required
+def get_messaging_stats(current_user):
+    """Write batching and typing-indicator coalescing counters for this process"""
+    return jsonify({
+        'success': True,
+        'writer': get_message_writer(current_app._get_current_object()).get_stats(),
+        'typing': get_typing_tracker().get_stats()
+    })
\ No newline at end of file
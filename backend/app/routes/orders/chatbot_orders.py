@@ -1,43 +1,31 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from app import db
 from app.models.Order import Order, OrderItem
 from app.models.products import Product
 from app.models.User import User
-from app.services.mpesa_service import MpesaService
-import jwt
-from functools import wraps
+from app.services.auth_service import token_required
+from app.services.inventory_service import reserve_stock, StockError
+from app.services.mpesa_outbox import enqueue_stk_push, notify_outbox
+from app.services.mpesa_service import mpesa_amount
+from app.services.product_index import product_index
+from app.services.chatbot_parser import parse_order, split_basket, parse_follow_up
+from app.services.chatbot_sessions import ChatbotSessions, create_session_store
 from decimal import Decimal
 import re
 
 chatbot_bp = Blueprint("chatbot_orders", __name__)
 
-# JWT configuration
-JWT_SECRET_KEY = "super-secret-jwt"
-JWT_ALGORITHM = "HS256"
+_sessions = None
 
-# ========== TOKEN DECORATOR ==========
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = request.cookies.get("access_token")
 
-        if not token:
-            return jsonify({"success": False, "message": "Token is missing"}), 401
-
-        try:
-            data = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-            current_user = User.query.get(data["user_id"])
-            if not current_user:
-                return jsonify({"success": False, "message": "Invalid token"}), 401
-
-        except jwt.ExpiredSignatureError:
-            return jsonify({"success": False, "message": "Token has expired"}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({"success": False, "message": "Invalid token"}), 401
-
-        return f(current_user, *args, **kwargs)
-
-    return decorated
+def get_chatbot_sessions():
+    global _sessions
+    if _sessions is None:
+        _sessions = ChatbotSessions(
+            create_session_store(current_app.config['CHATBOT_SESSION_STORE_URL']),
+            ttl=current_app.config['CHATBOT_SESSION_TTL']
+        )
+    return _sessions
 
 # ========== PHONE NUMBER NORMALIZATION ==========
 def normalize_phone_number(phone_number):
@@ -77,142 +65,103 @@ def normalize_phone_number(phone_number):
     return None
 
 # ========== AI PRODUCT DETECTION ==========
+MENTION_CONFIDENCE = 0.5  # a product word somewhere in a message without a quantity
 def detect_product_order(message, language='en'):
     """
     Advanced product and quantity detection from natural language
     """
     message_lower = message.lower().strip()
     
-    # Get ALL products (both available and unavailable) for comprehensive matching
-    all_products = Product.query.all()
-    
-    # Enhanced patterns for both languages
-    patterns = {
-        'en': [
-            # "I want 5 cooking oil"
-            (r'(?:i\s+want|i\s+need|give\s+me|order|buy|get)\s+(\d+)\s+(.+)', (1, 2)),
-            # "5 cooking oil"
-            (r'(\d+)\s+(.+)', (1, 2)),
-            # "cooking oil 5"
-            (r'(.+?)\s+(\d+)(?:\s|$)', (2, 1)),
-            # "I'd like 3 bags of rice"
-            (r'(?:i\'\s*d\s+like|i\s+would\s+like)\s+(\d+)\s+(.+)', (1, 2)),
-        ],
-        'sw': [
-            # "Nataka mafuta ya kupikia 5"
-            (r'(?:nataka|nahitaji|nipe|agiza|nunua|leta)\s+(.+?)\s+(\d+)', (2, 1)),
-            # "5 mafuta ya kupikia"
-            (r'(\d+)\s+(.+)', (1, 2)),
-            # "mafuta ya kupikia 5"
-            (r'(.+?)\s+(\d+)(?:\s|$)', (2, 1)),
-            # "Ningependa kupata 3 mchele"
-            (r'(?:ningependa|napenda)\s+(?:kupata|kuagiza)\s+(\d+)\s+(.+)', (1, 2)),
-        ]
-    }
+    order_info = detect_order_line(message_lower, language)
+    if order_info:
+        return order_info
     
-    lang_patterns = patterns.get(language, patterns['en'])
+    # If no quantity specified, check if it's just a product mention from ALL products
+    product_id = product_index.find_mentioned(message_lower)
+    product = db.session.get(Product, product_id) if product_id is not None else None
+    if product:
+        return {
+            'quantity': None,  # No quantity specified
+            'product_name': product.name,
+            'product': product,
+            'match_confidence': 'medium',
+            'confidence': MENTION_CONFIDENCE,
+            'alternatives': [],
+            'is_available': product.stock > 0
+        }
     
-    for pattern, groups in lang_patterns:
-        match = re.search(pattern, message_lower, re.IGNORECASE)
-        if match:
-            try:
-                quantity = int(match.group(groups[0]))
-                raw_product_name = match.group(groups[1]).strip()
-                
-                if quantity <= 0:
-                    continue
-                
-                # Clean product name
-                stop_words = {
-                    'en': ['please', 'thanks', 'thank you', 'i want', 'i need', 'give me', 'order', 'buy', 'get', 'of'],
-                    'sw': ['tafadhali', 'asante', 'nataka', 'nahitaji', 'nipe', 'agiza', 'nunua', 'leta', 'ya']
-                }
-                
-                for word in stop_words.get(language, []):
-                    raw_product_name = re.sub(r'\b' + word + r'\b', '', raw_product_name, flags=re.IGNORECASE)
-                
-                product_name = re.sub(r'\s+', ' ', raw_product_name).strip()
-                
-                if product_name:
-                    # Try to find the best matching product from ALL products
-                    best_product = find_best_product_match(product_name, all_products)
-                    if best_product:
-                        return {
-                            'quantity': quantity,
-                            'product_name': product_name,
-                            'product': best_product,
-                            'match_confidence': 'high',
-                            'is_available': best_product.stock > 0
-                        }
-                    
-            except (ValueError, IndexError):
-                continue
+    return None
+
+def detect_order_line(text, language='en'):
+    """(quantity, product) for one order line, or None when it has no quantity or no known product"""
+    limit = 1 + current_app.config['CHATBOT_MATCH_ALTERNATIVES']
     
-    # If no quantity specified, check if it's just a product mention from ALL products
-    for product in all_products:
-        product_lower = product.name.lower()
-        # Check if product name is mentioned in the message
-        if product_lower in message_lower or any(word in message_lower for word in product_lower.split()):
+    # Every (quantity, name) reading the grammar finds, first matching product wins
+    for quantity, product_name in parse_order(text, language):
+        matches = find_best_product_match(product_name, limit)
+        if matches:
+            best_product, confidence = matches[0]
             return {
-                'quantity': None,  # No quantity specified
-                'product_name': product.name,
-                'product': product,
-                'match_confidence': 'medium',
-                'is_available': product.stock > 0
+                'quantity': quantity,
+                'product_name': product_name,
+                'product': best_product,
+                'match_confidence': confidence_label(confidence),
+                'confidence': confidence,
+                'alternatives': matches[1:],
+                'is_available': best_product.stock > 0
             }
-    
     return None
 
-def find_best_product_match(product_name, products):
+def detect_basket(segments, language='en'):
     """
-    Find the best matching product using multiple strategies
+    Order lines for a message already split by split_basket(). Returns
+    (lines, unmatched segments); a product named twice gets one line with
+    the quantities added up.
     """
-    product_name_lower = product_name.lower()
-    
-    # Strategy 1: Exact match
-    for product in products:
-        if product.name.lower() == product_name_lower:
-            return product
-    
-    # Strategy 2: Contains match
-    for product in products:
-        if product_name_lower in product.name.lower() or product.name.lower() in product_name_lower:
-            return product
-    
-    # Strategy 3: Word overlap with scoring
-    best_match = None
-    best_score = 0
-    
-    product_words = set(product_name_lower.split())
-    
-    for product in products:
-        product_name_words = set(product.name.lower().split())
-        overlap = len(product_words.intersection(product_name_words))
-        
-        # Calculate score based on overlap and string similarity
-        if overlap > 0:
-            # Additional points for longer matches
-            score = overlap * 2
-            
-            # Check for partial matches within words
-            for p_word in product_words:
-                for prod_word in product_name_words:
-                    if p_word in prod_word or prod_word in p_word:
-                        score += 1
-            
-            if score > best_score:
-                best_score = score
-                best_match = product
-    
-    if best_score >= 1:  # Require at least some meaningful match
-        return best_match
-    
-    # Strategy 4: Try category matching
-    for product in products:
-        if product.category and product_name_lower in product.category.lower():
-            return product
-    
-    return None
+    lines, unmatched = {}, []
+    for segment in segments:
+        order_info = detect_order_line(segment, language)
+        if order_info is None:
+            unmatched.append(segment)
+            continue
+        existing = lines.get(order_info['product'].id)
+        if existing:
+            existing['quantity'] += order_info['quantity']
+        else:
+            lines[order_info['product'].id] = order_info
+    return list(lines.values()), unmatched
+
+def find_best_product_match(product_name, limit=1):
+    """
+    Ranked matches for a typed product name as [(Product, confidence)], best first
+    (see ProductIndex.rank)
+    """
+    ranked = product_index.rank(product_name, limit)
+    if not ranked:
+        return []
+    products = {p.id: p for p in Product.query.filter(Product.id.in_([pid for pid, _ in ranked])).all()}
+    return [(products[pid], score) for pid, score in ranked if pid in products]
+
+def confidence_label(confidence):
+    if confidence >= 0.85:
+        return 'high'
+    if confidence >= 0.6:
+        return 'medium'
+    return 'low'
+
+def match_details(order_info):
+    """Confidence and runner-up products for an analyze-message response"""
+    return {
+        "match_confidence": order_info['match_confidence'],
+        "confidence": order_info['confidence'],
+        "alternatives": [{
+            "id": product.id,
+            "name": product.name,
+            "price": float(product.price),
+            "stock": product.stock,
+            "confidence": confidence
+        } for product, confidence in order_info['alternatives']]
+    }
 
 # ========== CHATBOT ENDPOINTS ==========
 
@@ -229,7 +178,12 @@ def analyze_chat_message(current_user):
             return jsonify({"success": False, "message": "Message is required"}), 400
         
         message = data['message'].strip()
-        language = data.get('language', 'en')
+        sessions = get_chatbot_sessions()
+        session = sessions.get(current_user.id)
+        # The language sticks for the session once the customer has picked one
+        language = data.get('language') or session.get('language', 'en')
+        if language != session.get('language'):
+            session = sessions.update(current_user.id, language=language)
         
         if not message:
             return jsonify({
@@ -238,11 +192,39 @@ def analyze_chat_message(current_user):
                 "message": "Hello! How can I help you with your order today?"
             }), 200
         
-        # Detect product order from ALL products (including unavailable ones)
-        order_info = detect_product_order(message, language)
+        # "yes" to "Shall I proceed with ordering ...?" confirms what the bot suggested
+        items = confirmed_suggestion(session, message, language)
+        if items:
+            return jsonify({
+                "success": True,
+                "type": "confirm_order",
+                "message": "Great! Placing your order now." if language == 'en' else "Sawa! Naweka agizo lako sasa.",
+                "items": items,
+                "original_message": message
+            }), 200
+        
+        # "5" or "ok send 3" answering the bot's last question needs no parsing or search
+        order_info = follow_up_order(session, message, language)
+        
+        if order_info is None:
+            # Several items in one message ("5 rice and 3 sugar") are answered as one basket
+            segments = split_basket(message, language)
+            if len(segments) > 1:
+                lines, unmatched = detect_basket(segments, language)
+                if lines:
+                    # Only a basket that can be ordered as it stands is offered for confirmation
+                    orderable = all(line['product'].stock >= line['quantity'] for line in lines)
+                    sessions.update(current_user.id, language=language, pending=None, last_suggestion={
+                        'items': [{'product_id': line['product'].id, 'quantity': line['quantity']} for line in lines]
+                    } if orderable else None)
+                    return basket_response(current_user, message, lines, unmatched)
+            
+            # Detect product order from ALL products (including unavailable ones)
+            order_info = detect_product_order(message, language)
         
         if not order_info:
             # No product detected at all
+            sessions.update(current_user.id, language=language, pending=None, last_suggestion=None)
             return jsonify({
                 "success": True,
                 "type": "general",
@@ -252,6 +234,7 @@ def analyze_chat_message(current_user):
         product = order_info['product']
         
         if not product:
+            sessions.update(current_user.id, language=language, pending=None, last_suggestion=None)
             return jsonify({
                 "success": True,
                 "type": "product_not_found",
@@ -261,21 +244,26 @@ def analyze_chat_message(current_user):
         
         # Check stock availability - THIS IS THE KEY FIX
         if not order_info['is_available']:
+            sessions.update(current_user.id, language=language, pending=None, last_suggestion=None)
             return jsonify({
                 "success": True,
                 "type": "out_of_stock",
                 "message": f"I'm sorry, {product.name} is currently out of stock.",
                 "product_name": product.name,
+                **match_details(order_info),
                 "original_message": message
             }), 200
         
         # Handle case where no quantity specified
         if order_info['quantity'] is None:
+            sessions.update(current_user.id, language=language, last_suggestion=None,
+                            pending={'product_id': product.id, 'reason': 'need_quantity'})
             return jsonify({
                 "success": True,
                 "type": "need_quantity",
                 "message": f"Great! {product.name} is available. We have {product.stock} units in stock. How many would you like to order?",
                 "product": product.to_dict(),
+                **match_details(order_info),
                 "original_message": message
             }), 200
         
@@ -283,6 +271,9 @@ def analyze_chat_message(current_user):
         
         # Check if sufficient stock
         if product.stock < quantity:
+            sessions.update(current_user.id, language=language, last_suggestion=None, pending={
+                'product_id': product.id, 'reason': 'insufficient_stock', 'suggested_quantity': product.stock
+            })
             return jsonify({
                 "success": True,
                 "type": "insufficient_stock",
@@ -291,11 +282,14 @@ def analyze_chat_message(current_user):
                 "available_stock": product.stock,
                 "requested_quantity": quantity,
                 "product": product.to_dict(),
+                **match_details(order_info),
                 "original_message": message
             }), 200
         
         # Product is available with specified quantity
         total_amount = float(product.price) * quantity
+        sessions.update(current_user.id, language=language, pending=None,
+                        last_suggestion={'product_id': product.id, 'quantity': quantity})
         
         return jsonify({
             "success": True,
@@ -306,6 +300,7 @@ def analyze_chat_message(current_user):
             "total_amount": total_amount,
             "confirmation_message": f"Shall I proceed with ordering {quantity} {product.name} for KSh {total_amount:.2f}?",
             "customer_name": f"{current_user.first_name}",
+            **match_details(order_info),
             "original_message": message
         }), 200
         
@@ -318,6 +313,118 @@ def analyze_chat_message(current_user):
             "message": "I encountered an error processing your request. Please try again."
         }), 500
 
+def confirmed_suggestion(session, message, language):
+    """
+    The items of the bot's last suggestion when the message only agrees to
+    it ("yes", "sawa"); None otherwise, or when a question is still pending
+    """
+    suggestion = session.get('last_suggestion')
+    if not suggestion or session.get('pending'):
+        return None
+    reply = parse_follow_up(message, language)
+    if reply is None or reply != (None, True):
+        return None
+    if 'items' in suggestion:
+        return suggestion['items']
+    return [{'product_id': suggestion['product_id'], 'quantity': suggestion['quantity']}]
+
+def follow_up_order(session, message, language):
+    """
+    Order line for a reply to the bot's last question about a product,
+    loaded by primary key from the session; None when nothing is pending
+    or the message is a new request. A number after a one-product
+    suggestion changes its quantity.
+    """
+    pending = session.get('pending')
+    suggestion = session.get('last_suggestion') or {}
+    if not pending and 'product_id' in suggestion:
+        pending = {'product_id': suggestion['product_id'], 'reason': 'change_quantity'}
+    if not pending:
+        return None
+    reply = parse_follow_up(message, language)
+    if reply is None:
+        return None
+    
+    quantity, agreed = reply
+    if quantity is None:
+        # "ok" to "Would you like to order 3 instead?"
+        if not agreed or 'suggested_quantity' not in pending:
+            return None
+        quantity = pending['suggested_quantity']
+    
+    product = db.session.get(Product, pending['product_id'])
+    if product is None:
+        return None
+    return {
+        'quantity': quantity,
+        'product_name': product.name,
+        'product': product,
+        'match_confidence': 'high',
+        'confidence': 1.0,
+        'alternatives': [],
+        'is_available': product.stock > 0
+    }
+
+def basket_response(current_user, message, lines, unmatched):
+    """analyze-message reply for a multi-item message; `items` is ready for confirm-order"""
+    items, problems = [], []
+    total_amount = 0.0
+    for line in lines:
+        product, quantity = line['product'], line['quantity']
+        if product.stock <= 0:
+            status = 'out_of_stock'
+            problems.append(f"{product.name} is out of stock")
+        elif product.stock < quantity:
+            status = 'insufficient_stock'
+            problems.append(f"only {product.stock} units of {product.name} are available")
+        else:
+            status = 'available'
+        line_total = float(product.price) * quantity
+        if status == 'available':
+            total_amount += line_total
+        items.append({
+            "product_id": product.id,
+            "product": product.to_dict(),
+            "quantity": quantity,
+            "available_stock": product.stock,
+            "status": status,
+            "line_total": line_total,
+            **match_details(line)
+        })
+    
+    summary = ", ".join(f"{line['quantity']} {line['product'].name}" for line in lines)
+    if problems:
+        text = f"I found {summary}, but " + "; ".join(problems) + "."
+    else:
+        text = f"Perfect! I can order {summary} for you at KSh {total_amount:.2f}."
+    if unmatched:
+        text += " I couldn't find: " + ", ".join(f"'{segment}'" for segment in unmatched) + "."
+    
+    return jsonify({
+        "success": True,
+        "type": "basket",
+        "message": text,
+        "items": items,
+        "unmatched": unmatched,
+        "can_order": not problems,
+        "total_amount": total_amount,
+        "confirmation_message": f"Shall I proceed with ordering {summary} for KSh {total_amount:.2f}?" if not problems else None,
+        "customer_name": f"{current_user.first_name}",
+        "original_message": message
+    }), 200
+
+def describe_shortfalls(items):
+    """'3 units of Sugar'-style notes for basket items asking for more than is in stock"""
+    requested = {}
+    for item in items:
+        try:
+            product_id, quantity = int(item['product_id']), int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            return []
+        requested[product_id] = requested.get(product_id, 0) + quantity
+    products = Product.query.filter(Product.id.in_(list(requested))).order_by(Product.id).all()
+    return [f"{p.stock} units of {p.name}" for p in products if p.stock < requested[p.id]]
+
 def get_available_products_sample():
     """Get a sample of available products for suggestions"""
     products = Product.query.filter(Product.stock > 0).limit(5).all()
@@ -344,25 +451,15 @@ def confirm_chatbot_order(current_user):
         if not data:
             return jsonify({"success": False, "message": "No data provided"}), 400
         
-        required_fields = ['product_id', 'quantity', 'total_amount']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"success": False, "message": f"Missing required field: {field}"}), 400
-        
-        product_id = data['product_id']
-        quantity = data['quantity']
-        total_amount = data['total_amount']
-        
-        # Verify product exists and has sufficient stock
-        product = Product.query.get(product_id)
-        if not product:
-            return jsonify({"success": False, "message": "Product not found"}), 404
-        
-        if product.stock < quantity:
-            return jsonify({
-                "success": False, 
-                "message": f"Sorry, only {product.stock} units of {product.name} are available now."
-            }), 400
+        # A basket ({"items": [{product_id, quantity}, ...]}) or a single product
+        items = data.get('items')
+        if items is None:
+            for field in ['product_id', 'quantity']:
+                if field not in data:
+                    return jsonify({"success": False, "message": f"Missing required field: {field}"}), 400
+            items = [{'product_id': data['product_id'], 'quantity': data['quantity']}]
+        elif not isinstance(items, list) or not items:
+            return jsonify({"success": False, "message": "items must be a non-empty list"}), 400
         
         # NORMALIZE PHONE NUMBER PROPERLY
         phone_number = normalize_phone_number(current_user.phone_number)
@@ -373,12 +470,26 @@ def confirm_chatbot_order(current_user):
                 "message": "Unable to process payment. Please ensure your phone number is registered in the correct format (e.g., 254712345678)."
             }), 400
         
-        print(f"Processing order with phone: {phone_number}")  # Debug log
+        # Lock the product rows and reserve the whole basket in one batch in this transaction
+        try:
+            products = reserve_stock(items)
+        except StockError as e:
+            db.session.rollback()
+            if e.status_code == 404:
+                return jsonify({"success": False, "message": "Product not found"}), 404
+            
+            shortfalls = describe_shortfalls(items)
+            if shortfalls:
+                return jsonify({
+                    "success": False, 
+                    "message": f"Sorry, only {', '.join(shortfalls)} are available now."
+                }), 400
+            return jsonify({"success": False, "message": e.message}), e.status_code
         
         # Create order
         order = Order(
             customer_id=current_user.id,
-            total_amount=Decimal(str(total_amount)),
+            total_amount=Decimal('0.00'),
             payment_method='mpesa',
             status='pending',
             mpesa_phone_number=phone_number
@@ -387,62 +498,40 @@ def confirm_chatbot_order(current_user):
         db.session.add(order)
         db.session.flush()
         
-        # Add order item
-        order_item = OrderItem(
-            order_id=order.id,
-            product_id=product_id,
-            quantity=quantity,
-            price=Decimal(str(product.price))
-        )
-        db.session.add(order_item)
+        # Add order items, priced from the reserved rows
+        for item in items:
+            product = products[int(item['product_id'])]
+            db.session.add(OrderItem(
+                order_id=order.id,
+                product=product,
+                quantity=int(item['quantity']),
+                price=Decimal(str(product.price))
+            ))
         
         # Calculate totals
         order.calculate_totals()
         
-        # Initiate M-Pesa STK Push
-        mpesa_service = MpesaService()
-        account_reference = f"CHAT{order.id}"
-        transaction_desc = f"Order #{order.id} - {product.name}"
-        
-        # Convert amount to integer for M-Pesa
-        mpesa_amount = int(float(total_amount))
-        
-        print(f"Sending STK Push to: {phone_number}, Amount: {mpesa_amount}")  # Debug log
-        
-        stk_response, error = mpesa_service.stk_push(
+        # Queue one M-Pesa STK Push for the whole basket; the outbox worker sends it after commit
+        names = [products[pid].name for pid in dict.fromkeys(int(item['product_id']) for item in items)]
+        enqueue_stk_push(
+            order,
             phone_number=phone_number,
-            amount=mpesa_amount,
-            account_reference=account_reference,
-            transaction_desc=transaction_desc
+            amount=mpesa_amount(order.total_amount),  # whole shillings, rounded half up
+            account_reference=f"CHAT{order.id}",
+            transaction_desc=f"Order #{order.id} - {names[0] if len(names) == 1 else f'{len(names)} items'}"
         )
         
-        if error:
-            db.session.rollback()
-            print(f"STK Push Error: {error}")  # Debug log
-            return jsonify({
-                "success": False, 
-                "message": f"Payment processing failed: {error}"
-            }), 400
-        
-        # Update order with M-Pesa details
-        if stk_response:
-            order.mpesa_merchant_request_id = stk_response.get('MerchantRequestID')
-            order.mpesa_checkout_request_id = stk_response.get('CheckoutRequestID')
-            order.mpesa_response_code = stk_response.get('ResponseCode')
-            
-            if stk_response.get('ResponseCode') == '0':
-                order.status = 'processing'
-        
-        # Update product stock
-        product.stock -= quantity
-        
         # Commit everything
+        # Serialise before commit expires the rows loaded during reservation
+        order_data = order.to_dict()
         db.session.commit()
+        notify_outbox()
+        get_chatbot_sessions().update(current_user.id, pending=None, last_suggestion=None)
         
         return jsonify({
             "success": True,
-            "message": f"Order confirmed {current_user.first_name}! I've sent an M-Pesa prompt to {phone_number}. Please check your phone to complete payment.",
-            "order": order.to_dict(),
+            "message": f"Order confirmed {current_user.first_name}! I'm sending an M-Pesa prompt to {phone_number}. Please check your phone to complete payment.",
+            "order": order_data,
             "stk_push_sent": True,
             "customer_name": f"{current_user.first_name}",
             "phone_number": phone_number
@@ -0,0 +1,35 @@
+from flask import Blueprint, request, jsonify, current_app
+from app.services.mpesa_service import get_mpesa_service
+from app.services.mpesa_settlement import parse_stk_callback, get_callback_ingestor
+
+mpesa_bp = Blueprint("mpesa_callback", __name__)
+
+# ========== DARAJA CALLBACKS ==========
+
+# STK push result callback (MpesaService.callback_url, which ends in MPESA_CALLBACK_TOKEN)
+@mpesa_bp.route("/mpesa-callback", methods=["POST"])
+@mpesa_bp.route("/mpesa-callback/<token>", methods=["POST"])
+def mpesa_callback(token=None):
+    """
+    Acknowledge Safaricom immediately and settle the order in the background.
+    Settlement is idempotent per CheckoutRequestID, so retried or duplicated
+    callbacks are harmless. Anyone can learn a CheckoutRequestID, so the
+    secret token in the URL is what stops forged "paid" callbacks.
+    """
+    if not get_mpesa_service().callback_token_valid(token):
+        print("Rejected M-Pesa callback with a missing or wrong token")
+        return jsonify({"ResultCode": 1, "ResultDesc": "Rejected"}), 403
+
+    payload = request.get_json(silent=True)
+    result = parse_stk_callback(payload) if payload else None
+
+    if not result:
+        print(f"Ignoring malformed M-Pesa callback: {payload}")
+        return jsonify({"ResultCode": 1, "ResultDesc": "Rejected: malformed callback"}), 400
+
+    # Set by the outbox on every push (callback_url_for); finds the order when
+    # we never learned this push's CheckoutRequestID
+    result['order_id'] = request.args.get("order", type=int)
+    get_callback_ingestor(current_app._get_current_object()).submit(result)
+
+    return jsonify({"ResultCode": 0, "ResultDesc": "Accepted"}), 200
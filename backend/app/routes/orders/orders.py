@@ -3,41 +3,87 @@ from app import db
 from app.models.Order import Order, OrderItem
 from app.models.products import Product
 from app.models.User import User
-from app.services.mpesa_service import MpesaService
-import jwt
-from functools import wraps
+from app.services.auth_service import token_required
+from app.services.inventory_service import reserve_stock, release_stock, StockError
+from app.services.mpesa_outbox import enqueue_stk_push, notify_outbox, get_outbox_stats
+from app.services.mpesa_service import get_mpesa_service, mpesa_amount
+from app.services.mpesa_settlement import get_callback_stats, OPEN_STATUSES
+from app.services.mpesa_reconciler import get_reconciler_stats, trigger_reconciliation
+from app.utils.pagination import parse_limit, keyset_before, paginate_keyset, InvalidCursor
+from app.utils.export import export_response, EXPORT_FORMATS
+from app.services.exports import order_rows, ORDER_COLUMNS
+from sqlalchemy import or_, update
 from datetime import datetime , timedelta
 from decimal import Decimal
 
 orders_bp = Blueprint("orders", __name__)
 
-# JWT configuration
-JWT_SECRET_KEY = "super-secret-jwt"
-JWT_ALGORITHM = "HS256"
-
-# ========== TOKEN DECORATOR ==========
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = request.cookies.get("access_token")
-
-        if not token:
-            return jsonify({"success": False, "message": "Token is missing"}), 401
-
-        try:
-            data = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-            current_user = User.query.get(data["user_id"])
-            if not current_user:
-                return jsonify({"success": False, "message": "Invalid token"}), 401
-
-        except jwt.ExpiredSignatureError:
-            return jsonify({"success": False, "message": "Token has expired"}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({"success": False, "message": "Invalid token"}), 401
-
-        return f(current_user, *args, **kwargs)
-
-    return decorated
+# ========== HELPER FUNCTIONS ==========
+def parse_datetime_arg(value, end_of_day=False):
+    """Parse a YYYY-MM-DD or ISO 8601 query arg; a date-only upper bound covers that whole day"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def filter_orders(query, args):
+    """Apply the admin listing's status/payment/customer/date filters; ValueError on a malformed id or date"""
+    # Server-side filters
+    statuses = [s for s in args.get("status", "").split(",") if s]
+    if statuses:
+        query = query.filter(Order.status.in_(statuses))
+
+    if args.get("payment_method"):
+        query = query.filter(Order.payment_method == args["payment_method"])
+
+    if args.get("customer_id"):
+        customer_id = args.get("customer_id", type=int)
+        if customer_id is None:
+            raise ValueError("customer_id must be an integer")
+        query = query.filter(Order.customer_id == customer_id)
+
+    if args.get("customer"):
+        term = f"%{args['customer'].strip()}%"
+        query = query.join(User, Order.customer_id == User.id).filter(or_(
+            User.email.ilike(term),
+            User.first_name.ilike(term),
+            User.last_name.ilike(term),
+            User.phone_number.ilike(term)
+        ))
+
+    date_from = parse_datetime_arg(args.get("date_from"))
+    date_to = parse_datetime_arg(args.get("date_to"), end_of_day=True)
+    if (args.get("date_from") and not date_from) or (args.get("date_to") and not date_to):
+        raise ValueError("Dates must be YYYY-MM-DD or ISO 8601")
+    if date_from:
+        query = query.filter(Order.created_at >= date_from)
+    if date_to:
+        query = query.filter(Order.created_at < date_to)
+    return query
+
+def cancel_order(order):
+    """
+    Cancel an open order and return its reserved stock, in the caller's
+    transaction. The status flip is a guarded UPDATE, so of two concurrent
+    cancels (or a cancel racing a failed-payment callback) only one releases
+    the stock. Returns False if the order was no longer open.
+    """
+    result = db.session.execute(
+        update(Order)
+        .where(Order.id == order.id, Order.status.in_(OPEN_STATUSES))
+        .values(status='cancelled')
+        .execution_options(synchronize_session=False)
+    )
+    db.session.expire(order, ['status'])
+    if result.rowcount != 1:
+        return False
+    release_stock([order])
+    return True
 
 # ========== ROUTES ==========
 
@@ -86,22 +132,17 @@ def create_order_with_mpesa(current_user):
         db.session.add(order)
         db.session.flush()  # Get the order ID without committing
 
+        # Lock and decrement stock for the whole basket in one batch
+        products = reserve_stock(items)
+
         # Add order items - ensure prices are Decimal
         for item_data in items:
-            product = Product.query.get(item_data['product_id'])
-            if not product:
-                return jsonify({"success": False, "message": f"Product not found: {item_data['product_id']}"}), 404
-            
-            # Check stock availability
-            if product.stock < item_data['quantity']:
-                return jsonify({"success": False, "message": f"Insufficient stock for {product.name}"}), 400
-            
             # Ensure price is converted to Decimal
             item_price = Decimal(str(item_data['price']))
             
             order_item = OrderItem(
                 order_id=order.id,
-                product_id=item_data['product_id'],
+                product=products[int(item_data['product_id'])],
                 quantity=item_data['quantity'],
                 price=item_price
             )
@@ -110,45 +151,32 @@ def create_order_with_mpesa(current_user):
         # Calculate totals
         order.calculate_totals()
 
-        # Initiate M-Pesa STK Push
-        mpesa_service = MpesaService()
-        account_reference = f"ORDER{order.id}"
-        transaction_desc = f"Payment for order #{order.id}"
-        
-        # Convert amount to integer for M-Pesa (they expect whole numbers)
-        mpesa_amount = int(float(amount))
-        
-        stk_response, error = mpesa_service.stk_push(
+        # Queue the M-Pesa STK Push; the outbox worker sends it after commit
+        # Charge the order's own total in whole shillings (M-Pesa takes integers), rounded half up
+        enqueue_stk_push(
+            order,
             phone_number=phone_number,
-            amount=mpesa_amount,
-            account_reference=account_reference,
-            transaction_desc=transaction_desc
+            amount=mpesa_amount(order.total_amount),
+            account_reference=f"ORDER{order.id}",
+            transaction_desc=f"Payment for order #{order.id}"
         )
 
-        if error:
-            db.session.rollback()
-            return jsonify({"success": False, "message": f"M-Pesa STK Push failed: {error}"}), 400
-
-        # Update order with M-Pesa response details
-        if stk_response:
-            order.mpesa_merchant_request_id = stk_response.get('MerchantRequestID')
-            order.mpesa_checkout_request_id = stk_response.get('CheckoutRequestID')
-            order.mpesa_response_code = stk_response.get('ResponseCode')
-            
-            # If STK Push was initiated successfully, mark as processing
-            if stk_response.get('ResponseCode') == '0':
-                order.status = 'processing'
-
-        # Commit the order and M-Pesa details
+        # Serialise before commit expires the rows loaded during reservation
+        order_data = order.to_dict()
         db.session.commit()
+        notify_outbox()
 
         return jsonify({
             "success": True,
-            "message": "Order created and M-Pesa STK Push initiated successfully",
-            "order": order.to_dict(),
-            "mpesa_response": stk_response
+            "message": "Order created. An M-Pesa prompt will be sent to your phone shortly",
+            "order": order_data,
+            "mpesa_status": "queued"
         }), 201
 
+    except StockError as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": e.message}), e.status_code
+
     except Exception as e:
         db.session.rollback()
         print(f"Error creating order with M-Pesa: {str(e)}")
@@ -183,22 +211,17 @@ def create_order_cash_on_delivery(current_user):
         db.session.add(order)
         db.session.flush()
 
+        # Lock and decrement stock for the whole basket in one batch
+        products = reserve_stock(items)
+
         # Add order items - ensure prices are Decimal
         for item_data in items:
-            product = Product.query.get(item_data['product_id'])
-            if not product:
-                return jsonify({"success": False, "message": f"Product not found: {item_data['product_id']}"}), 404
-            
-            # Check stock availability
-            if product.stock < item_data['quantity']:
-                return jsonify({"success": False, "message": f"Insufficient stock for {product.name}"}), 400
-            
             # Ensure price is converted to Decimal
             item_price = Decimal(str(item_data['price']))
             
             order_item = OrderItem(
                 order_id=order.id,
-                product_id=item_data['product_id'],
+                product=products[int(item_data['product_id'])],
                 quantity=item_data['quantity'],
                 price=item_price
             )
@@ -206,14 +229,20 @@ def create_order_cash_on_delivery(current_user):
 
         # Calculate totals
         order.calculate_totals()
+        # Serialise before commit expires the rows loaded during reservation
+        order_data = order.to_dict()
         db.session.commit()
 
         return jsonify({
             "success": True,
             "message": "Order created successfully (Cash on Delivery)",
-            "order": order.to_dict()
+            "order": order_data
         }), 201
 
+    except StockError as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": e.message}), e.status_code
+
     except Exception as e:
         db.session.rollback()
         print(f"Error creating cash order: {str(e)}")
@@ -227,6 +256,7 @@ def create_order_cash_on_delivery(current_user):
 def get_user_orders(current_user):
     try:
         orders = Order.query.filter_by(customer_id=current_user.id)\
+                          .options(*Order.detail_options())\
                           .order_by(Order.created_at.desc())\
                           .all()
         
@@ -244,7 +274,9 @@ def get_user_orders(current_user):
 @token_required
 def get_order(current_user, order_id):
     try:
-        order = Order.query.filter_by(id=order_id, customer_id=current_user.id).first()
+        order = Order.query.filter_by(id=order_id, customer_id=current_user.id)\
+                          .options(*Order.detail_options())\
+                          .first()
         
         if not order:
             return jsonify({"success": False, "message": "Order not found"}), 404
@@ -258,7 +290,7 @@ def get_order(current_user, order_id):
         print(f"Error fetching order: {str(e)}")
         return jsonify({"success": False, "message": str(e)}), 500
     
-# Get all orders for admin
+# Get all orders for admin (keyset-paginated on created_at, id)
 @orders_bp.route("/admin/orders", methods=["GET"])
 @token_required
 def get_all_orders(current_user):
@@ -267,17 +299,62 @@ def get_all_orders(current_user):
         if not current_user.role =="admin":  # You'll need to add this field to your User model
             return jsonify({"success": False, "message": "Unauthorized"}), 403
 
-        orders = Order.query.order_by(Order.created_at.desc()).all()
-        
+        args = request.args
+        limit = parse_limit(args.get("limit"))
+        try:
+            query = filter_orders(Order.query, args)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+
+        # Totals per status over every matching order, not just this page; sent with the first page only
+        status_counts = None
+        if not args.get("cursor"):
+            counts = filter_orders(db.session.query(Order.status, db.func.count(Order.id)), args)\
+                .group_by(Order.status)
+            status_counts = {status: count for status, count in counts}
+
+        if args.get("cursor"):
+            try:
+                query = query.filter(keyset_before(Order.created_at, Order.id, args["cursor"]))
+            except InvalidCursor:
+                return jsonify({"success": False, "message": "Invalid cursor"}), 400
+
+        query = query.options(*Order.detail_options())\
+                     .order_by(Order.created_at.desc(), Order.id.desc())
+        orders, next_cursor = paginate_keyset(query, limit)
+
         return jsonify({
             "success": True,
-            "orders": [order.to_dict() for order in orders]
+            "orders": [order.to_dict() for order in orders],
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
+            "limit": limit,
+            "status_counts": status_counts
         }), 200
 
     except Exception as e:
         print(f"Error fetching all orders: {str(e)}")
         return jsonify({"success": False, "message": str(e)}), 500
 
+# Export orders for admin as a streamed CSV/XLSX download (same filters as the listing)
+@orders_bp.route("/admin/orders/export", methods=["GET"])
+@token_required
+def export_orders(current_user):
+    if not current_user.role == "admin":
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+
+    file_format = request.args.get("format", "csv").lower()
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({"success": False, "message": "format must be 'csv' or 'xlsx'"}), 400
+    try:
+        query = filter_orders(Order.query, request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    rows = order_rows(query, batch_size=current_app.config['EXPORT_BATCH_SIZE'])
+    filename = f"orders_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
+    return export_response(ORDER_COLUMNS, rows, file_format, filename, sheet_name="Orders")
+
 # Update order status
 @orders_bp.route("/admin/orders/<int:order_id>/status", methods=["PUT"])
 @token_required
@@ -300,6 +377,8 @@ def update_order_status(current_user, order_id):
         if new_status not in valid_statuses:
             return jsonify({"success": False, "message": "Invalid status"}), 400
 
+        if new_status == 'cancelled':
+            cancel_order(order)
         order.status = new_status
         db.session.commit()
 
@@ -331,6 +410,8 @@ def update_order(current_user, order_id):
             return jsonify({"success": False, "message": "Order not found"}), 404
 
         # Update allowed fields
+        if data.get('status') == 'cancelled':
+            cancel_order(order)
         allowed_fields = ['status', 'mpesa_phone_number', 'payment_method']
         for field in allowed_fields:
             if field in data:
@@ -349,12 +430,51 @@ def update_order(current_user, order_id):
         print(f"Error updating order: {str(e)}")
         return jsonify({"success": False, "message": str(e)}), 500
     
+# M-Pesa client and outbox metrics for this worker process
+@orders_bp.route("/admin/mpesa/metrics", methods=["GET"])
+@token_required
+def get_mpesa_metrics(current_user):
+    try:
+        if not current_user.role=="admin":
+            return jsonify({"success": False, "message": "Unauthorized"}), 403
+
+        return jsonify({
+            "success": True,
+            "mpesa": get_mpesa_service().get_metrics(),
+            "outbox": get_outbox_stats(),
+            "callbacks": get_callback_stats(),
+            "reconciler": get_reconciler_stats()
+        }), 200
+
+    except Exception as e:
+        print(f"Error fetching M-Pesa metrics: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@orders_bp.route("/admin/mpesa/reconcile", methods=["POST"])
+@token_required
+def run_mpesa_reconciliation(current_user):
+    try:
+        if not current_user.role=="admin":
+            return jsonify({"success": False, "message": "Unauthorized"}), 403
+
+        if not trigger_reconciliation():
+            return jsonify({"success": False, "message": "Reconciliation is disabled"}), 503
+
+        return jsonify({"success": True, "message": "Reconciliation sweep started"}), 202
+
+    except Exception as e:
+        print(f"Error triggering M-Pesa reconciliation: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
 @orders_bp.route("/dashboard", methods=["GET"])
 @token_required
 def get_dashboard_data(current_user):
     try:
-        # Get user's orders
-        user_orders = Order.query.filter_by(customer_id=current_user.id).all()
+        # Get user's orders, newest first, with items/products/customer batch-loaded
+        user_orders = Order.query.filter_by(customer_id=current_user.id)\
+                               .options(*Order.detail_options())\
+                               .order_by(Order.created_at.desc())\
+                               .all()
         
         # Calculate stats
         total_orders = len(user_orders)
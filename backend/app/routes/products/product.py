@@ -1,21 +1,28 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app
 from app import db
 from app.models.products import Product
 from app.models.User import User
-import jwt
-from functools import wraps
+from app.services.auth_service import token_required, admin_required
+from app.models.import_job import ImportJob
+from app.services.product_import import (
+    read_upload, upload_columns, missing_columns, import_new_products, upsert_products, catalogue_changed
+)
+from app.services.import_jobs import create_import_job, notify_import_runner
+from app.services.exports import product_rows, PRODUCT_COLUMNS
+from app.utils.export import export_response, EXPORT_FORMATS
+from app.utils.pagination import parse_limit, keyset_before, paginate_keyset, InvalidCursor
+from app.services.catalogue_version import get_catalogue_version
+from sqlalchemy import or_
+from sqlalchemy.orm import load_only
 from datetime import datetime, date
-import pandas as pd
+import hashlib
 import io
 import os
+import time
 from werkzeug.utils import secure_filename
 
 products_bp = Blueprint("products", __name__)
 
-# JWT configuration (should match login.py)
-JWT_SECRET_KEY = "super-secret-jwt"
-JWT_ALGORITHM = "HS256"
-
 # ========== HELPER FUNCTIONS ==========
 def allowed_file(filename):
     """Check if the file extension is allowed"""
@@ -48,41 +55,6 @@ def delete_product_image(filename):
         except Exception as e:
             print(f"Error deleting image file: {e}")
 
-# ========== TOKEN DECORATOR ==========
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = request.cookies.get("access_token")
-
-        if not token:
-            return jsonify({"success": False, "message": "Token is missing"}), 401
-
-        try:
-            data = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-            current_user = User.query.get(data["user_id"])
-            if not current_user:
-                return jsonify({"success": False, "message": "Invalid token"}), 401
-
-        except jwt.ExpiredSignatureError:
-            return jsonify({"success": False, "message": "Token has expired"}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({"success": False, "message": "Invalid token"}), 401
-
-        return f(current_user, *args, **kwargs)
-
-    return decorated
-
-# ========== ADMIN DECORATOR ==========
-def admin_required(f):
-    @wraps(f)
-    @token_required
-    def decorated(current_user, *args, **kwargs):
-        if current_user.role != "admin":
-            return jsonify({"success": False, "message": "Admin access required"}), 403
-        return f(current_user, *args, **kwargs)
-
-    return decorated
-
 # ========== HELPER FUNCTIONS ==========
 def parse_date(date_string):
     """Convert string to date object, return None if empty/invalid"""
@@ -93,28 +65,160 @@ def parse_date(date_string):
     except (ValueError, TypeError):
         return None
 
+def filter_products(query, args):
+    """category (repeat it for several), in_stock (true/false) and q (every word in name, SKU, description or category)"""
+    categories = [c for c in args.getlist("category") if c]
+    if categories:
+        query = query.filter(Product.category.in_(categories))
+
+    in_stock = args.get("in_stock", "").lower()
+    if in_stock in ("1", "true", "yes"):
+        query = query.filter(Product.stock > 0)
+    elif in_stock in ("0", "false", "no"):
+        query = query.filter(Product.stock <= 0)
+
+    for word in args.get("q", "").split():
+        term = "%" + word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        query = query.filter(or_(
+            Product.name.ilike(term, escape="\\"),
+            Product.sku.ilike(term, escape="\\"),
+            Product.description.ilike(term, escape="\\"),
+            Product.category.ilike(term, escape="\\")
+        ))
+    return query
+
+def catalogue_etag(resource, window=None):
+    """
+    Changes whenever the catalogue does; the query string is folded in so each filtered view has its own tag.
+    Stock isn't part of the catalogue version, so responses showing it also pass their stock window.
+    """
+    params = "&".join(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)))
+    digest = hashlib.sha1(f"{resource}?{params}".encode()).hexdigest()[:12]
+    if window is not None:
+        return f"{get_catalogue_version()}-{window}-{digest}"
+    return f"{get_catalogue_version()}-{digest}"
+
+def shows_stock(args, fields):
+    return fields is None or "stock" in fields or bool(args.get("in_stock"))
+
+def stock_window():
+    """(window number, seconds left in it) for PRODUCT_STOCK_MAX_AGE-long windows; stock may be this stale"""
+    max_age = current_app.config['PRODUCT_STOCK_MAX_AGE']
+    if max_age <= 0:
+        return time.time_ns(), None  # a new tag every time: never served from cache
+    now = time.time()
+    return int(now // max_age), max(1, int(max_age - now % max_age))
+
+def cacheable(response, etag, max_age=None):
+    response.set_etag(etag)
+    if max_age:
+        # Stock responses: reused until their window ends, then revalidated
+        response.headers["Cache-Control"] = f"private, max-age={max_age}"
+    else:
+        response.headers["Cache-Control"] = "private, no-cache"  # browsers revalidate with If-None-Match every time
+    return response
+
+def not_modified(etag, max_age=None):
+    return cacheable(Response(status=304), etag, max_age)
+
 # ========== ROUTES ==========
 
 # CORS Preflight Handler
 @products_bp.route("/products", methods=["OPTIONS"])
 @products_bp.route("/products/<int:id>", methods=["OPTIONS"])
 @products_bp.route("/products/bulk-upload", methods=["OPTIONS"])
+@products_bp.route("/products/export", methods=["OPTIONS"])
+@products_bp.route("/products/categories", methods=["OPTIONS"])
+@products_bp.route("/products/bulk-upload/jobs", methods=["OPTIONS"])
+@products_bp.route("/products/bulk-upload/jobs/<int:id>", methods=["OPTIONS"])
 def handle_options(id=None):
     return "", 200
 
-# GET all products
+# GET products: optionally paginated (limit, cursor) and filtered (category, in_stock, q), with sparse fields.
+# The ETag changes with the catalogue version, so an unchanged catalogue is answered 304 without loading a product.
+# Orders change stock without bumping the version; responses showing stock are cached for PRODUCT_STOCK_MAX_AGE.
 @products_bp.route("/products", methods=["GET"])
 @token_required
 def get_products(current_user):
     try:
-        products = Product.query.order_by(Product.created_at.desc()).all()
-        return jsonify({
+        args = request.args
+        fields = None
+        if args.get("fields"):
+            fields = [f.strip() for f in args["fields"].split(",") if f.strip()]
+            unknown = [f for f in fields if f not in Product.FIELD_COLUMNS]
+            if unknown:
+                return jsonify({"success": False, "message": f"Unknown fields: {', '.join(unknown)}"}), 400
+
+        window, max_age = stock_window() if shows_stock(args, fields) else (None, None)
+        etag = catalogue_etag("products", window)
+        if request.if_none_match.contains(etag):
+            return not_modified(etag, max_age)
+
+        query = filter_products(Product.query, args)
+        if fields:
+            columns = {"id", "created_at"}  # always loaded; the cursor is built from them
+            for field in fields:
+                columns.update(Product.FIELD_COLUMNS[field])
+            query = query.options(load_only(*(getattr(Product, c) for c in columns)))
+
+        if args.get("cursor"):
+            try:
+                query = query.filter(keyset_before(Product.created_at, Product.id, args["cursor"]))
+            except InvalidCursor:
+                return jsonify({"success": False, "message": "Invalid cursor"}), 400
+
+        query = query.order_by(Product.created_at.desc(), Product.id.desc())
+        # Without a limit the whole (filtered) catalogue is returned, as before
+        if args.get("limit"):
+            limit = parse_limit(args.get("limit"))
+            products, next_cursor = paginate_keyset(query, limit)
+        else:
+            limit = None
+            products, next_cursor = query.all(), None
+
+        response = jsonify({
             "success": True,
-            "products": [p.to_dict() for p in products]
-        }), 200
+            "products": [p.to_dict(fields) for p in products],
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
+            "limit": limit
+        })
+        return cacheable(response, etag, max_age), 200
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+# GET the distinct product categories, for filter menus
+@products_bp.route("/products/categories", methods=["GET"])
+@token_required
+def get_product_categories(current_user):
+    etag = catalogue_etag("categories")
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    categories = db.session.scalars(
+        db.select(Product.category)
+          .where(Product.category.isnot(None), Product.category != "")
+          .distinct()
+          .order_by(Product.category)
+    ).all()
+    return cacheable(jsonify({"success": True, "categories": categories}), etag), 200
+
+# EXPORT products as a streamed CSV/XLSX download (Admin only)
+@products_bp.route("/products/export", methods=["GET"])
+@admin_required
+def export_products(current_user):
+    file_format = request.args.get("format", "csv").lower()
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({"success": False, "message": "format must be 'csv' or 'xlsx'"}), 400
+
+    query = Product.query
+    if request.args.get("category"):
+        query = query.filter(Product.category == request.args["category"])
+
+    rows = product_rows(query, batch_size=current_app.config['EXPORT_BATCH_SIZE'])
+    filename = f"products_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
+    return export_response(PRODUCT_COLUMNS, rows, file_format, filename, sheet_name="Products")
+
 # CREATE product (Admin only) - UPDATED WITH CATEGORY
 @products_bp.route("/products", methods=["POST"])
 @admin_required
@@ -211,87 +315,46 @@ def bulk_upload_products(current_user):
         if file_extension not in allowed_extensions:
             return jsonify({"success": False, "message": "Invalid file type. Please upload CSV or Excel file."}), 400
 
+        # insert (default): existing SKUs are errors; upsert: refresh price/stock/etc. of existing SKUs
+        mode = request.form.get('mode') or request.args.get('mode') or 'insert'
+        if mode not in ('insert', 'upsert'):
+            return jsonify({"success": False, "message": "mode must be 'insert' or 'upsert'"}), 400
+
+        # background=true: queue the file for the import workers and answer with a job id to poll
+        background = (request.form.get('background') or request.args.get('background') or '').lower() in ('1', 'true', 'yes')
+        if background:
+            return queue_bulk_upload(current_user, file, file_extension, mode)
+
         # Read file based on extension
-        if file_extension == 'csv':
-            df = pd.read_csv(file)
-        else:  # Excel files
-            df = pd.read_excel(file)
+        df = read_upload(file, file_extension)
 
         # Validate required columns
-        required_columns = ['name', 'sku', 'unit', 'price', 'stock', 'threshold']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        
-        if missing_columns:
+        missing = missing_columns(df.columns)
+        if missing:
             return jsonify({
                 "success": False, 
-                "message": f"Missing required columns: {', '.join(missing_columns)}"
+                "message": f"Missing required columns: {', '.join(missing)}"
             }), 400
 
-        success_count = 0
-        error_count = 0
-        errors = []
+        if mode == 'upsert':
+            # Commits chunk by chunk itself
+            result = upsert_products(df)
+            return jsonify({
+                "success": True,
+                "message": f"Bulk upsert completed. Inserted: {result['inserted']}, Updated: {result['updated']}, Unchanged: {result['unchanged']}, Errors: {result['error_count']}",
+                **result
+            }), 200
 
-        # Process each row
-        for index, row in df.iterrows():
-            try:
-                # Skip empty rows
-                if pd.isna(row.get('name')) or pd.isna(row.get('sku')):
-                    continue
-
-                # Check if SKU already exists
-                existing_product = Product.query.filter_by(sku=str(row['sku'])).first()
-                if existing_product:
-                    errors.append(f"Row {index + 2}: SKU '{row['sku']}' already exists")
-                    error_count += 1
-                    continue
-
-                # Parse data with defaults
-                name = str(row['name']).strip()
-                sku = str(row['sku']).strip()
-                description = str(row['description']).strip() if 'description' in row and pd.notna(row['description']) else ""
-                category = str(row['category']).strip() if 'category' in row and pd.notna(row['category']) else ""  # Add category
-                unit = str(row['unit']).strip() if 'unit' in row and pd.notna(row['unit']) else "kg"
-                price = float(row['price']) if pd.notna(row['price']) else 0.0
-                stock = int(row['stock']) if pd.notna(row['stock']) else 0
-                threshold = int(row['threshold']) if pd.notna(row['threshold']) else 0
-                
-                # Handle expiry date
-                expiry_date = None
-                if 'expiry_date' in row and pd.notna(row['expiry_date']):
-                    try:
-                        if isinstance(row['expiry_date'], str):
-                            expiry_date = parse_date(row['expiry_date'])
-                        else:
-                            # Handle Excel date format
-                            expiry_date = row['expiry_date'].date() if hasattr(row['expiry_date'], 'date') else None
-                    except:
-                        expiry_date = None
-
-                # Create product (without image for bulk upload)
-                product = Product(
-                    name=name,
-                    sku=sku,
-                    description=description,
-                    category=category,  # Add category
-                    unit=unit,
-                    price=price,
-                    stock=stock,
-                    threshold=threshold,
-                    expiry_date=expiry_date
-                    # image_filename is not set in bulk upload
-                )
-                
-                db.session.add(product)
-                success_count += 1
-
-            except Exception as e:
-                errors.append(f"Row {index + 2}: {str(e)}")
-                error_count += 1
-                continue
+        # Validate and insert in bulk (see app/services/product_import.py)
+        result = import_new_products(df)
+        success_count = result['success_count']
+        error_count = result['error_count']
+        errors = result['errors']
 
         # Commit all successful products
         if success_count > 0:
             db.session.commit()
+            catalogue_changed()
 
         return jsonify({
             "success": True,
@@ -305,6 +368,66 @@ def bulk_upload_products(current_user):
         db.session.rollback()
         return jsonify({"success": False, "message": f"File processing error: {str(e)}"}), 500
     
+def queue_bulk_upload(current_user, file, file_extension, mode):
+    saved_path = None
+    queued = False
+    try:
+        job = create_import_job(
+            file,
+            secure_filename(file.filename) or f"upload.{file_extension}",
+            file_extension,
+            mode,
+            current_app.config['IMPORT_JOB_FOLDER'],
+            created_by=current_user.id
+        )
+        saved_path = job.file_path
+
+        # Only the header is read here; the rows are parsed by the worker
+        missing = missing_columns(upload_columns(saved_path, file_extension))
+        if missing:
+            return jsonify({
+                "success": False,
+                "message": f"Missing required columns: {', '.join(missing)}"
+            }), 400
+
+        db.session.commit()
+        queued = True
+    finally:
+        # Rejected, unreadable or not recorded: nothing will ever import the saved file
+        if not queued:
+            db.session.rollback()
+            if saved_path:
+                try:
+                    os.remove(saved_path)
+                except OSError:
+                    pass
+
+    notify_import_runner()
+    return jsonify({
+        "success": True,
+        "message": "Bulk upload queued",
+        "job_id": job.id,
+        "status_url": f"/api/products/bulk-upload/jobs/{job.id}",
+        "job": job.to_dict()
+    }), 202
+
+# GET background import progress (Admin only)
+@products_bp.route("/products/bulk-upload/jobs/<int:id>", methods=["GET"])
+@admin_required
+def get_import_job(current_user, id):
+    job = db.session.get(ImportJob, id)
+    if not job:
+        return jsonify({"success": False, "message": "Import job not found"}), 404
+    return jsonify({"success": True, "job": job.to_dict()}), 200
+
+# LIST recent background imports (Admin only)
+@products_bp.route("/products/bulk-upload/jobs", methods=["GET"])
+@admin_required
+def list_import_jobs(current_user):
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    jobs = ImportJob.query.order_by(ImportJob.created_at.desc()).limit(limit).all()
+    return jsonify({"success": True, "jobs": [job.to_dict(include_errors=False) for job in jobs]}), 200
+
 # UPDATE product (Admin only) - UPDATED WITH CATEGORY
 @products_bp.route("/products/<int:id>", methods=["PUT"])
 @admin_required
@@ -0,0 +1,211 @@
+from flask import request, jsonify
+from app import db
+from app.config import Config
+from app.models.User import User
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from collections import OrderedDict
+from functools import wraps
+import threading
+import time
+import jwt
+
+# JWT configuration (shared by every blueprint)
+JWT_SECRET_KEY = "super-secret-jwt"
+JWT_ALGORITHM = "HS256"
+JWT_EXPIRY_HOURS = 24
+
+# ========== TTL / LRU CACHE ==========
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a time-to-live"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0  # bumped by pop(); see set_unless_invalidated()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def set_unless_invalidated(self, key, value, seen_invalidations, ttl=None):
+        """
+        set(), unless something was popped since `seen_invalidations` was read:
+        the value may have been loaded before that change committed
+        """
+        with self._lock:
+            if self.invalidations != seen_invalidations:
+                return
+        self.set(key, value, ttl)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+# Decoded JWT payloads keyed by the raw token string
+token_cache = TTLCache(Config.AUTH_TOKEN_CACHE_SIZE, Config.AUTH_CACHE_TTL)
+# Column snapshots of User rows keyed by user id
+user_cache = TTLCache(Config.AUTH_USER_CACHE_SIZE, Config.AUTH_CACHE_TTL)
+
+_USER_COLUMNS = [column.key for column in User.__table__.columns]
+
+
+def decode_token(token):
+    """Decode a JWT, reusing the payload of a previously verified token"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+
+    # Never keep a token in the cache past its own expiry
+    ttl = token_cache.ttl
+    if 'exp' in payload:
+        ttl = payload['exp'] - time.time()
+    token_cache.set(token, payload, ttl)
+    return payload
+
+
+def get_user(user_id):
+    """Return the User for user_id attached to the current session, using the cache when possible"""
+    snapshot = user_cache.get(user_id)
+    if snapshot is None:
+        invalidations = user_cache.invalidations
+        user = db.session.get(User, user_id)
+        if user:
+            user_cache.set_unless_invalidated(user_id, {key: getattr(user, key) for key in _USER_COLUMNS},
+                                              invalidations)
+        return user
+
+    # Rebuild a clean detached instance and attach it without hitting the database
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def invalidate_user(user_id):
+    user_cache.pop(user_id)
+
+
+def get_cache_stats():
+    return {
+        "token_cache": token_cache.stats(),
+        "user_cache": user_cache.stats()
+    }
+
+
+# A changed user is dropped from the cache once the change commits; dropping it at flush time
+# would let a concurrent request cache the old row again before the commit landed
+@event.listens_for(User, "after_update")
+def _user_updated(mapper, connection, target):
+    _changed_users(target).add(target.id)
+
+
+@event.listens_for(User, "after_delete")
+def _user_deleted(mapper, connection, target):
+    _changed_users(target).add(target.id)
+
+
+def _changed_users(target):
+    return object_session(target).info.setdefault('changed_user_ids', set())
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_changed_users(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop('changed_user_ids', None)
+
+
+# ========== TOKEN DECORATOR ==========
+def token_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = request.cookies.get("access_token")
+
+        if not token:
+            return jsonify({"success": False, "message": "Token is missing"}), 401
+
+        try:
+            data = decode_token(token)
+            current_user = get_user(data["user_id"])
+            if not current_user:
+                return jsonify({"success": False, "message": "Invalid token"}), 401
+
+        except jwt.ExpiredSignatureError:
+            return jsonify({"success": False, "message": "Token has expired"}), 401
+        except jwt.InvalidTokenError:
+            return jsonify({"success": False, "message": "Invalid token"}), 401
+
+        if not current_user.is_active:
+            return jsonify({"success": False, "message": "Account is deactivated. Please contact support."}), 401
+
+        return f(current_user, *args, **kwargs)
+
+    return decorated
+
+# ========== ADMIN DECORATOR ==========
+def admin_required(f):
+    @wraps(f)
+    @token_required
+    def decorated(current_user, *args, **kwargs):
+        if current_user.role != "admin":
+            return jsonify({"success": False, "message": "Admin access required"}), 403
+        return f(current_user, *args, **kwargs)
+
+    return decorated
@@ -0,0 +1,80 @@
+"""
+Catalogue version counter behind the /api/products ETag.
+
+Any transaction that writes products bumps the counter once, just before it
+commits, so the new version becomes visible together with the change and
+the row lock on the counter is held only for the commit itself. ORM writes
+are noticed by session events; Core statements that bypass the ORM (bulk
+imports) call mark_catalogue_changed().
+
+Stock reserved and released by orders is left out: bumping the counter on
+every checkout would serialise them all on its row lock and invalidate
+every cached product list. Responses that show stock are instead cached
+for PRODUCT_STOCK_MAX_AGE seconds (see get_products).
+"""
+from app import db
+from app.models.catalogue_version import CatalogueVersion
+from app.models.products import Product
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+from datetime import datetime
+import itertools
+
+CATALOGUE_ROW_ID = 1
+
+
+def mark_catalogue_changed(session=None):
+    """Bump the version when the current transaction commits"""
+    (session or db.session).info['catalogue_changed'] = True
+
+
+def get_catalogue_version():
+    version = db.session.execute(
+        select(CatalogueVersion.version).where(CatalogueVersion.id == CATALOGUE_ROW_ID)
+    ).scalar()
+    return version or 0
+
+
+def _bump(session):
+    result = session.execute(
+        update(CatalogueVersion)
+        .where(CatalogueVersion.id == CATALOGUE_ROW_ID)
+        .values(version=CatalogueVersion.version + 1, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        session.execute(insert(CatalogueVersion).values(id=CATALOGUE_ROW_ID, version=1, updated_at=datetime.utcnow()))
+
+
+def _touches_products(session):
+    if any(isinstance(obj, Product) for obj in itertools.chain(session.new, session.deleted)):
+        return True
+    # A product is also dirty when only a relationship changed, e.g. OrderItem(product=...) appending to
+    # its order_items backref; that is no change to the catalogue
+    return any(isinstance(obj, Product) and session.is_modified(obj, include_collections=False)
+               for obj in session.dirty)
+
+
+# ========== SESSION EVENTS ==========
+@event.listens_for(Session, 'after_flush')
+def _note_product_writes(session, flush_context):
+    if _touches_products(session):
+        session.info['catalogue_changed'] = True
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_before_commit(session):
+    # Objects still pending here are flushed by this commit, after this event
+    if session.info.get('catalogue_changed') or _touches_products(session):
+        _bump(session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _clear_after_commit(session):
+    session.info.pop('catalogue_changed', None)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_product_writes(session, previous_transaction):
+    if not session.in_transaction():  # a rolled-back savepoint leaves the outer writes standing
+        session.info.pop('catalogue_changed', None)
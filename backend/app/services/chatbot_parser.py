@@ -0,0 +1,213 @@
+"""
+Order grammar for chatbot messages: pulls (quantity, product name) out of
+free text in English or Swahili.
+
+The grammars and stop-word tables are compiled once at import; stop words
+are stripped in a single pass with one combined regex per language. Parse
+throughput over a sample EN/SW corpus can be measured with:
+
+    python -m app.services.chatbot_parser --rounds 2000
+"""
+import argparse
+import re
+import time
+
+# (pattern, (quantity group, product group)), tried in order
+GRAMMARS = {
+    'en': [
+        # "I want 5 cooking oil"
+        (r'(?:i\s+want|i\s+need|give\s+me|order|buy|get)\s+(\d+)\s+(.+)', (1, 2)),
+        # "5 cooking oil"
+        (r'(\d+)\s+(.+)', (1, 2)),
+        # "cooking oil 5"
+        (r'(.+?)\s+(\d+)(?:\s|$)', (2, 1)),
+        # "I'd like 3 bags of rice"
+        (r'(?:i\'\s*d\s+like|i\s+would\s+like)\s+(\d+)\s+(.+)', (1, 2)),
+    ],
+    'sw': [
+        # "Nataka mafuta ya kupikia 5"
+        (r'(?:nataka|nahitaji|nipe|agiza|nunua|leta)\s+(.+?)\s+(\d+)', (2, 1)),
+        # "5 mafuta ya kupikia"
+        (r'(\d+)\s+(.+)', (1, 2)),
+        # "mafuta ya kupikia 5"
+        (r'(.+?)\s+(\d+)(?:\s|$)', (2, 1)),
+        # "Ningependa kupata 3 mchele"
+        (r'(?:ningependa|napenda)\s+(?:kupata|kuagiza)\s+(\d+)\s+(.+)', (1, 2)),
+    ]
+}
+
+# What customers put between items: "5 rice and 3 sugar", "mchele 5 na sukari 3"
+BASKET_SEPARATORS = {
+    'en': [',', ';', '&', '+', 'and', 'plus', 'also'],
+    'sw': [',', ';', '&', '+', 'na', 'pamoja na', 'pia', 'and']
+}
+
+# Filler around a reply to "How many?" or "Would you like 3 instead?": "ok send 5", "sawa nipe 3"
+FOLLOW_UP_WORDS = {
+    'en': ['ok', 'okay', 'yes', 'yeah', 'yep', 'sure', 'fine', 'alright', 'send', 'send me', 'give me',
+           'i want', 'i need', 'i will take', 'i\'ll take', 'take', 'make it', 'just', 'only', 'then',
+           'please', 'thanks', 'thank you', 'units', 'unit', 'pieces', 'pcs', 'of them'],
+    'sw': ['sawa', 'ndio', 'ndiyo', 'haya', 'tuma', 'nitumie', 'nipe', 'nataka', 'nahitaji', 'leta',
+           'tu', 'basi', 'tafadhali', 'asante', 'vipande']
+}
+AFFIRMATIVES = {
+    'en': {'ok', 'okay', 'yes', 'yeah', 'yep', 'sure', 'fine', 'alright'},
+    'sw': {'sawa', 'ndio', 'ndiyo', 'haya'}
+}
+
+STOP_WORDS = {
+    'en': ['please', 'thanks', 'thank you', 'i want', 'i need', 'give me', 'order', 'buy', 'get', 'of'],
+    'sw': ['tafadhali', 'asante', 'nataka', 'nahitaji', 'nipe', 'agiza', 'nunua', 'leta', 'ya']
+}
+
+
+def _compile_stop_words(words):
+    # Longest first, so "thank you" wins over a shorter alternative at the same spot
+    alternatives = '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+    return re.compile(r'\b(?:' + alternatives + r')\b', re.IGNORECASE)
+
+
+COMPILED_GRAMMARS = {
+    language: [(re.compile(pattern, re.IGNORECASE), groups) for pattern, groups in rules]
+    for language, rules in GRAMMARS.items()
+}
+STOP_WORD_RES = {language: _compile_stop_words(words) for language, words in STOP_WORDS.items()}
+FOLLOW_UP_RES = {language: _compile_stop_words(words) for language, words in FOLLOW_UP_WORDS.items()}
+WHITESPACE_RE = re.compile(r'\s+')
+PUNCTUATION_RE = re.compile(r'[^\w\s]')
+QUANTITY_RE = re.compile(r'\d+')
+
+
+def _compile_separators(separators):
+    # Words need word boundaries ("na" must not split "nanasi"), punctuation must not have them
+    words = sorted((sep for sep in separators if sep[0].isalpha()), key=len, reverse=True)
+    symbols = [sep for sep in separators if not sep[0].isalpha()]
+    alternatives = [re.escape(sep) for sep in symbols] + [r'\b' + re.escape(word) + r'\b' for word in words]
+    return re.compile(r'(\s*(?:' + '|'.join(alternatives) + r')\s*)', re.IGNORECASE)
+
+
+SEPARATOR_RES = {language: _compile_separators(words) for language, words in BASKET_SEPARATORS.items()}
+
+
+def clean_product_name(raw_name, language='en'):
+    stop_words = STOP_WORD_RES.get(language)
+    if stop_words is not None:
+        raw_name = stop_words.sub('', raw_name)
+    return WHITESPACE_RE.sub(' ', raw_name).strip()
+
+
+def parse_order(message, language='en'):
+    """
+    Yield every (quantity, product_name) reading of the message, one per
+    grammar rule that matches, in rule order. Callers stop at the first
+    reading whose product they can find.
+    """
+    text = message.lower().strip()
+    for pattern, (quantity_group, name_group) in COMPILED_GRAMMARS.get(language, COMPILED_GRAMMARS['en']):
+        match = pattern.search(text)
+        if not match:
+            continue
+        quantity = int(match.group(quantity_group))
+        if quantity <= 0:
+            continue
+        product_name = clean_product_name(match.group(name_group).strip(), language)
+        if product_name:
+            yield quantity, product_name
+
+
+def parse_follow_up(message, language='en'):
+    """
+    Read a reply to a question the bot asked about one product. Returns
+    (quantity or None, agreed) when the message is only a number and/or
+    filler such as "ok send 3" or "sawa", or None when it says anything
+    else and has to be parsed as a new request.
+    """
+    text = message.lower()
+    agreed = bool(AFFIRMATIVES.get(language, AFFIRMATIVES['en']) & set(PUNCTUATION_RE.sub(' ', text).split()))
+    rest = PUNCTUATION_RE.sub(' ', FOLLOW_UP_RES.get(language, FOLLOW_UP_RES['en']).sub(' ', text)).split()
+    if len(rest) > 1 or (rest and not rest[0].isdigit()):
+        return None
+    quantity = int(rest[0]) if rest else None
+    if (quantity is None and not agreed) or quantity == 0:
+        return None
+    return quantity, agreed
+
+
+def split_basket(message, language='en'):
+    """
+    Split a message listing several items into one segment per item. A
+    piece without a quantity stays joined to its neighbour, so names such
+    as "salt and vinegar crisps" survive. Messages with fewer than two
+    quantities come back as a single segment.
+    """
+    text = message.lower().strip()
+    if len(QUANTITY_RE.findall(text)) < 2:
+        return [text]
+
+    parts = SEPARATOR_RES.get(language, SEPARATOR_RES['en']).split(text)
+    segments = [parts[0]]
+    for separator, piece in zip(parts[1::2], parts[2::2]):
+        if not piece.strip():
+            continue
+        if QUANTITY_RE.search(piece) and QUANTITY_RE.search(segments[-1]):
+            segments.append(piece)
+        else:
+            segments[-1] += separator + piece
+    return [segment.strip() for segment in segments if segment.strip()]
+
+
+# ========== BENCHMARK ==========
+CORPUS = [
+    ('I want 5 cooking oil', 'en'),
+    ('5 rice please', 'en'),
+    ('sugar 2', 'en'),
+    ("I'd like 3 bags of rice", 'en'),
+    ('give me 10 bread thank you', 'en'),
+    ('can I get 4 packets of maize flour please', 'en'),
+    ('order 12 bars of soap', 'en'),
+    ('i need 1 tray of eggs thanks', 'en'),
+    ('do you have milk?', 'en'),
+    ('Nataka mafuta ya kupikia 5', 'sw'),
+    ('5 mafuta ya kupikia', 'sw'),
+    ('mchele 3 tafadhali', 'sw'),
+    ('Ningependa kupata 3 mchele', 'sw'),
+    ('nipe sukari 2 asante', 'sw'),
+    ('nahitaji unga wa ngano 4', 'sw'),
+    ('leta maziwa 6 tafadhali', 'sw'),
+    ('napenda kuagiza 2 sabuni', 'sw'),
+    ('una chai?', 'sw'),
+    ('5 rice and 3 sugar and 2 cooking oil', 'en'),
+    ('nataka mchele 5 na sukari 3, mafuta 2', 'sw'),
+]
+
+
+def benchmark(corpus=CORPUS, rounds=1000):
+    """Parse the corpus `rounds` times; returns throughput figures"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message, language in corpus:
+            for segment in split_basket(message, language):
+                next(parse_order(segment, language), None)
+    elapsed = time.perf_counter() - start
+    parsed = rounds * len(corpus)
+    return {
+        'messages': parsed,
+        'seconds': round(elapsed, 4),
+        'messages_per_second': round(parsed / elapsed) if elapsed else None,
+        'microseconds_per_message': round(elapsed / parsed * 1e6, 2)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chatbot order parser throughput over an EN/SW corpus")
+    parser.add_argument("--rounds", type=int, default=1000)
+    parser.add_argument("--corpus-file", help="one 'language<TAB>message' per line (default: built-in corpus)")
+    args = parser.parse_args()
+
+    corpus = CORPUS
+    if args.corpus_file:
+        with open(args.corpus_file, encoding='utf-8') as f:
+            corpus = [tuple(reversed(line.rstrip('\n').split('\t', 1))) for line in f if '\t' in line]
+
+    for name, value in benchmark(corpus, args.rounds).items():
+        print(f"{name}: {value}")
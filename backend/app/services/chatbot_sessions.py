@@ -0,0 +1,112 @@
+"""
+Short-lived chatbot conversation state per user.
+
+When the bot asks a question ("How many would you like?", "Would you like
+3 instead?") it remembers what it asked about, so a follow-up such as "5"
+or "ok send 3" resolves against that product instead of being parsed
+from scratch. Likewise a "yes" to "Shall I proceed with ordering ...?"
+confirms the remembered suggestion. A session is a small JSON-safe dict:
+
+    {'language': 'sw',
+     'pending': {'product_id': 7, 'reason': 'need_quantity'},
+     'last_suggestion': {'product_id': 7, 'quantity': 3}}
+
+where a basket suggestion is {'items': [{'product_id': 7, 'quantity': 3}, ...]}.
+
+Sessions lapse CHATBOT_SESSION_TTL seconds after their last update.
+CHATBOT_SESSION_STORE_URL chooses where they live: empty for this process
+only, or redis://... (needs the `redis` package) to share them between
+processes.
+"""
+import json
+import threading
+import time
+
+
+class MemorySessionStore:
+    """Sessions for a single process; expired ones are dropped on read and swept on write"""
+
+    def __init__(self):
+        self._sessions = {}  # key -> (expires_at, state)
+        self._lock = threading.Lock()
+        self._next_sweep = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._sessions[key]
+                return None
+            return entry[1]
+
+    def set(self, key, state, ttl):
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[key] = (now + ttl, state)
+            if now >= self._next_sweep:
+                self._sessions = {k: v for k, v in self._sessions.items() if v[0] > now}
+                self._next_sweep = now + ttl
+
+    def delete(self, key):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class RedisSessionStore:
+    """Sessions shared through Redis, one key per user with a Redis-side expiry"""
+
+    def __init__(self, url, prefix='chatbot:session'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CHATBOT_SESSION_STORE_URL points at Redis but the `redis` package is not installed")
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def get(self, key):
+        value = self.redis.get(self._key(key))
+        return json.loads(value) if value else None
+
+    def set(self, key, state, ttl):
+        self.redis.set(self._key(key), json.dumps(state), ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        self.redis.delete(self._key(key))
+
+
+class ChatbotSessions:
+    def __init__(self, store, ttl=600):
+        self.store = store
+        self.ttl = ttl
+
+    def get(self, user_id):
+        return self.store.get(str(user_id)) or {}
+
+    def update(self, user_id, **changes):
+        """Merge changes into the user's session (None removes a field) and restart its TTL"""
+        state = dict(self.get(user_id))
+        for field, value in changes.items():
+            if value is None:
+                state.pop(field, None)
+            else:
+                state[field] = value
+        self.store.set(str(user_id), state, self.ttl)
+        return state
+
+    def clear(self, user_id):
+        self.store.delete(str(user_id))
+
+
+def create_session_store(url):
+    if url and url.startswith(('redis://', 'rediss://')):
+        return RedisSessionStore(url)
+    return MemorySessionStore()
@@ -0,0 +1,101 @@
+"""
+Row sources for the product and order exports (see app/utils/export.py).
+
+Both read their main table through a server-side cursor (yield_per), one
+batch of rows at a time. For orders, each batch's items, with their
+products, and its customers are fetched with one IN query apiece.
+Nothing is kept from one batch to the next, so an export of a million
+orders uses no more memory than one of a thousand.
+"""
+from app import db
+from app.models.Order import Order, OrderItem
+from app.models.products import Product
+from app.models.User import User
+from sqlalchemy import select
+
+EXPORT_BATCH_SIZE = 1000
+
+# Same names as the bulk-upload columns, so an export can be edited and uploaded again
+PRODUCT_COLUMNS = ['id', 'name', 'sku', 'description', 'category', 'unit', 'price', 'stock',
+                   'threshold', 'expiry_date', 'image_url', 'created_at']
+
+# One row per order item; an order without items gets one row with the item columns empty
+ORDER_COLUMNS = ['order_id', 'created_at', 'status', 'payment_method', 'total_amount', 'total_quantity',
+                 'customer_id', 'customer_name', 'customer_email', 'customer_phone',
+                 'mpesa_phone_number', 'mpesa_checkout_request_id', 'mpesa_result_code', 'mpesa_receipt_number',
+                 'item_id', 'product_id', 'product', 'sku', 'quantity', 'price', 'subtotal']
+
+
+def product_rows(query=None, batch_size=EXPORT_BATCH_SIZE):
+    """PRODUCT_COLUMNS values for every product in `query` (default: the whole catalogue), oldest first"""
+    query = query if query is not None else Product.query
+    statement = query.with_entities(
+        Product.id, Product.name, Product.sku, Product.description, Product.category, Product.unit,
+        Product.price, Product.stock, Product.threshold, Product.expiry_date, Product.image_filename,
+        Product.created_at
+    ).order_by(Product.id).statement
+
+    for row in db.session.execute(statement, execution_options={'yield_per': batch_size}):
+        image_url = f"/static/uploads/products/{row.image_filename}" if row.image_filename else None
+        yield [row.id, row.name, row.sku, row.description, row.category, row.unit, row.price, row.stock,
+               row.threshold, _iso(row.expiry_date), image_url, _iso(row.created_at)]
+
+
+def order_rows(query=None, batch_size=EXPORT_BATCH_SIZE):
+    """ORDER_COLUMNS values for every order in `query` (default: all orders), newest first"""
+    query = query if query is not None else Order.query
+    statement = query.with_entities(
+        Order.id, Order.created_at, Order.status, Order.payment_method, Order.total_amount,
+        Order.total_quantity, Order.customer_id, Order.mpesa_phone_number,
+        Order.mpesa_checkout_request_id, Order.mpesa_result_code, Order.mpesa_receipt_number
+    ).order_by(Order.created_at.desc(), Order.id.desc()).statement
+
+    result = db.session.execute(statement, execution_options={'yield_per': batch_size})
+    for orders in result.partitions():
+        items = _items_by_order([order.id for order in orders])
+        customers = _customers({order.customer_id for order in orders})
+
+        for order in orders:
+            customer = customers.get(order.customer_id)
+            head = [
+                order.id, _iso(order.created_at), order.status, order.payment_method, order.total_amount,
+                order.total_quantity, order.customer_id,
+                f"{customer.first_name} {customer.last_name}" if customer else None,
+                customer.email if customer else None,
+                customer.phone_number if customer else None,
+                order.mpesa_phone_number, order.mpesa_checkout_request_id, order.mpesa_result_code,
+                order.mpesa_receipt_number
+            ]
+            order_items = items.get(order.id)
+            if not order_items:
+                yield head + [None] * 6
+                continue
+            for item in order_items:
+                yield head + [item.id, item.product_id, item.name, item.sku, item.quantity, item.price,
+                              item.price * item.quantity]
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _items_by_order(order_ids):
+    items = {}
+    rows = db.session.execute(
+        select(OrderItem.order_id, OrderItem.id, OrderItem.product_id, OrderItem.quantity, OrderItem.price,
+               Product.name, Product.sku)
+        .outerjoin(Product, OrderItem.product_id == Product.id)
+        .where(OrderItem.order_id.in_(order_ids))
+        .order_by(OrderItem.order_id, OrderItem.id)
+    )
+    for row in rows:
+        items.setdefault(row.order_id, []).append(row)
+    return items
+
+
+def _customers(customer_ids):
+    rows = db.session.execute(
+        select(User.id, User.first_name, User.last_name, User.email, User.phone_number)
+        .where(User.id.in_(customer_ids))
+    )
+    return {row.id: row for row in rows}
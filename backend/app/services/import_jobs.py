@@ -0,0 +1,287 @@
+"""
+Background bulk product imports.
+
+POST /api/products/bulk-upload with background=true saves the file, records
+an ImportJob row and returns at once. A runner in each process claims
+queued jobs and streams the file in IMPORT_CHUNK_SIZE chunks (see
+iter_upload_chunks); every chunk's products are committed in the same
+transaction as the job's progress counters. A job whose process dies is
+claimed again once its lease lapses and resumes after the last committed
+chunk, so no row is imported twice.
+
+Uploads are saved to IMPORT_JOB_FOLDER on the host that received them.
+Unless IMPORT_JOB_SHARED_FOLDER says that folder is shared storage (an NFS
+or similar mount seen at the same path by every host), a runner only claims
+jobs saved on its own host, so a job waits for a runner on that host.
+
+A SKU repeated in a later chunk than its first appearance is checked
+against the catalogue rather than the file: in insert mode it is reported
+as already existing, in upsert mode it updates the earlier row.
+"""
+from app import db
+from app.models.import_job import ImportJob
+from app.services.product_import import iter_upload_chunks, import_chunk, catalogue_changed
+from sqlalchemy import and_, or_, update
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import json
+import os
+import socket
+import threading
+import time
+
+COUNTERS = ('rows_processed', 'inserted', 'updated', 'unchanged', 'error_count', 'processing_seconds')
+
+
+def create_import_job(file, filename, file_type, mode, folder, created_by=None):
+    """Save the upload under `folder` and queue a job for it; the caller commits"""
+    job = ImportJob(filename=filename, file_type=file_type, mode=mode, file_path='',
+                    host=socket.gethostname(), created_by=created_by)
+    db.session.add(job)
+    db.session.flush()
+
+    job.file_path = os.path.join(folder, f"import_{job.id}.{file_type}")
+    try:
+        file.save(job.file_path)
+    except Exception:
+        # Don't leave a partial file behind
+        if os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        raise
+    return job
+
+
+class ImportJobRunner:
+    """Claims queued import jobs and runs them on a thread pool"""
+
+    def __init__(self, app, workers=2, chunk_size=5000, poll_interval=2.0,
+                 lease_seconds=300, max_attempts=3, max_errors=1000, shared_folder=False):
+        self.app = app
+        # With a host-local folder only this host can read the files it saved
+        self.host = None if shared_folder else socket.gethostname()
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.max_errors = max_errors
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="import-job")
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._thread = None
+        self.stats = {"completed": 0, "failed": 0, "chunks": 0}
+
+    # ---------- lifecycle ----------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="import-job-runner", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._stopped.set()
+        self._wakeup.set()
+        self._executor.shutdown(wait=wait)
+
+    def notify(self):
+        """Wake the runner early, e.g. right after a job is queued"""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            with self._lock:
+                free_slots = self.workers - self._busy
+
+            claimed = []
+            if free_slots > 0:
+                try:
+                    with self.app.app_context():
+                        claimed = self._claim(free_slots)
+                except Exception as e:
+                    print(f"Import job claim error: {str(e)}")
+
+            for job_id in claimed:
+                with self._lock:
+                    self._busy += 1
+                self._executor.submit(self._run_slot, job_id)
+
+            if not claimed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _run_slot(self, job_id):
+        try:
+            self.run(job_id)
+        finally:
+            with self._lock:
+                self._busy -= 1
+            self._wakeup.set()
+
+    # ---------- claiming ----------
+    def _claimable(self, now):
+        stale_lock = now - timedelta(seconds=self.lease_seconds)
+        claimable = or_(
+            ImportJob.status == "queued",
+            # Jobs whose process died mid-import
+            and_(ImportJob.status == "running", ImportJob.locked_at < stale_lock)
+        )
+        if self.host:
+            claimable = and_(claimable, or_(ImportJob.host == self.host, ImportJob.host.is_(None)))
+        return claimable
+
+    def _claim(self, limit):
+        """Atomically flip up to `limit` claimable jobs to running; safe across processes"""
+        now = datetime.utcnow()
+        candidate_ids = [
+            job_id for (job_id,) in db.session.query(ImportJob.id)
+                                              .filter(self._claimable(now))
+                                              .order_by(ImportJob.created_at)
+                                              .limit(limit)
+        ]
+
+        claimed = []
+        for job_id in candidate_ids:
+            result = db.session.execute(
+                update(ImportJob)
+                .where(ImportJob.id == job_id, self._claimable(now))
+                .values(status="running", locked_at=now, attempts=ImportJob.attempts + 1,
+                        started_at=db.func.coalesce(ImportJob.started_at, now))
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                claimed.append(job_id)
+        db.session.commit()
+        return claimed
+
+    # ---------- running ----------
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def run(self, job_id):
+        with self.app.app_context():
+            try:
+                job = db.session.get(ImportJob, job_id)
+                if not job or job.status != "running":
+                    return
+                if job.attempts > self.max_attempts:
+                    self._finish(job, "failed", f"Gave up after {self.max_attempts} attempts")
+                    return
+
+                progress = {key: getattr(job, key) for key in COUNTERS}
+                errors = job.error_messages()
+                path, file_type, mode = job.file_path, job.file_type, job.mode
+                db.session.rollback()
+
+                chunks = iter_upload_chunks(path, file_type, self.chunk_size, skip_rows=progress['rows_processed'])
+                for chunk in chunks:
+                    if not self._import(job_id, chunk, mode, progress, errors):
+                        chunks.close()
+                        print(f"Import job {job_id} was claimed by another worker; stopping here")
+                        return
+
+                job = db.session.get(ImportJob, job_id)
+                self._finish(job, "completed", (
+                    f"Imported {progress['rows_processed']} rows. Inserted: {progress['inserted']}, "
+                    f"Updated: {progress['updated']}, Unchanged: {progress['unchanged']}, "
+                    f"Errors: {progress['error_count']}"
+                ))
+
+            except Exception as e:
+                db.session.rollback()
+                print(f"Import job {job_id} error: {str(e)}")
+                job = db.session.get(ImportJob, job_id)
+                if job and job.status == "running":
+                    self._finish(job, "failed", f"Import failed: {str(e)}"[:255])
+
+    def _import(self, job_id, chunk, mode, progress, errors):
+        """
+        Import one chunk and advance the job's counters in the same
+        transaction. Returns False, writing nothing, when the job's progress
+        no longer matches what this worker last committed.
+        """
+        started = time.perf_counter()
+        try:
+            result = import_chunk(chunk, mode)
+        except Exception as e:
+            db.session.rollback()
+            first_row = chunk.index[0] + 2
+            result = {
+                'inserted': 0, 'updated': 0, 'unchanged': 0,
+                'errors': [f"Rows {first_row}-{first_row + len(chunk) - 1}: not saved ({str(e).splitlines()[0]})"],
+                'failed_rows': len(chunk)
+            }
+
+        new_errors = result['errors'][:max(0, self.max_errors - len(errors))]
+        changes = {
+            'rows_processed': progress['rows_processed'] + len(chunk),
+            'inserted': progress['inserted'] + result['inserted'],
+            'updated': progress['updated'] + result['updated'],
+            'unchanged': progress['unchanged'] + result['unchanged'],
+            'error_count': progress['error_count'] + result.get('failed_rows', len(result['errors'])),
+            'processing_seconds': progress['processing_seconds'] + time.perf_counter() - started,
+        }
+        values = dict(changes, locked_at=datetime.utcnow())
+        if new_errors:
+            values['errors'] = json.dumps(errors + new_errors)
+
+        saved = db.session.execute(
+            update(ImportJob)
+            .where(ImportJob.id == job_id, ImportJob.status == "running",
+                   ImportJob.rows_processed == progress['rows_processed'])
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if saved.rowcount != 1:
+            db.session.rollback()
+            return False
+        db.session.commit()
+
+        if result['inserted'] or result['updated']:
+            catalogue_changed()
+        progress.update(changes)
+        errors.extend(new_errors)
+        self._count("chunks")
+        return True
+
+    def _finish(self, job, status, message):
+        job.status = status
+        job.message = message
+        job.locked_at = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        self._count(status)
+        try:
+            os.remove(job.file_path)
+        except OSError:
+            pass
+
+
+# ========== PROCESS-WIDE RUNNER ==========
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def start_import_runner(app):
+    """Start this process's import runner once, however many times create_app() runs"""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = ImportJobRunner(
+                app,
+                workers=app.config['IMPORT_JOB_WORKERS'],
+                chunk_size=app.config['IMPORT_CHUNK_SIZE'],
+                poll_interval=app.config['IMPORT_JOB_POLL_INTERVAL'],
+                lease_seconds=app.config['IMPORT_JOB_LEASE_SECONDS'],
+                max_attempts=app.config['IMPORT_JOB_MAX_ATTEMPTS'],
+                max_errors=app.config['IMPORT_JOB_MAX_ERRORS'],
+                shared_folder=app.config['IMPORT_JOB_SHARED_FOLDER']
+            )
+            _runner.start()
+    return _runner
+
+
+def notify_import_runner():
+    if _runner is not None:
+        _runner.notify()
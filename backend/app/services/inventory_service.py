@@ -0,0 +1,93 @@
+from app import db
+from app.models.products import Product
+from sqlalchemy import case
+
+
+class StockError(Exception):
+    """Raised when a basket cannot be reserved; carries the HTTP status to return"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def _basket_quantities(items):
+    """Collapse line items into {product_id: total quantity}"""
+    quantities = {}
+    for item in items:
+        try:
+            product_id = int(item['product_id'])
+            quantity = int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise StockError("Each item needs a numeric product_id and quantity")
+        if quantity <= 0:
+            raise StockError(f"Quantity must be positive for product {product_id}")
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def reserve_stock(items):
+    """
+    Reserve stock for a whole basket inside the caller's transaction.
+
+    All referenced products are fetched with one IN (...) query, row-locked
+    with SELECT ... FOR UPDATE where the database supports it (SQLAlchemy
+    drops the clause on SQLite), then decremented by a single guarded
+    UPDATE. The guard (stock >= requested) makes the decrement atomic on
+    every backend, so concurrent checkouts cannot oversell; if it touches
+    fewer rows than expected the basket is rejected. The caller commits or
+    rolls back. Returns {product_id: Product}.
+    """
+    quantities = _basket_quantities(items)
+    if not quantities:
+        raise StockError("Order has no items")
+
+    # Lock in primary-key order so concurrent baskets cannot deadlock
+    product_ids = sorted(quantities)
+    products = {
+        product.id: product
+        for product in Product.query.filter(Product.id.in_(product_ids))
+                                    .order_by(Product.id)
+                                    .with_for_update()
+    }
+
+    for product_id in product_ids:
+        product = products.get(product_id)
+        if not product:
+            raise StockError(f"Product not found: {product_id}", 404)
+        if product.stock < quantities[product_id]:
+            raise StockError(f"Insufficient stock for {product.name}")
+
+    table = Product.__table__
+    requested = case(quantities, value=table.c.id)
+    result = db.session.execute(
+        table.update()
+             .where(table.c.id.in_(product_ids), table.c.stock >= requested)
+             .values(stock=table.c.stock - requested)
+    )
+    if result.rowcount != len(product_ids):
+        raise StockError("Stock changed while placing your order. Please try again.", 409)
+
+    # The loaded rows now hold the pre-reservation stock; reload it on next access
+    for product in products.values():
+        db.session.expire(product, ['stock'])
+
+    return products
+
+
+def release_stock(orders):
+    """Return the reserved stock of cancelled orders with a single UPDATE"""
+    quantities = {}
+    for order in orders:
+        for item in order.items:
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    if not quantities:
+        return
+
+    table = Product.__table__
+    db.session.execute(
+        table.update()
+             .where(table.c.id.in_(list(quantities)))
+             .values(stock=table.c.stock + case(quantities, value=table.c.id))
+    )
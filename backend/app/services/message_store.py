@@ -0,0 +1,490 @@
+from app import db
+from app.models.messages import Conversation, ConversationParticipant, Message
+from app.models.User import User
+from app.services.auth_service import TTLCache
+from app.utils.pagination import encode_cursor, keyset_after, keyset_before
+from sqlalchemy import case, update
+from concurrent.futures import Future
+from datetime import datetime
+import queue
+import threading
+import time
+
+# Participants that are not rows in the users table
+DEFAULT_PROFILES = {
+    'customer_1': {'id': 'customer_1', 'name': 'Sarah Johnson', 'avatar': 'SJ', 'user_type': 'customer'},
+    'retailer_1': {'id': 'retailer_1', 'name': 'Tech Store', 'avatar': 'TS', 'user_type': 'retailer'},
+    'ai_support': {'id': 'ai_support', 'name': 'AI Assistant', 'avatar': 'AI', 'user_type': 'ai'},
+}
+
+profile_cache = TTLCache(maxsize=10000, ttl=300)
+
+
+class ConversationNotFound(LookupError):
+    pass
+
+
+class InvalidMessage(ValueError):
+    pass
+
+
+def check_message(sender_id, content):
+    """Raise InvalidMessage unless there is a sender and some text to send"""
+    if sender_id is None or str(sender_id).strip() == '':
+        raise InvalidMessage("sender_id is required")
+    if not isinstance(content, str) or not content.strip():
+        raise InvalidMessage("content is required")
+
+
+def parse_id(value, prefix=''):
+    """Accept 12, "12" or "<prefix>12" (the old in-memory ids); None if it isn't one"""
+    value = str(value)
+    if prefix and value.startswith(prefix):
+        value = value[len(prefix):]
+    return int(value) if value.isdigit() else None
+
+
+def conversation_room(conversation_id):
+    """Socket.IO room for a conversation, the same whichever id form the client used"""
+    pk = parse_id(conversation_id, 'conv_')
+    return f"conversation_{pk}" if pk is not None else str(conversation_id)
+
+
+# ========== PROFILES ==========
+def _unknown_profile(user_id):
+    return {'id': user_id, 'name': 'Unknown User', 'avatar': 'UU', 'user_type': 'customer'}
+
+
+def get_profiles(user_ids):
+    """Resolve display profiles for many participants with at most one users query"""
+    profiles = {}
+    missing = []
+    for user_id in set(str(uid) for uid in user_ids if uid is not None):
+        if user_id in DEFAULT_PROFILES:
+            profiles[user_id] = DEFAULT_PROFILES[user_id]
+            continue
+        cached = profile_cache.get(user_id)
+        if cached is not None:
+            profiles[user_id] = cached
+        elif user_id.isdigit():
+            missing.append(int(user_id))
+        else:
+            profiles[user_id] = _unknown_profile(user_id)
+
+    if missing:
+        rows = db.session.query(User.id, User.first_name, User.last_name, User.role)\
+                         .filter(User.id.in_(missing)).all()
+        for user_id, first_name, last_name, role in rows:
+            profile = {
+                'id': str(user_id),
+                'name': f"{first_name} {last_name}",
+                'avatar': f"{first_name[:1]}{last_name[:1]}".upper(),
+                'user_type': 'retailer' if role == 'admin' else 'customer'
+            }
+            profile_cache.set(str(user_id), profile)
+            profiles[str(user_id)] = profile
+        for user_id in missing:
+            profiles.setdefault(str(user_id), _unknown_profile(str(user_id)))
+
+    return profiles
+
+
+def get_profile(user_id):
+    return get_profiles([user_id])[str(user_id)]
+
+
+# ========== CONVERSATIONS ==========
+def create_conversation(participant_ids, title):
+    participant_ids = list(dict.fromkeys(str(pid) for pid in participant_ids))
+    now = datetime.utcnow()
+    conversation = Conversation(
+        title=title,
+        conversation_type='direct' if len(participant_ids) == 2 else 'group',
+        created_at=now,
+        timestamp=now,
+        unread_count=0,
+        participants=[ConversationParticipant(user_id=pid, last_message_at=now) for pid in participant_ids]
+    )
+    db.session.add(conversation)
+    db.session.commit()
+    return conversation
+
+
+def get_inbox_page(user_id, limit, cursor=None):
+    """
+    One page of a user's inbox, most recently active first. The page is a
+    single seek on idx_participant_inbox (user_id, last_message_at,
+    conversation_id); the other participants of just those conversations
+    come from one IN query. Returns (rows, participants, next_cursor) where
+    rows are (ConversationParticipant, Conversation) pairs.
+    """
+    inbox = ConversationParticipant
+    query = db.session.query(inbox, Conversation)\
+        .join(Conversation, Conversation.id == inbox.conversation_id)\
+        .filter(inbox.user_id == str(user_id))
+    if cursor:
+        query = query.filter(keyset_before(inbox.last_message_at, inbox.conversation_id, cursor))
+    rows = query.order_by(inbox.last_message_at.desc(), inbox.conversation_id.desc())\
+                .limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1][0]
+        next_cursor = encode_cursor(last.last_message_at, last.conversation_id)
+    if not rows:
+        return [], {}, None
+
+    participants = {}
+    members = db.session.query(inbox.conversation_id, inbox.user_id)\
+                        .filter(inbox.conversation_id.in_([conv.id for _, conv in rows]))
+    for conversation_id, participant_id in members:
+        participants.setdefault(conversation_id, []).append(participant_id)
+    return rows, participants, next_cursor
+
+
+def get_history_page(conversation_id, limit, before=None, after=None):
+    """
+    One page of a conversation's history in send order, read from the
+    (conversation_id, timestamp) index. Without a cursor this is the newest
+    page; `before` walks back to older messages, `after` forward to newer
+    ones. Returns (messages, has_more) where has_more is in the direction
+    being walked. Raises InvalidCursor for a malformed cursor.
+    """
+    query = Message.query.filter(Message.conversation_id == conversation_id)
+    if after:
+        query = query.filter(keyset_after(Message.timestamp, Message.id, after))\
+                     .order_by(Message.timestamp, Message.id)
+    else:
+        if before:
+            query = query.filter(keyset_before(Message.timestamp, Message.id, before))
+        query = query.order_by(Message.timestamp.desc(), Message.id.desc())
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not after:
+        rows.reverse()
+    return rows, has_more
+
+
+def serialize_messages(messages):
+    profiles = get_profiles([m.sender_id for m in messages])
+    return [m.to_dict(sender=profiles[m.sender_id]) for m in messages]
+
+
+def _unread_after(conversation_id, user_id, boundary):
+    """Messages from others newer than `boundary`, as a scalar subquery"""
+    return db.session.query(db.func.count(Message.id))\
+        .filter(
+            Message.conversation_id == conversation_id,
+            db.or_(Message.timestamp > boundary.timestamp,
+                   db.and_(Message.timestamp == boundary.timestamp, Message.id > boundary.id)),
+            Message.sender_id != user_id
+        ).scalar_subquery()
+
+
+def mark_read_up_to(user_id, message_ids):
+    """
+    Mark everything other participants sent up to and including each given
+    message as read by `user_id`. The messages are fetched by primary key in
+    one query; each conversation then gets a single range UPDATE on the
+    (conversation_id, timestamp) index, and its unread counters are
+    adjusted. Returns one receipt per conversation.
+    """
+    user_id = str(user_id)
+    boundaries = {}
+    for msg in Message.query.filter(Message.id.in_(message_ids)):
+        current = boundaries.get(msg.conversation_id)
+        if current is None or (msg.timestamp, msg.id) > (current.timestamp, current.id):
+            boundaries[msg.conversation_id] = msg
+
+    receipts = []
+    for conversation_id, boundary in boundaries.items():
+        result = db.session.execute(
+            update(Message)
+            .where(
+                Message.conversation_id == conversation_id,
+                db.or_(Message.timestamp < boundary.timestamp,
+                       db.and_(Message.timestamp == boundary.timestamp, Message.id <= boundary.id)),
+                Message.sender_id != user_id,
+                Message.read.is_(False)
+            )
+            .values(read=True)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            _decrement_conversation_unread(conversation_id, result.rowcount)
+        # The reader's own counter becomes whatever arrived after what they have read
+        db.session.execute(
+            update(ConversationParticipant)
+            .where(ConversationParticipant.conversation_id == conversation_id,
+                   ConversationParticipant.user_id == user_id)
+            .values(unread_count=_unread_after(conversation_id, user_id, boundary),
+                    last_read_message_id=boundary.id)
+            .execution_options(synchronize_session=False)
+        )
+        receipts.append({
+            'conversation_id': conversation_id,
+            'message_id': boundary.id,
+            'count': result.rowcount
+        })
+    db.session.commit()
+    return receipts
+
+
+def mark_one_read(user_id, msg):
+    """Read receipt for a single message; the caller commits"""
+    msg.read = True
+    _decrement_conversation_unread(msg.conversation_id, 1)
+    participant = ConversationParticipant
+    db.session.execute(
+        update(participant)
+        .where(participant.conversation_id == msg.conversation_id,
+               participant.user_id == str(user_id),
+               participant.unread_count > 0)
+        .values(unread_count=participant.unread_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _decrement_conversation_unread(conversation_id, amount):
+    db.session.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(unread_count=case((Conversation.unread_count > amount, Conversation.unread_count - amount), else_=0))
+        .execution_options(synchronize_session=False)
+    )
+
+
+# ========== WRITE PATH ==========
+class MessageWriter:
+    """
+    Group-commits messages from concurrent senders.
+
+    Senders get a Future; a single writer thread drains whatever is queued
+    (up to `batch_size`, waiting at most `max_wait` for a burst to build
+    up), inserts it with one flush, bumps each conversation's last message
+    with one UPDATE and commits once. If the batch can't be saved it is
+    retried one message at a time, so only the messages at fault fail.
+    Every `prune_every` writes to a conversation its history is trimmed to
+    the newest `retention` rows.
+    """
+
+    def __init__(self, app, batch_size=100, max_wait=0.01, retention=5000, prune_every=100, queue_size=10000):
+        self.app = app
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.retention = retention
+        self.prune_every = prune_every
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._since_prune = {}  # conversation id -> writes since last prune; writer thread only
+        self._lock = threading.Lock()
+        self.stats = {'messages': 0, 'batches': 0, 'pruned': 0, 'errors': 0}
+        self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, conversation_id, sender_id, content, message_type='text'):
+        """Queue a message; the Future resolves to its to_dict() once committed"""
+        future = Future()
+        self._queue.put((future, {
+            'conversation_id': conversation_id,
+            'sender_id': str(sender_id),
+            'content': content,
+            'message_type': message_type or 'text',
+            'timestamp': datetime.utcnow()
+        }))
+        return future
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            with self.app.app_context():
+                self._write(batch)
+
+    def _write(self, batch):
+        try:
+            self._flush(batch)
+        except Exception as e:
+            db.session.rollback()
+            pending = [item for item in batch if not item[0].done()]
+            if len(pending) > 1:
+                for item in pending:
+                    self._write([item])
+                return
+            self._count('errors')
+            print(f"Error writing messages: {str(e)}")
+            for future, _ in pending:
+                future.set_exception(e)
+
+    def _flush(self, batch):
+        conversation_ids = {fields['conversation_id'] for _, fields in batch}
+        existing = {
+            cid for (cid,) in db.session.query(Conversation.id).filter(Conversation.id.in_(conversation_ids))
+        }
+
+        accepted = []
+        for future, fields in batch:
+            if fields['conversation_id'] in existing:
+                accepted.append((future, fields))
+            else:
+                future.set_exception(ConversationNotFound("Conversation not found"))
+        if not accepted:
+            return
+
+        profiles = get_profiles([fields['sender_id'] for _, fields in accepted])
+        rows = [
+            Message(sender_type=profiles[fields['sender_id']]['user_type'], read=False, **fields)
+            for _, fields in accepted
+        ]
+        db.session.add_all(rows)
+        db.session.flush()
+
+        self._update_inboxes(rows)
+
+        results = [row.to_dict(sender=profiles[row.sender_id]) for row in rows]
+        db.session.commit()
+
+        for (future, _), result in zip(accepted, results):
+            future.set_result(result)
+        self._count('messages', len(rows))
+        self._count('batches')
+
+        self._prune([row.conversation_id for row in rows])
+
+    def _update_inboxes(self, rows):
+        """Fold a batch into the conversation previews and every participant's inbox row"""
+        latest = {}
+        per_conversation = {}
+        per_sender = {}
+        for row in rows:
+            latest[row.conversation_id] = row
+            per_conversation[row.conversation_id] = per_conversation.get(row.conversation_id, 0) + 1
+            key = (row.conversation_id, row.sender_id)
+            per_sender[key] = per_sender.get(key, 0) + 1
+        conversation_ids = list(latest)
+
+        # Newest message per conversation becomes its preview
+        db.session.execute(
+            update(Conversation)
+            .where(Conversation.id.in_(conversation_ids))
+            .values(
+                last_message=case({cid: m.content for cid, m in latest.items()}, value=Conversation.id),
+                timestamp=case({cid: m.timestamp for cid, m in latest.items()}, value=Conversation.id),
+                unread_count=db.func.coalesce(Conversation.unread_count, 0)
+                             + case(per_conversation, value=Conversation.id)
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+        # Everyone gets the batch as unread except for what they sent themselves
+        participant = ConversationParticipant
+        own_messages = case(
+            *[(db.and_(participant.conversation_id == cid, participant.user_id == sender), count)
+              for (cid, sender), count in per_sender.items()],
+            else_=0
+        )
+        db.session.execute(
+            update(participant)
+            .where(participant.conversation_id.in_(conversation_ids))
+            .values(
+                last_message_at=case({cid: m.timestamp for cid, m in latest.items()}, value=participant.conversation_id),
+                unread_count=participant.unread_count
+                             + case(per_conversation, value=participant.conversation_id)
+                             - own_messages
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    def _prune(self, conversation_ids):
+        if not self.retention:
+            return
+        due = []
+        for cid in conversation_ids:
+            self._since_prune[cid] = self._since_prune.get(cid, 0) + 1
+            if self._since_prune[cid] >= self.prune_every:
+                self._since_prune[cid] = 0
+                due.append(cid)
+
+        for cid in set(due):
+            # The oldest message we keep, found by walking the (conversation_id, timestamp) index
+            boundary = db.session.query(Message.timestamp, Message.id)\
+                                 .filter(Message.conversation_id == cid)\
+                                 .order_by(Message.timestamp.desc(), Message.id.desc())\
+                                 .offset(self.retention - 1).limit(1).first()
+            if boundary is None:
+                continue
+            older = db.and_(
+                Message.conversation_id == cid,
+                db.or_(Message.timestamp < boundary.timestamp,
+                       db.and_(Message.timestamp == boundary.timestamp, Message.id < boundary.id))
+            )
+            unread = db.session.query(db.func.count(Message.id)).filter(older, Message.read.is_(False)).scalar()
+            result = db.session.execute(Message.__table__.delete().where(older))
+            if unread:
+                _decrement_conversation_unread(cid, unread)
+            if result.rowcount:
+                self._trim_participant_unread(cid)
+            self._count('pruned', result.rowcount)
+        if due:
+            db.session.commit()
+
+    def _trim_participant_unread(self, conversation_id):
+        """
+        A participant's unread messages are the newest ones from others, so
+        pruning the oldest only removed some of them if fewer than that remain
+        """
+        participant = ConversationParticipant
+        remaining = db.session.query(db.func.count(Message.id))\
+            .filter(Message.conversation_id == conversation_id, Message.sender_id != participant.user_id)\
+            .correlate(participant).scalar_subquery()
+        db.session.execute(
+            update(participant)
+            .where(participant.conversation_id == conversation_id, participant.unread_count > remaining)
+            .values(unread_count=remaining)
+            .execution_options(synchronize_session=False)
+        )
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_message_writer(app):
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = MessageWriter(
+                app,
+                batch_size=app.config['MESSAGE_WRITE_BATCH_SIZE'],
+                max_wait=app.config['MESSAGE_WRITE_MAX_WAIT'],
+                retention=app.config['MESSAGE_RETENTION_PER_CONVERSATION'],
+                prune_every=app.config['MESSAGE_PRUNE_EVERY']
+            )
+    return _writer
+
+
+def store_message(app, conversation_id, sender_id, content, message_type='text', timeout=10):
+    """Persist one message through the batching writer and return its to_dict()"""
+    return get_message_writer(app).submit(conversation_id, sender_id, content, message_type).result(timeout)
@@ -0,0 +1,312 @@
+"""
+Background STK pushes.
+
+Checkout writes an MpesaOutbox row in the order's transaction, and a pool
+of workers sends the pushes once the order is committed. A push is only
+retried when Daraja says it was rejected. After a timeout, a dropped
+connection or a worker dying mid-dispatch, the customer may already have
+the prompt, so the entry is parked as `unknown` rather than pushed again.
+Every push carries the order id in its CallBackURL; when that push's result
+callback arrives, settlement adopts its CheckoutRequestID and the
+reconciler confirms the payment with STK Query (see mpesa_settlement.py).
+Unknown entries that hear nothing within `unknown_expiry` are failed.
+"""
+from app import db
+from app.models.mpesa_outbox import MpesaOutbox
+from app.services.inventory_service import release_stock
+from app.services.mpesa_service import get_mpesa_service
+from sqlalchemy import and_, or_, update
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import random
+import threading
+import time
+
+MAX_BACKOFF_SECONDS = 600
+RECORD_ATTEMPTS = 3
+
+
+def callback_url_for(base_url, order_id):
+    """The push's CallBackURL: identifies the order even if we never saw the CheckoutRequestID"""
+    return f"{base_url}{'&' if '?' in base_url else '?'}order={order_id}"
+
+
+def enqueue_stk_push(order, phone_number, amount, account_reference, transaction_desc):
+    """
+    Record an STK push in the caller's transaction. The outbox worker sends it
+    after the order is committed, so no HTTP call happens inside the request.
+    """
+    entry = MpesaOutbox(
+        order=order,
+        phone_number=phone_number,
+        amount=amount,
+        account_reference=account_reference,
+        transaction_desc=transaction_desc
+    )
+    db.session.add(entry)
+    return entry
+
+
+class OutboxDispatcher:
+    """Claims due outbox rows and performs their STK pushes on a thread pool"""
+
+    def __init__(self, app, workers=4, poll_interval=2.0, max_attempts=5,
+                 backoff_seconds=5, lease_seconds=300, unknown_expiry=900, mpesa_service=None):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.lease_seconds = lease_seconds
+        self.unknown_expiry = unknown_expiry
+        self.mpesa = mpesa_service or get_mpesa_service()
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mpesa-outbox")
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._thread = None
+        self.stats = {"sent": 0, "retried": 0, "failed": 0, "unknown": 0, "expired": 0}
+
+    # ---------- lifecycle ----------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="mpesa-outbox-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._stopped.set()
+        self._wakeup.set()
+        self._executor.shutdown(wait=wait)
+
+    def notify(self):
+        """Wake the dispatcher early, e.g. right after an order commits"""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            with self._lock:
+                free_slots = self.workers - self._busy
+
+            claimed = []
+            if free_slots > 0:
+                try:
+                    with self.app.app_context():
+                        claimed = self._claim(free_slots)
+                except Exception as e:
+                    print(f"Outbox claim error: {str(e)}")
+
+            for entry_id in claimed:
+                with self._lock:
+                    self._busy += 1
+                self._executor.submit(self._dispatch_slot, entry_id)
+
+            if not claimed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _dispatch_slot(self, entry_id):
+        try:
+            self.dispatch(entry_id)
+        finally:
+            with self._lock:
+                self._busy -= 1
+            self._wakeup.set()
+
+    def process_due(self, limit=100):
+        """Claim and send due entries synchronously in the calling thread; returns how many ran"""
+        with self.app.app_context():
+            claimed = self._claim(limit)
+        for entry_id in claimed:
+            self.dispatch(entry_id)
+        return len(claimed)
+
+    # ---------- claiming ----------
+    def _claimable(self, now):
+        return and_(MpesaOutbox.status == "pending", MpesaOutbox.next_attempt_at <= now)
+
+    def _park_interrupted(self, now):
+        """
+        Rows whose worker died mid-dispatch may have had their push accepted,
+        so they become `unknown` instead of being claimed and pushed again
+        """
+        stale_lock = now - timedelta(seconds=self.lease_seconds)
+        result = db.session.execute(
+            update(MpesaOutbox)
+            .where(MpesaOutbox.status == "in_progress", MpesaOutbox.locked_at < stale_lock)
+            .values(status="unknown", locked_at=None, updated_at=now,
+                    last_error="Dispatch interrupted; STK push outcome unknown")
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            self._count("unknown", result.rowcount)
+
+    def _expire_unknown(self, now):
+        """Fail unknown pushes whose result never arrived, cancelling their orders"""
+        expired_before = now - timedelta(seconds=self.unknown_expiry)
+        entries = MpesaOutbox.query.filter(MpesaOutbox.status == "unknown",
+                                           MpesaOutbox.updated_at < expired_before)\
+                                   .limit(100).all()
+        for entry in entries:
+            entry.status = "failed"
+            self._cancel_order(entry.order, "STK push outcome unknown and no result arrived")
+            self._count("expired")
+
+    def _claim(self, limit):
+        """Atomically flip up to `limit` due rows to in_progress; safe across processes"""
+        now = datetime.utcnow()
+        self._park_interrupted(now)
+        self._expire_unknown(now)
+        db.session.commit()
+
+        candidate_ids = [
+            entry_id for (entry_id,) in db.session.query(MpesaOutbox.id)
+                                                  .filter(self._claimable(now))
+                                                  .order_by(MpesaOutbox.next_attempt_at)
+                                                  .limit(limit)
+        ]
+
+        claimed = []
+        for entry_id in candidate_ids:
+            result = db.session.execute(
+                update(MpesaOutbox)
+                .where(MpesaOutbox.id == entry_id, self._claimable(now))
+                .values(status="in_progress", locked_at=now, attempts=MpesaOutbox.attempts + 1)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                claimed.append(entry_id)
+        db.session.commit()
+        return claimed
+
+    # ---------- dispatch ----------
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def dispatch(self, entry_id):
+        with self.app.app_context():
+            try:
+                entry = db.session.get(MpesaOutbox, entry_id)
+                if not entry or entry.status != "in_progress":
+                    return
+                request_args = {
+                    "phone_number": entry.phone_number,
+                    "amount": entry.amount,
+                    "account_reference": entry.account_reference,
+                    "transaction_desc": entry.transaction_desc,
+                    "callback_url": callback_url_for(self.mpesa.callback_url, entry.order_id)
+                }
+                # Release the DB connection while the (slow) Daraja call is in flight
+                db.session.rollback()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Outbox dispatch error for entry {entry_id}: {str(e)}")
+                return
+
+            stk_response, error = self.mpesa.stk_push(**request_args)
+
+            # Once Daraja has answered, its answer must be saved: pushing
+            # again would prompt the customer twice
+            for attempt in range(1, RECORD_ATTEMPTS + 1):
+                try:
+                    entry = db.session.get(MpesaOutbox, entry_id)
+                    if not error:
+                        self._record_response(entry, stk_response)
+                    elif getattr(error, "maybe_accepted", False):
+                        self._park_unknown(entry, error)
+                    else:
+                        self._retry_or_fail(entry, error)
+                    db.session.commit()
+                    return
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Outbox dispatch error for entry {entry_id} (attempt {attempt}): {str(e)}")
+                    time.sleep(attempt)
+            # Still in_progress: once the lease lapses it is parked as unknown
+
+    def _record_response(self, entry, stk_response):
+        order = entry.order
+        if stk_response:
+            order.mpesa_merchant_request_id = stk_response.get('MerchantRequestID')
+            order.mpesa_checkout_request_id = stk_response.get('CheckoutRequestID')
+            order.mpesa_response_code = stk_response.get('ResponseCode')
+
+            # If STK Push was initiated successfully, mark as processing
+            if stk_response.get('ResponseCode') == '0' and order.status == 'pending':
+                order.status = 'processing'
+
+        entry.status = "sent"
+        entry.locked_at = None
+        entry.last_error = None
+        self._count("sent")
+
+    def _park_unknown(self, entry, error):
+        """The push may have been accepted; wait for its callback rather than retrying"""
+        entry.status = "unknown"
+        entry.last_error = str(error)[:255]
+        entry.locked_at = None
+        self._count("unknown")
+
+    def _cancel_order(self, order, reason):
+        if order.status == 'pending':
+            order.status = 'cancelled'
+            order.mpesa_result_desc = reason[:255]
+            release_stock([order])
+
+    def _retry_or_fail(self, entry, error):
+        """Daraja rejected the push, so no prompt was sent: back off and push again"""
+        entry.last_error = str(error)[:255]
+        entry.locked_at = None
+
+        if entry.attempts >= self.max_attempts:
+            entry.status = "failed"
+            self._cancel_order(entry.order, f"STK push failed: {entry.last_error}")
+            self._count("failed")
+            return
+
+        # Exponential backoff with jitter so retries after an outage don't stampede
+        delay = min(self.backoff_seconds * 2 ** (entry.attempts - 1), MAX_BACKOFF_SECONDS)
+        delay *= random.uniform(0.8, 1.2)
+        entry.status = "pending"
+        entry.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        self._count("retried")
+
+
+# ========== PROCESS-WIDE DISPATCHER ==========
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def start_outbox_dispatcher(app):
+    """Start this process's dispatcher once, however many times create_app() runs"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = OutboxDispatcher(
+                app,
+                workers=app.config['MPESA_OUTBOX_WORKERS'],
+                poll_interval=app.config['MPESA_OUTBOX_POLL_INTERVAL'],
+                max_attempts=app.config['MPESA_OUTBOX_MAX_ATTEMPTS'],
+                backoff_seconds=app.config['MPESA_OUTBOX_BACKOFF_SECONDS'],
+                unknown_expiry=app.config['MPESA_OUTBOX_UNKNOWN_EXPIRY']
+            )
+            _dispatcher.start()
+    return _dispatcher
+
+
+def notify_outbox():
+    if _dispatcher is not None:
+        _dispatcher.notify()
+
+
+def get_outbox_stats():
+    """Dispatcher counters for this process plus the queue depth by status"""
+    counts = dict(
+        db.session.query(MpesaOutbox.status, db.func.count(MpesaOutbox.id))
+                  .group_by(MpesaOutbox.status)
+                  .all()
+    )
+    stats = dict(_dispatcher.stats) if _dispatcher is not None else {}
+    stats["queue"] = counts
+    return stats
@@ -0,0 +1,246 @@
+from app import db
+from app.models.Order import Order
+from app.services.mpesa_service import get_mpesa_service
+from app.services.mpesa_settlement import settle_results
+from app.utils.pagination import encode_cursor, keyset_after
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import threading
+import time
+
+# Daraja answers STK Query with this error until the customer has responded
+STILL_PROCESSING = "being processed"
+
+
+class RateLimiter:
+    """
+    Token bucket shared by one process's query workers; acquire() blocks
+    until a slot is free. Processes do not share it, so start_reconciler()
+    gives each one its share of the overall rate.
+    """
+
+    def __init__(self, rate_per_second, burst=None):
+        self.rate = float(rate_per_second)
+        self.capacity = float(burst or max(1, rate_per_second))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class StkReconciler:
+    """
+    Periodically settles orders whose STK result callback never arrived.
+
+    Each sweep walks the stale `processing` orders that have a checkout id
+    but no result code in (created_at, id) order, `batch_size` at a time,
+    queries Daraja for each with at most `concurrency` requests in flight
+    and `rate_per_second` from this process, and applies the final results
+    in bulk through the same idempotent path as the callback endpoint.
+    """
+
+    def __init__(self, app, batch_size=100, concurrency=4, rate_per_second=5,
+                 stale_after=120, interval=60, mpesa_service=None):
+        self.app = app
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.stale_after = stale_after
+        self.interval = interval
+        self.mpesa = mpesa_service or get_mpesa_service()
+        self.limiter = RateLimiter(rate_per_second, burst=min(concurrency, max(1, rate_per_second)))
+
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="mpesa-reconcile")
+        self._sweep_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {
+            "sweeps": 0, "checked": 0, "settled": 0, "still_pending": 0, "errors": 0,
+            "running": False, "last_started_at": None, "last_finished_at": None,
+            "last_duration_seconds": None, "last_sweep": None, "progress": None
+        }
+
+    # ---------- lifecycle ----------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="mpesa-reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._stopped.set()
+        self._wakeup.set()
+        self._executor.shutdown(wait=wait)
+
+    def trigger(self):
+        """Run a sweep now instead of waiting for the next interval"""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"STK reconciliation sweep error: {str(e)}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    # ---------- selection ----------
+    def _stale_filter(self, cutoff):
+        return [
+            Order.status == 'processing',
+            Order.mpesa_checkout_request_id.isnot(None),
+            Order.mpesa_result_code.is_(None),
+            Order.created_at <= cutoff
+        ]
+
+    def _next_batch(self, cutoff, cursor):
+        query = db.session.query(Order.id, Order.created_at, Order.mpesa_checkout_request_id)\
+                          .filter(*self._stale_filter(cutoff))
+        if cursor:
+            query = query.filter(keyset_after(Order.created_at, Order.id, cursor))
+        return query.order_by(Order.created_at, Order.id).limit(self.batch_size).all()
+
+    # ---------- querying ----------
+    def _query(self, checkout_request_id):
+        """STK Query one checkout id; returns a settle_results() entry, 'pending' or 'error'"""
+        self.limiter.acquire()
+        data, error = self.mpesa.stk_query(checkout_request_id)
+        if error:
+            return "pending" if STILL_PROCESSING in str(error).lower() else "error"
+        if data.get('ResultCode') is None:
+            return "pending"
+        return {
+            'checkout_request_id': checkout_request_id,
+            'merchant_request_id': data.get('MerchantRequestID'),
+            'result_code': str(data['ResultCode']),
+            'result_desc': str(data.get('ResultDesc', ''))[:255],
+            'receipt_number': None
+        }
+
+    # ---------- sweeping ----------
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _set(self, **values):
+        with self._lock:
+            self.stats.update(values)
+
+    def sweep(self):
+        """Reconcile every order that was stale when the sweep started; returns the sweep's counts"""
+        if not self._sweep_lock.acquire(blocking=False):
+            return None
+        try:
+            started = datetime.utcnow()
+            cutoff = started - timedelta(seconds=self.stale_after)
+            totals = {"checked": 0, "settled": 0, "still_pending": 0, "errors": 0}
+            self._set(running=True, last_started_at=started.isoformat(), progress=dict(totals))
+
+            cursor = None
+            while not self._stopped.is_set():
+                with self.app.app_context():
+                    batch = self._next_batch(cutoff, cursor)
+                    db.session.rollback()  # don't hold a connection during the HTTP calls
+                if not batch:
+                    break
+                cursor = encode_cursor(batch[-1].created_at, batch[-1].id)
+
+                outcomes = list(self._executor.map(self._query, [row.mpesa_checkout_request_id for row in batch]))
+                final = [outcome for outcome in outcomes if isinstance(outcome, dict)]
+                settled = 0
+                if final:
+                    with self.app.app_context():
+                        try:
+                            counts, _ = settle_results(final)
+                            settled = counts['settled']
+                        except Exception as e:
+                            db.session.rollback()
+                            print(f"Error settling reconciled STK results: {str(e)}")
+
+                batch_counts = {
+                    "checked": len(batch),
+                    "settled": settled,
+                    "still_pending": outcomes.count("pending"),
+                    "errors": outcomes.count("error")
+                }
+                for key, amount in batch_counts.items():
+                    totals[key] += amount
+                    self._count(key, amount)
+                self._set(progress=dict(totals))
+
+                if len(batch) < self.batch_size:
+                    break
+
+            finished = datetime.utcnow()
+            self._set(
+                running=False, progress=None, last_sweep=totals,
+                last_finished_at=finished.isoformat(),
+                last_duration_seconds=round((finished - started).total_seconds(), 3)
+            )
+            self._count("sweeps")
+            return totals
+        finally:
+            self._sweep_lock.release()
+
+    def get_stats(self):
+        """Counters plus the current backlog of stale orders and how far behind the oldest is"""
+        with self._lock:
+            stats = dict(self.stats)
+        now = datetime.utcnow()
+        backlog, oldest = db.session.query(db.func.count(Order.id), db.func.min(Order.created_at))\
+                                    .filter(*self._stale_filter(now - timedelta(seconds=self.stale_after)))\
+                                    .one()
+        stats["backlog"] = backlog
+        stats["lag_seconds"] = int((now - oldest).total_seconds()) if oldest else 0
+        return stats
+
+
+# ========== PROCESS-WIDE RECONCILER ==========
+_reconciler = None
+_reconciler_lock = threading.Lock()
+
+
+def start_reconciler(app):
+    """
+    Start this process's sweeper once, however many times create_app() runs.
+    MPESA_RECONCILE_RATE is the limit for the whole deployment, so each of
+    the MPESA_RECONCILE_PROCESSES sweepers queries at its share of it.
+    """
+    global _reconciler
+    with _reconciler_lock:
+        if _reconciler is None:
+            _reconciler = StkReconciler(
+                app,
+                batch_size=app.config['MPESA_RECONCILE_BATCH_SIZE'],
+                concurrency=app.config['MPESA_RECONCILE_CONCURRENCY'],
+                rate_per_second=app.config['MPESA_RECONCILE_RATE'] / max(1, app.config['MPESA_RECONCILE_PROCESSES']),
+                stale_after=app.config['MPESA_RECONCILE_STALE_AFTER'],
+                interval=app.config['MPESA_RECONCILE_INTERVAL']
+            )
+            _reconciler.start()
+    return _reconciler
+
+
+def trigger_reconciliation():
+    """Wake the sweeper; False if it is not running in this process"""
+    if _reconciler is None:
+        return False
+    _reconciler.trigger()
+    return True
+
+
+def get_reconciler_stats():
+    return _reconciler.get_stats() if _reconciler is not None else {}
@@ -1,69 +1,161 @@
 import requests
+from requests.adapters import HTTPAdapter
 import base64
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+import hmac
 import json
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Refresh the OAuth token this many seconds before Daraja says it expires
+TOKEN_REFRESH_MARGIN = 60
+HTTP_POOL_SIZE = int(os.getenv('MPESA_HTTP_POOL_SIZE', 10))
+# Gateway errors that can come back after Daraja has already acted on the request
+AMBIGUOUS_STATUS_CODES = (502, 503, 504)
+
+class MpesaError(str):
+    """
+    Error message returned by MpesaService calls. `maybe_accepted` is True
+    when the request may have reached Daraja and been acted on (a read
+    timeout, a dropped connection, a gateway error), so sending it again
+    could duplicate it.
+    """
+
+    def __new__(cls, message, maybe_accepted=False):
+        error = super().__new__(cls, message)
+        error.maybe_accepted = maybe_accepted
+        return error
+
 class MpesaService:
     def __init__(self):
         self.consumer_key = os.getenv('MPESA_CONSUMER_KEY', 'your_consumer_key_here')
         self.consumer_secret = os.getenv('MPESA_CONSUMER_SECRET', 'your_consumer_secret_here')
         self.business_shortcode = os.getenv('MPESA_BUSINESS_SHORTCODE', '174379')
         self.passkey = os.getenv('MPESA_PASSKEY', 'your_passkey_here')
-        self.callback_url = os.getenv('MPESA_CALLBACK_URL', 'https://yourdomain.com/api/mpesa-callback')
+        # Daraja cannot sign callbacks, so their URL carries a secret path segment instead
+        self.callback_token = os.getenv('MPESA_CALLBACK_TOKEN', '')
+        self.callback_url = os.getenv('MPESA_CALLBACK_URL', 'https://yourdomain.com/api/mpesa-callback').rstrip('/')
+        if self.callback_token:
+            self.callback_url = f"{self.callback_url}/{self.callback_token}"
         self.environment = os.getenv('MPESA_ENVIRONMENT', 'sandbox')  # sandbox or production
+        self.timeout = float(os.getenv('MPESA_HTTP_TIMEOUT', 30))  # seconds per Daraja request
         
-        if self.environment == 'sandbox':
+        if os.getenv('MPESA_BASE_URL'):
+            # e.g. a local fake Daraja server (tests/fake_daraja.py)
+            self.base_url = os.getenv('MPESA_BASE_URL').rstrip('/')
+        elif self.environment == 'sandbox':
             self.base_url = 'https://sandbox.safaricom.co.ke'
         else:
             self.base_url = 'https://api.safaricom.co.ke'
+        
+        # Keep-alive connection pool shared by every call made through this instance
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE)
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+        
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self.metrics = {
+            'token_fetches': 0,
+            'token_fetch_failures': 0,
+            'token_reuses': 0,
+            'stk_push_requests': 0,
+            'stk_query_requests': 0
+        }
     
-    def get_access_token(self):
-        """Get M-Pesa access token"""
-        try:
-            url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
-            auth_string = f"{self.consumer_key}:{self.consumer_secret}"
-            encoded_auth = base64.b64encode(auth_string.encode()).decode()
-            
-            headers = {
-                'Authorization': f'Basic {encoded_auth}'
-            }
-            
-            response = requests.get(url, headers=headers, timeout=30)
-            response.raise_for_status()
+    def callback_token_valid(self, token):
+        """Callbacks must present MPESA_CALLBACK_TOKEN; with none configured only the sandbox takes them"""
+        if not self.callback_token:
+            return self.environment == 'sandbox'
+        return hmac.compare_digest((token or '').encode(), self.callback_token.encode())
+    
+    def _count(self, key):
+        with self._metrics_lock:
+            self.metrics[key] += 1
+    
+    def get_metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        metrics['token_valid_for_seconds'] = max(0, int(self._token_expires_at - time.monotonic())) if self._token else 0
+        return metrics
+    
+    def _fetch_access_token(self):
+        """Request a new OAuth token from Daraja; returns (token, expires_in)"""
+        url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
+        auth_string = f"{self.consumer_key}:{self.consumer_secret}"
+        encoded_auth = base64.b64encode(auth_string.encode()).decode()
+        
+        headers = {
+            'Authorization': f'Basic {encoded_auth}'
+        }
+        
+        response = self.http.get(url, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        
+        data = response.json()
+        return data.get('access_token'), int(data.get('expires_in', 3599))
+    
+    def get_access_token(self, force_refresh=False):
+        """Get M-Pesa access token, reusing the cached one until shortly before it expires"""
+        if not force_refresh and self._token and time.monotonic() < self._token_expires_at:
+            self._count('token_reuses')
+            return self._token
+        
+        # Only one caller refreshes; the others wait and reuse its token
+        with self._token_lock:
+            if not force_refresh and self._token and time.monotonic() < self._token_expires_at:
+                self._count('token_reuses')
+                return self._token
             
-            data = response.json()
-            return data.get('access_token')
+            try:
+                token, expires_in = self._fetch_access_token()
+                self._count('token_fetches')
+            except Exception as e:
+                self._count('token_fetch_failures')
+                print(f"Error getting access token: {str(e)}")
+                return None
             
-        except Exception as e:
-            print(f"Error getting access token: {str(e)}")
-            return None
+            if token:
+                margin = min(TOKEN_REFRESH_MARGIN, expires_in // 10)
+                self._token = token
+                self._token_expires_at = time.monotonic() + expires_in - margin
+            return token
+    
+    def _password(self, timestamp):
+        return base64.b64encode(
+            f"{self.business_shortcode}{self.passkey}{timestamp}".encode()
+        ).decode()
     
-    def stk_push(self, phone_number, amount, account_reference, transaction_desc):
-        """Initiate STK Push"""
+    def stk_push(self, phone_number, amount, account_reference, transaction_desc, callback_url=None):
+        """
+        Initiate STK Push. Errors are MpesaError; only those without
+        maybe_accepted prove that no prompt was sent and are safe to retry.
+        """
         try:
             access_token = self.get_access_token()
             if not access_token:
-                return None, "Failed to get access token"
+                return None, MpesaError("Failed to get access token")
             
             timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            password = base64.b64encode(
-                f"{self.business_shortcode}{self.passkey}{timestamp}".encode()
-            ).decode()
             
             payload = {
                 "BusinessShortCode": self.business_shortcode,
-                "Password": password,
+                "Password": self._password(timestamp),
                 "Timestamp": timestamp,
                 "TransactionType": "CustomerPayBillOnline",
                 "Amount": amount,
                 "PartyA": phone_number,
                 "PartyB": self.business_shortcode,
                 "PhoneNumber": phone_number,
-                "CallBackURL": self.callback_url,
+                "CallBackURL": callback_url or self.callback_url,
                 "AccountReference": account_reference,
                 "TransactionDesc": transaction_desc
             }
@@ -74,14 +166,88 @@ class MpesaService:
                 'Content-Type': 'application/json'
             }
             
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            self._count('stk_push_requests')
+            response = self.http.post(url, json=payload, headers=headers, timeout=self.timeout)
+            
+            # A token revoked early on Safaricom's side: refresh once and retry
+            if response.status_code == 401:
+                access_token = self.get_access_token(force_refresh=True)
+                if not access_token:
+                    return None, MpesaError("Failed to get access token")
+                headers['Authorization'] = f'Bearer {access_token}'
+                self._count('stk_push_requests')
+                response = self.http.post(url, json=payload, headers=headers, timeout=self.timeout)
+        
+        except requests.exceptions.ConnectTimeout as e:
+            # Never connected, so nothing was sent
+            print(f"Error in STK Push: {str(e)}")
+            return None, MpesaError(str(e))
+        except Exception as e:
+            print(f"Error in STK Push: {str(e)}")
+            return None, MpesaError(str(e), maybe_accepted=True)
+        
+        try:
+            response_data = response.json()
+        except ValueError:
+            response_data = None
+        
+        if response.status_code == 200 and response_data:
+            return response_data, None
+        if response_data and response.status_code not in AMBIGUOUS_STATUS_CODES:
+            # Daraja answered with an error of its own: the push was rejected
+            return None, MpesaError(response_data.get('errorMessage', 'STK Push failed'))
+        return None, MpesaError(f"STK Push returned HTTP {response.status_code}", maybe_accepted=True)
+    
+    def stk_query(self, checkout_request_id):
+        """Query the status of an STK Push (returns ResultCode/ResultDesc once the customer has answered)"""
+        try:
+            access_token = self.get_access_token()
+            if not access_token:
+                return None, "Failed to get access token"
+            
+            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+            payload = {
+                "BusinessShortCode": self.business_shortcode,
+                "Password": self._password(timestamp),
+                "Timestamp": timestamp,
+                "CheckoutRequestID": checkout_request_id
+            }
+            
+            url = f"{self.base_url}/mpesa/stkpushquery/v1/query"
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            }
+            
+            self._count('stk_query_requests')
+            response = self.http.post(url, json=payload, headers=headers, timeout=self.timeout)
             response_data = response.json()
             
             if response.status_code == 200:
                 return response_data, None
             else:
-                return None, response_data.get('errorMessage', 'STK Push failed')
-                
+                return None, response_data.get('errorMessage', 'STK Query failed')
+        
         except Exception as e:
-            print(f"Error in STK Push: {str(e)}")
-            return None, str(e)
\ No newline at end of file
+            print(f"Error in STK Query: {str(e)}")
+            return None, str(e)
+
+
+def mpesa_amount(total):
+    """Whole shillings charged for an order total (Daraja only accepts integer amounts)"""
+    return int(Decimal(str(total)).quantize(Decimal('1'), ROUND_HALF_UP))
+
+
+# ========== PROCESS-WIDE INSTANCE ==========
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_mpesa_service():
+    """Shared MpesaService so the OAuth token and HTTP connections are reused across requests"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = MpesaService()
+    return _service
@@ -0,0 +1,333 @@
+from app import db
+from app.models.Order import Order
+from app.models.mpesa_outbox import MpesaOutbox
+from app.services.inventory_service import release_stock
+from app.services.mpesa_service import mpesa_amount
+from sqlalchemy import case, select, update
+from sqlalchemy.orm import selectinload
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+import queue
+import threading
+import time
+
+OPEN_STATUSES = ('pending', 'processing')
+
+
+def parse_stk_callback(payload):
+    """Extract the fields we settle on from a Daraja STK callback body; None if malformed"""
+    try:
+        callback = payload['Body']['stkCallback']
+        result = {
+            'checkout_request_id': str(callback['CheckoutRequestID']),
+            'merchant_request_id': callback.get('MerchantRequestID'),
+            'result_code': str(callback['ResultCode']),
+            'result_desc': str(callback.get('ResultDesc', ''))[:255],
+        }
+    except (KeyError, TypeError):
+        return None
+
+    items = (callback.get('CallbackMetadata') or {}).get('Item') or []
+    metadata = {item.get('Name'): item.get('Value') for item in items if isinstance(item, dict)}
+    result['receipt_number'] = str(metadata['MpesaReceiptNumber'])[:50] if metadata.get('MpesaReceiptNumber') else None
+    try:
+        result['amount'] = Decimal(str(metadata['Amount'])) if metadata.get('Amount') is not None else None
+    except InvalidOperation:
+        return None
+
+    # Daraja always reports what was paid; a success without it cannot be checked
+    if result['result_code'] == '0' and result['amount'] is None:
+        return None
+    return result
+
+
+def settle_results(results):
+    """
+    Apply STK results to their orders in one batch.
+
+    Each order is settled at most once: every UPDATE only matches rows whose
+    mpesa_result_code is still NULL, so duplicates, replays and late
+    callbacks that lose a race are no-ops, even across processes.
+    Results are deduplicated by checkout id (first one wins). Successful
+    payments complete the order and record the receipt number, unless the
+    result carries an amount that differs from what the order was charged:
+    those are recorded but the order is left for an admin. Failed ones
+    cancel the order and return its stock. Callback results whose order's push outcome was unknown are
+    adopted rather than settled (see adopt_unknown_pushes). Returns
+    (counts, unmatched checkout ids).
+    """
+    latest = {}
+    for result in results:
+        latest.setdefault(result['checkout_request_id'], result)
+    duplicates = len(results) - len(latest)
+    if not latest:
+        return {'settled': 0, 'duplicates': duplicates, 'adopted': 0}, []
+
+    paid = {cid: r for cid, r in latest.items() if r['result_code'] == '0'}
+    failed = {cid: r for cid, r in latest.items() if r['result_code'] != '0'}
+    checkout_id = Order.mpesa_checkout_request_id
+    unsettled = Order.mpesa_result_code.is_(None)
+    settled_ids = set()
+
+    if paid:
+        descs = {cid: r['result_desc'] for cid, r in paid.items()}
+        receipts = {cid: r['receipt_number'] for cid, r in paid.items() if r.get('receipt_number')}
+        mismatched = _amount_mismatches(paid)
+        descs.update(mismatched)
+        completes = Order.status.in_(OPEN_STATUSES)
+        if mismatched:
+            completes = completes & checkout_id.notin_(list(mismatched))
+        rows = db.session.execute(
+            update(Order)
+            .where(checkout_id.in_(list(paid)), unsettled)
+            .values(
+                mpesa_result_code='0',
+                mpesa_result_desc=case(descs, value=checkout_id),
+                mpesa_receipt_number=case(receipts, value=checkout_id) if receipts else None,
+                status=case((completes, 'completed'), else_=Order.status)
+            )
+            .returning(checkout_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        settled_ids.update(row[0] for row in rows)
+
+    if failed:
+        codes = {cid: r['result_code'] for cid, r in failed.items()}
+        descs = {cid: r['result_desc'] for cid, r in failed.items()}
+        values = {
+            'mpesa_result_code': case(codes, value=checkout_id),
+            'mpesa_result_desc': case(descs, value=checkout_id),
+        }
+        # Open orders are cancelled and their reserved stock returned
+        cancelled = db.session.execute(
+            update(Order)
+            .where(checkout_id.in_(list(failed)), unsettled, Order.status.in_(OPEN_STATUSES))
+            .values(status='cancelled', **values)
+            .returning(Order.id, checkout_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        # Orders an admin already moved on only get the result recorded
+        recorded = db.session.execute(
+            update(Order)
+            .where(checkout_id.in_(list(failed)), unsettled)
+            .values(**values)
+            .returning(checkout_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        settled_ids.update(row[1] for row in cancelled)
+        settled_ids.update(row[0] for row in recorded)
+
+        if cancelled:
+            orders = Order.query.options(selectinload(Order.items))\
+                                .filter(Order.id.in_([row[0] for row in cancelled])).all()
+            release_stock(orders)
+
+    db.session.commit()
+
+    # Ids that matched no order at all may belong to an order whose outbox
+    # write-back has not committed yet; the caller can retry them later
+    unresolved = [cid for cid in latest if cid not in settled_ids]
+    known = set()
+    if unresolved:
+        known = {
+            cid for (cid,) in db.session.query(checkout_id).filter(checkout_id.in_(unresolved))
+        }
+    unmatched = [cid for cid in unresolved if cid not in known]
+
+    adopted = adopt_unknown_pushes([latest[cid] for cid in unmatched if latest[cid].get('order_id')])
+    unmatched = [cid for cid in unmatched if cid not in adopted]
+
+    return {
+        'settled': len(settled_ids),
+        'duplicates': duplicates + len(known),
+        'adopted': len(adopted)
+    }, unmatched
+
+
+def _amount_mismatches(paid):
+    """{checkout id: result desc} for paid results whose amount is not what the order was charged"""
+    amounts = {cid: r['amount'] for cid, r in paid.items() if r.get('amount') is not None}
+    if not amounts:
+        return {}
+    totals = db.session.query(Order.mpesa_checkout_request_id, Order.total_amount)\
+                       .filter(Order.mpesa_checkout_request_id.in_(list(amounts)))
+    mismatched = {}
+    for cid, total in totals:
+        expected = mpesa_amount(total)
+        if amounts[cid] != expected:
+            print(f"M-Pesa amount mismatch for {cid}: paid {amounts[cid]}, expected {expected}")
+            mismatched[cid] = f"Amount mismatch: paid {amounts[cid]}, expected {expected}"
+    return mismatched
+
+
+def adopt_unknown_pushes(results):
+    """
+    Attach callback CheckoutRequestIDs to orders whose STK push ended as
+    `unknown` (see mpesa_outbox.py), found through the order id carried in
+    the CallBackURL. The order moves to processing and is left to the
+    reconciler, which settles it from STK Query rather than from the
+    callback. Returns the adopted checkout ids.
+    """
+    by_order = {}
+    for result in results:
+        by_order.setdefault(result['order_id'], result)
+    if not by_order:
+        return set()
+
+    checkout_ids = {order_id: r['checkout_request_id'] for order_id, r in by_order.items()}
+    merchant_ids = {order_id: r['merchant_request_id'] for order_id, r in by_order.items()}
+    rows = db.session.execute(
+        update(Order)
+        .where(
+            Order.id.in_(list(by_order)),
+            Order.status == 'pending',
+            Order.mpesa_checkout_request_id.is_(None),
+            Order.id.in_(select(MpesaOutbox.order_id).where(MpesaOutbox.status == 'unknown'))
+        )
+        .values(
+            mpesa_checkout_request_id=case(checkout_ids, value=Order.id),
+            mpesa_merchant_request_id=case(merchant_ids, value=Order.id),
+            status='processing'
+        )
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    adopted_orders = [row[0] for row in rows]
+
+    if adopted_orders:
+        db.session.execute(
+            update(MpesaOutbox)
+            .where(MpesaOutbox.order_id.in_(adopted_orders), MpesaOutbox.status == 'unknown')
+            .values(status='sent', last_error=None)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    return {checkout_ids[order_id] for order_id in adopted_orders}
+
+
+class CallbackIngestor:
+    """
+    Queues callback payloads and settles them on a background thread,
+    coalescing bursts into batches of up to `batch_size` results.
+    """
+
+    def __init__(self, app, batch_size=200, max_wait=0.2, queue_size=10000,
+                 unmatched_ttl=300, unmatched_retry=2.0):
+        self.app = app
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.unmatched_ttl = unmatched_ttl
+        self.unmatched_retry = unmatched_retry
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._unmatched = {}  # checkout id -> (result, first seen); settler thread only
+        self._lock = threading.Lock()
+        self.stats = {
+            'received': 0, 'settled': 0, 'duplicates': 0, 'adopted': 0,
+            'unmatched_dropped': 0, 'batches': 0, 'overflow_sync': 0, 'settle_errors': 0
+        }
+        self._thread = threading.Thread(target=self._run, name="mpesa-callbacks", daemon=True)
+        self._thread.start()
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def submit(self, result):
+        """Queue one parsed callback; settles inline if the queue is full"""
+        self._count('received')
+        try:
+            self._queue.put_nowait(result)
+        except queue.Full:
+            self._count('overflow_sync')
+            unmatched = self._settle([result])
+            self._count('unmatched_dropped', len(unmatched))
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['queued'] = self._queue.qsize()
+        stats['awaiting_order'] = len(self._unmatched)
+        return stats
+
+    def _next_batch(self):
+        batch = []
+        try:
+            # Wake up periodically while callbacks are waiting for their order
+            batch.append(self._queue.get(timeout=self.unmatched_retry if self._unmatched else None))
+        except queue.Empty:
+            return batch
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # Give earlier callbacks without a matching order another chance
+            batch.extend(result for result, _ in self._unmatched.values())
+            if not batch:
+                continue
+
+            unmatched = self._settle(batch)
+
+            now = datetime.utcnow()
+            by_id = {result['checkout_request_id']: result for result in batch}
+            still_waiting = {}
+            for cid in unmatched:
+                _, first_seen = self._unmatched.get(cid, (None, now))
+                if now - first_seen < timedelta(seconds=self.unmatched_ttl):
+                    still_waiting[cid] = (by_id[cid], first_seen)
+                else:
+                    # Left to the STK status reconciliation sweep
+                    self._count('unmatched_dropped')
+            self._unmatched = still_waiting
+
+    def _settle(self, batch):
+        """
+        Settle one batch; returns the checkout ids still to retry. If the
+        batch cannot be written at all, every id in it is returned, so it is
+        retried with the unmatched ones and, past unmatched_ttl, left to the
+        reconciler (which finds the orders still unsettled)
+        """
+        with self.app.app_context():
+            try:
+                counts, unmatched = settle_results(batch)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error settling M-Pesa callbacks, will retry: {str(e)}")
+                self._count('settle_errors')
+                return list(dict.fromkeys(result['checkout_request_id'] for result in batch))
+
+        self._count('batches')
+        self._count('settled', counts['settled'])
+        self._count('duplicates', counts['duplicates'])
+        self._count('adopted', counts['adopted'])
+        return unmatched
+
+
+_ingestor = None
+_ingestor_lock = threading.Lock()
+
+
+def get_callback_ingestor(app):
+    global _ingestor
+    with _ingestor_lock:
+        if _ingestor is None:
+            _ingestor = CallbackIngestor(
+                app,
+                batch_size=app.config['MPESA_CALLBACK_BATCH_SIZE'],
+                max_wait=app.config['MPESA_CALLBACK_MAX_WAIT']
+            )
+    return _ingestor
+
+
+def get_callback_stats():
+    return _ingestor.get_stats() if _ingestor is not None else {}
@@ -0,0 +1,166 @@
+"""
+Who is online, across every backend process.
+
+Each connected socket (sid) belongs to one user; a user is online while at
+least one of their sockets is alive, so several tabs are reference-counted
+naturally. Every process re-announces its own sockets on a heartbeat, and
+entries not refreshed within PRESENCE_TTL lapse, which also cleans up after
+a process that died without running its disconnect handlers.
+
+PRESENCE_STORE_URL chooses where the state lives: empty for this process
+only, or redis://... (needs the `redis` package) to share it between
+processes.
+"""
+import threading
+import time
+
+
+class MemoryPresenceStore:
+    """Presence state for a single process"""
+
+    def __init__(self):
+        self._sockets = {}    # user_id -> {sid: expires_at}
+        self._last_seen = {}  # user_id -> unix time the last socket went away
+        self._lock = threading.Lock()
+
+    def touch(self, entries, ttl):
+        expires_at = time.time() + ttl
+        with self._lock:
+            for user_id, sid in entries:
+                self._sockets.setdefault(user_id, {})[sid] = expires_at
+
+    def remove(self, user_id, sid):
+        with self._lock:
+            sockets = self._sockets.get(user_id, {})
+            sockets.pop(sid, None)
+            if not sockets:
+                self._sockets.pop(user_id, None)
+            self._last_seen[user_id] = time.time()
+
+    def connection_counts(self, user_ids):
+        now = time.time()
+        with self._lock:
+            return {
+                user_id: sum(1 for expires in self._sockets.get(user_id, {}).values() if expires > now)
+                for user_id in user_ids
+            }
+
+    def last_seen(self, user_ids):
+        with self._lock:
+            return {user_id: self._last_seen.get(user_id) for user_id in user_ids}
+
+
+class RedisPresenceStore:
+    """
+    Presence state shared through Redis: one sorted set per user holding
+    their sids scored by expiry, plus one hash of last-seen times. Every
+    operation is a single pipelined round trip, whatever the number of users.
+    """
+
+    def __init__(self, url, prefix='presence'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("PRESENCE_STORE_URL points at Redis but the `redis` package is not installed")
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, user_id):
+        return f"{self.prefix}:user:{user_id}"
+
+    def touch(self, entries, ttl):
+        expires_at = time.time() + ttl
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id, sid in entries:
+            pipe.zadd(self._key(user_id), {sid: expires_at})
+            pipe.expire(self._key(user_id), int(ttl * 2))
+        pipe.execute()
+
+    def remove(self, user_id, sid):
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrem(self._key(user_id), sid)
+        pipe.zremrangebyscore(self._key(user_id), '-inf', now)
+        pipe.hset(f"{self.prefix}:last_seen", user_id, now)
+        pipe.execute()
+
+    def connection_counts(self, user_ids):
+        user_ids = list(user_ids)
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zcount(self._key(user_id), f"({now}", '+inf')
+        return dict(zip(user_ids, pipe.execute()))
+
+    def last_seen(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        values = self.redis.hmget(f"{self.prefix}:last_seen", user_ids)
+        return {user_id: float(value) if value else None for user_id, value in zip(user_ids, values)}
+
+
+class PresenceTracker:
+    """Maps this process's sockets to users and keeps them alive in the store"""
+
+    def __init__(self, socketio, store, ttl=60, heartbeat_interval=20):
+        self.socketio = socketio
+        self.store = store
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self._local = {}  # sid -> user_id, sockets connected to this process
+        self._lock = threading.Lock()
+        self._task = None
+
+    def connect(self, sid, user_id):
+        """Attach a socket to a user; repeated calls for the same pair only refresh it"""
+        user_id = str(user_id)
+        with self._lock:
+            previous = self._local.get(sid)
+            self._local[sid] = user_id
+            if self._task is None:
+                self._task = self.socketio.start_background_task(self._heartbeat)
+        if previous is not None and previous != user_id:
+            self.store.remove(previous, sid)
+        self.store.touch([(user_id, sid)], self.ttl)
+
+    def disconnect(self, sid):
+        with self._lock:
+            user_id = self._local.pop(sid, None)
+        if user_id is not None:
+            self.store.remove(user_id, sid)
+        return user_id
+
+    def online(self, user_ids):
+        """The subset of `user_ids` with at least one live socket, in one store query"""
+        user_ids = {str(uid) for uid in user_ids if uid is not None}
+        if not user_ids:
+            return set()
+        return {user_id for user_id, count in self.store.connection_counts(user_ids).items() if count}
+
+    def get_status(self, user_ids):
+        user_ids = [str(uid) for uid in user_ids]
+        counts = self.store.connection_counts(user_ids)
+        last_seen = self.store.last_seen(user_ids)
+        return {
+            user_id: {'online': counts[user_id] > 0, 'connections': counts[user_id], 'last_seen': last_seen[user_id]}
+            for user_id in user_ids
+        }
+
+    def _heartbeat(self):
+        while True:
+            self.socketio.sleep(self.heartbeat_interval)
+            with self._lock:
+                entries = [(user_id, sid) for sid, user_id in self._local.items()]
+            if not entries:
+                continue
+            try:
+                self.store.touch(entries, self.ttl)
+            except Exception as e:
+                print(f"Error refreshing presence: {e}")
+
+
+def create_presence_store(url):
+    if url and url.startswith(('redis://', 'rediss://')):
+        return RedisPresenceStore(url)
+    return MemoryPresenceStore()
@@ -0,0 +1,364 @@
+"""
+In-memory search index over the product catalogue for the chatbot.
+
+Only the searchable fields (id, name, category) are indexed; stock and
+price are always read from the database for the product that matched.
+The index is built on first use and then kept current from committed ORM
+changes in this process (create, update, delete, bulk upload). A full
+rebuild every PRODUCT_INDEX_REFRESH_SECONDS picks up changes made by
+other processes.
+
+Lookups tolerate typos and Swahili names: each typed word is matched
+exactly, through SYNONYM_GROUPS, or to indexed words within a small edit
+distance (shortlisted by shared trigrams), and products are ranked with
+a 0..1 confidence.
+"""
+from app import db
+from app.models.products import Product
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import heapq
+import re
+import threading
+import time
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+# Words that name the same thing; a customer typing one also matches the others
+SYNONYM_GROUPS = [
+    {'rice', 'mchele'},
+    {'sugar', 'sukari'},
+    {'oil', 'mafuta'},
+    {'cooking', 'kupikia'},
+    {'flour', 'unga'},
+    {'wheat', 'ngano'},
+    {'maize', 'mahindi'},
+    {'milk', 'maziwa'},
+    {'tea', 'chai', 'majani'},
+    {'coffee', 'kahawa'},
+    {'bread', 'mkate'},
+    {'salt', 'chumvi'},
+    {'soap', 'sabuni'},
+    {'beans', 'maharagwe'},
+    {'eggs', 'egg', 'mayai', 'yai'},
+    {'water', 'maji'},
+    {'meat', 'nyama'},
+    {'potatoes', 'potato', 'viazi'},
+    {'onions', 'onion', 'vitunguu'},
+    {'tomatoes', 'tomato', 'nyanya'},
+    {'juice', 'sharubati'},
+    {'matches', 'kiberiti'},
+]
+SYNONYMS = {word: group for group in SYNONYM_GROUPS for word in group}
+
+SYNONYM_SCORE = 0.95   # a synonym is nearly as good as the word itself
+PREFIX_SCORE = 0.85    # "cook" for "cooking"
+MIN_WORD_SCORE = 0.6   # weaker per-word matches are ignored
+MIN_MATCH_SCORE = 0.45  # weaker product matches are not returned
+CATEGORY_SCORE = 0.4
+FUZZY_TOKENS_PER_WORD = 5
+
+
+def normalize(text):
+    return ' '.join(TOKEN_RE.findall((text or '').lower()))
+
+
+def trigrams(word):
+    """Trigrams of a word padded with spaces, so word starts and ends count too"""
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit=None):
+    """Levenshtein distance; anything past `limit` is reported as limit + 1"""
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = previous[j - 1] + (ca != cb)
+            insert = current[j - 1] + 1
+            delete = previous[j] + 1
+            current.append(cost if cost <= insert and cost <= delete else (insert if insert < delete else delete))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def word_similarity(word, token):
+    """0..1, from edit distance, with a floor for a typed prefix of the token"""
+    if len(word) >= 3 and token.startswith(word):
+        return max(1 - (len(token) - len(word)) / len(token), PREFIX_SCORE)
+    longest = max(len(word), len(token))
+    limit = int(longest * (1 - MIN_WORD_SCORE))
+    return 1 - edit_distance(word, token, limit) / longest
+
+
+SYNONYM_TRIGRAMS = {}  # trigram -> {synonym-table words}, so misspelt aliases still resolve
+for _word in SYNONYMS:
+    for _gram in trigrams(_word):
+        SYNONYM_TRIGRAMS.setdefault(_gram, set()).add(_word)
+
+
+class ProductEntry:
+    __slots__ = ('id', 'name', 'name_norm', 'tokens', 'category_norm')
+
+    def __init__(self, product_id, name, category):
+        self.id = product_id
+        self.name = name
+        self.name_norm = normalize(name)
+        self.tokens = tuple(dict.fromkeys(self.name_norm.split()))
+        self.category_norm = normalize(category)
+
+
+class ProductIndex:
+    def __init__(self, refresh_seconds=300):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._reset()
+
+    def _reset(self):
+        self.entries = {}      # id -> ProductEntry
+        self.by_name = {}      # normalised name -> {ids}
+        self.by_token = {}     # word -> {ids}
+        self.by_trigram = {}   # trigram -> {words}, to find misspelt and partial words
+        self.by_category = {}  # category word -> {ids}
+        self.by_length = {}    # number of words in the name -> {ids}
+
+    # ---------- maintenance ----------
+    def _add(self, entry):
+        self.entries[entry.id] = entry
+        self.by_name.setdefault(entry.name_norm, set()).add(entry.id)
+        for token in entry.tokens:
+            if token not in self.by_token:
+                self.by_token[token] = set()
+                for gram in trigrams(token):
+                    self.by_trigram.setdefault(gram, set()).add(token)
+            self.by_token[token].add(entry.id)
+        for token in entry.category_norm.split():
+            self.by_category.setdefault(token, set()).add(entry.id)
+        self.by_length.setdefault(len(entry.tokens), set()).add(entry.id)
+
+    def _discard(self, product_id):
+        entry = self.entries.pop(product_id, None)
+        if entry is None:
+            return
+        postings = [(self.by_name, entry.name_norm, product_id)]
+        for token in entry.tokens:
+            postings.append((self.by_token, token, product_id))
+            if self.by_token.get(token) == {product_id}:
+                # Last product using this word: drop the word from the trigram index too
+                postings.extend((self.by_trigram, gram, token) for gram in trigrams(token))
+        postings.extend((self.by_category, token, product_id) for token in entry.category_norm.split())
+        postings.append((self.by_length, len(entry.tokens), product_id))
+        for index, key, value in postings:
+            values = index.get(key)
+            if values is not None:
+                values.discard(value)
+                if not values:
+                    del index[key]
+
+    def rebuild(self):
+        rows = db.session.query(Product.id, Product.name, Product.category).all()
+        with self._lock:
+            self._reset()
+            for product_id, name, category in rows:
+                self._add(ProductEntry(product_id, name, category))
+            self._built_at = time.monotonic()
+
+    def ensure_fresh(self):
+        if self._built_at is None or time.monotonic() - self._built_at > self.refresh_seconds:
+            self.rebuild()
+
+    def upsert(self, rows):
+        """rows: iterable of (id, name, category)"""
+        with self._lock:
+            if self._built_at is None:
+                return  # not built yet; the first build will read them
+            for product_id, name, category in rows:
+                self._discard(product_id)
+                self._add(ProductEntry(product_id, name, category))
+
+    def remove(self, product_ids):
+        with self._lock:
+            for product_id in product_ids:
+                self._discard(product_id)
+
+    def invalidate(self):
+        """Force a rebuild on next use, e.g. after bulk SQL that bypassed the ORM"""
+        with self._lock:
+            self._built_at = None
+
+    # ---------- lookups ----------
+    def _candidates(self, index, keys):
+        ids = set()
+        for key in keys:
+            ids |= index.get(key, set())
+        return sorted(ids)
+
+    def _credit(self, matches, word, score):
+        """Credit an indexed word, and the indexed synonyms of `word`, with a similarity"""
+        for candidate in SYNONYMS.get(word, (word,)):
+            candidate_score = score if candidate == word else score * SYNONYM_SCORE
+            if candidate in self.by_token and candidate_score > matches.get(candidate, 0):
+                matches[candidate] = candidate_score
+
+    def _similar_tokens(self, word):
+        """{indexed word: similarity} for one query word: itself, synonyms, or near misses"""
+        matches = {}
+        self._credit(matches, word, 1.0)
+        if word in self.by_token or word in SYNONYMS or len(word) < 3:
+            return matches
+
+        # Shortlist indexed and synonym-table words by shared trigrams, then
+        # confirm with edit distance; "mchelle" reaches rice through "mchele"
+        shared = {}
+        for gram in trigrams(word):
+            for token in self.by_trigram.get(gram, ()):
+                shared[token] = shared.get(token, 0) + 1
+            for token in SYNONYM_TRIGRAMS.get(gram, ()):
+                shared[token] = shared.get(token, 0) + 1
+        shortlist = heapq.nlargest(FUZZY_TOKENS_PER_WORD * 4, shared, key=shared.get)
+        scored = heapq.nlargest(FUZZY_TOKENS_PER_WORD, ((word_similarity(word, token), token) for token in shortlist))
+        for score, token in scored:
+            if score >= MIN_WORD_SCORE:
+                self._credit(matches, token, score)
+        return matches
+
+    def _groups(self, levels, ids, position=0, matched=0):
+        """
+        Split candidate ids into groups that match every query word at the
+        same level, yielding (summed word score, ids). Done with set
+        operations, so the cost follows the number of groups rather than
+        the number of products.
+        """
+        if not ids:
+            return
+        if position == len(levels):
+            if matched:
+                yield matched, ids
+            return
+        word_levels, seen = levels[position]
+        for score, level_ids in word_levels:
+            yield from self._groups(levels, ids & level_ids, position + 1, matched + score)
+        yield from self._groups(levels, ids - seen, position + 1, matched)
+
+    def rank(self, product_name, limit=5):
+        """
+        Products best matching a name the customer typed, as [(id, score)]
+        with score in 0..1, best first. Every word is matched exactly, via
+        the synonym table, or by edit distance to similar indexed words. A
+        product scores mostly by how much of the query it covers and partly
+        by how much of its own name the query covers. Falls back to the
+        category when no word matches.
+        """
+        query = normalize(product_name)
+        if not query:
+            return []
+        words = list(dict.fromkeys(query.split()))
+
+        with self._lock:
+            self.ensure_fresh()
+
+            exact = self.by_name.get(query)
+            if exact:
+                return [(product_id, 1.0) for product_id in sorted(exact)[:limit]]
+
+            # Per query word, the products it matches split into disjoint
+            # levels by similarity, best first
+            levels = []
+            for matches in map(self._similar_tokens, words):
+                seen, word_levels = set(), []
+                for token, score in sorted(matches.items(), key=lambda item: -item[1]):
+                    ids = self.by_token[token] - seen
+                    if ids:
+                        word_levels.append((score, ids))
+                        seen |= ids
+                levels.append((word_levels, seen))
+
+            scored_groups = []
+            for matched, ids in self._groups(levels, set().union(*(seen for _, seen in levels))):
+                # Within a group only the name length changes the score
+                for length, same_length in self.by_length.items():
+                    score = round(0.75 * matched / len(words) + 0.25 * min(matched / length, 1.0), 3)
+                    if score >= MIN_MATCH_SCORE:
+                        scored_groups.append((score, ids, same_length))
+
+            ranked = []
+            scored_groups.sort(key=lambda group: -group[0])
+            for score, ids, same_length in scored_groups:
+                if len(ranked) >= limit and ranked[limit - 1][1] > score:
+                    break
+                members = ids & same_length
+                ranked.extend((product_id, score) for product_id in sorted(members)[:limit])
+                ranked.sort(key=lambda item: (-item[1], item[0]))
+            ranked = ranked[:limit]
+
+            if not ranked:
+                for product_id in self._candidates(self.by_category, words):
+                    if query in self.entries[product_id].category_norm:
+                        ranked.append((product_id, CATEGORY_SCORE))
+                        if len(ranked) >= limit:
+                            break
+        return ranked[:limit]
+
+    def find(self, product_name):
+        """Id of the best match for a typed product name, or None"""
+        ranked = self.rank(product_name, limit=1)
+        return ranked[0][0] if ranked else None
+
+    def find_mentioned(self, message):
+        """First product (by id) with a word of its name, or a synonym of one, in the message"""
+        words = set()
+        for word in normalize(message).split():
+            words |= SYNONYMS.get(word, {word})
+        with self._lock:
+            self.ensure_fresh()
+            candidates = self._candidates(self.by_token, words)
+        return candidates[0] if candidates else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'products': len(self.entries),
+                'tokens': len(self.by_token),
+                'trigrams': len(self.by_trigram),
+                'categories': len(self.by_category),
+                'age_seconds': round(time.monotonic() - self._built_at, 1) if self._built_at else None
+            }
+
+
+product_index = ProductIndex()
+
+
+# ========== INCREMENTAL UPDATES ==========
+# Product changes are collected per session at flush and applied only once
+# the transaction commits, so rolled-back edits never reach the index.
+@event.listens_for(Session, 'after_flush')
+def _collect_product_changes(session, flush_context):
+    changes = session.info.setdefault('product_index_changes', {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Product):
+            changes[obj.id] = (obj.name, obj.category)
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            changes[obj.id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_product_changes(session):
+    changes = session.info.pop('product_index_changes', None)
+    if not changes:
+        return
+    product_index.remove([pid for pid, fields in changes.items() if fields is None])
+    product_index.upsert([(pid, *fields) for pid, fields in changes.items() if fields is not None])
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_product_changes(session, previous_transaction):
+    session.info.pop('product_index_changes', None)
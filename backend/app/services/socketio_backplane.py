@@ -0,0 +1,68 @@
+"""
+Socket.IO configuration for running more than one backend process.
+
+Each process keeps its own connected clients and rooms, so emits have to be
+relayed between processes through a message queue. SOCKETIO_MESSAGE_QUEUE
+picks the backplane:
+
+    redis://host:6379/0     python-socketio RedisManager (needs `redis`)
+    kafka://host:9092       KafkaManager (needs `kafka-python`)
+    amqp://guest@host//     KombuManager (needs `kombu`); any other URL too
+    memory://               InProcessManager below: every server created in
+                            this interpreter shares one hub (tests/local runs;
+                            Flask-SocketIO's test_client refuses any queue, so
+                            connect real python-socketio clients instead)
+
+Without sticky sessions (SOCKETIO_STICKY_SESSIONS=false) the long-polling
+transport cannot work, because its requests may land on different
+processes. Only websocket is offered then.
+"""
+from socketio import PubSubManager
+import queue
+import threading
+
+
+class InProcessManager(PubSubManager):
+    """Backplane that relays between Socket.IO servers living in the same process"""
+    name = 'inprocess'
+
+    _subscribers = {}  # channel -> [queue.Queue], shared by every instance
+    _subscribers_lock = threading.Lock()
+
+    def __init__(self, url='memory://', channel='socketio', write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+
+    def _publish(self, data):
+        payload = self.json.dumps(data)  # as strict as a real queue about what can be sent
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers.get(self.channel, []))
+        for subscriber in subscribers:
+            subscriber.put(payload)
+
+    def _listen(self):
+        inbox = queue.Queue()
+        with self._subscribers_lock:
+            self._subscribers.setdefault(self.channel, []).append(inbox)
+        while True:
+            yield inbox.get()
+
+
+def socketio_options(config):
+    """Keyword arguments for socketio.init_app() derived from the app config"""
+    options = {
+        'cors_allowed_origins': config['SOCKETIO_CORS_ORIGINS'],
+        'ping_interval': config['SOCKETIO_PING_INTERVAL'],
+        'ping_timeout': config['SOCKETIO_PING_TIMEOUT'],
+    }
+    if config['SOCKETIO_ASYNC_MODE']:
+        options['async_mode'] = config['SOCKETIO_ASYNC_MODE']
+    if not config['SOCKETIO_STICKY_SESSIONS']:
+        options['transports'] = ['websocket']
+
+    url = config['SOCKETIO_MESSAGE_QUEUE']
+    if url and url.startswith('memory://'):
+        options['client_manager'] = InProcessManager(url, channel=config['SOCKETIO_CHANNEL'])
+    elif url:
+        options['message_queue'] = url
+        options['channel'] = config['SOCKETIO_CHANNEL']
+    return options
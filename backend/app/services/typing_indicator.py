@@ -0,0 +1,131 @@
+from datetime import datetime
+import threading
+import time
+
+
+class TypingTracker:
+    """
+    Server-side typing state per (conversation, user).
+
+    Clients fire typing_start/typing_stop on keystrokes. Repeats of a
+    user's current state are dropped; the rest are queued per room and
+    flushed every `interval` seconds as one `typing_update` event listing
+    who is typing. A start and stop inside one window cancel out. Typing
+    expires after `timeout` seconds without a fresh start, and when the
+    socket disconnects.
+    """
+
+    def __init__(self, socketio, interval=0.5, timeout=5.0, event='typing_update'):
+        self.socketio = socketio
+        self.interval = interval
+        self.timeout = timeout
+        self.event = event
+        self._typing = {}   # room -> {user_id: (expires_at, sid)}
+        self._pending = {}  # room -> {user_id: is_typing} not yet broadcast
+        self._conversations = {}  # room -> conversation id as clients know it
+        self._lock = threading.Lock()
+        self._task = None
+        self.stats = {
+            'starts_received': 0, 'stops_received': 0, 'suppressed': 0,
+            'expired': 0, 'broadcasts': 0, 'changes_broadcast': 0
+        }
+
+    def _ensure_running(self):
+        if self._task is None:
+            self._task = self.socketio.start_background_task(self._run)
+
+    def start(self, room, conversation_id, user_id, sid=None):
+        with self._lock:
+            self.stats['starts_received'] += 1
+            self._conversations[room] = conversation_id
+            users = self._typing.setdefault(room, {})
+            already = user_id in users
+            users[user_id] = (time.monotonic() + self.timeout, sid)
+            if already:
+                self.stats['suppressed'] += 1
+            else:
+                self._queue(room, user_id, True)
+            self._ensure_running()
+
+    def stop(self, room, conversation_id, user_id):
+        with self._lock:
+            self.stats['stops_received'] += 1
+            if not self._clear(room, conversation_id, user_id):
+                self.stats['suppressed'] += 1
+
+    def message_sent(self, room, conversation_id, user_id):
+        """Sending a message ends the sender's typing without a separate stop event"""
+        with self._lock:
+            self._clear(room, conversation_id, user_id)
+
+    def _clear(self, room, conversation_id, user_id):
+        if self._typing.get(room, {}).pop(user_id, None) is None:
+            return False
+        self._conversations.setdefault(room, conversation_id)
+        self._queue(room, user_id, False)
+        return True
+
+    def drop_sid(self, sid):
+        """Stop everything a disconnected socket was typing"""
+        with self._lock:
+            for room, users in self._typing.items():
+                for user_id in [uid for uid, (_, owner) in users.items() if owner == sid]:
+                    del users[user_id]
+                    self._queue(room, user_id, False)
+
+    def _queue(self, room, user_id, is_typing):
+        pending = self._pending.setdefault(room, {})
+        if pending.get(user_id) is (not is_typing):
+            # Started and stopped (or the reverse) within one window: nobody needs to know
+            del pending[user_id]
+            self.stats['suppressed'] += 2
+        else:
+            pending[user_id] = is_typing
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['typing_now'] = sum(len(users) for users in self._typing.values())
+        received = stats['starts_received'] + stats['stops_received']
+        # Before coalescing every received event was broadcast to its room
+        stats['broadcasts_saved'] = received - stats['broadcasts']
+        return stats
+
+    def _collect(self):
+        """Expire stale typers and take the pending changes; returns [(room, payload)]"""
+        now = time.monotonic()
+        batches = []
+        with self._lock:
+            for room, users in self._typing.items():
+                for user_id in [uid for uid, (expires, _) in users.items() if expires <= now]:
+                    del users[user_id]
+                    self._queue(room, user_id, False)
+                    self.stats['expired'] += 1
+
+            for room, changes in self._pending.items():
+                if not changes:
+                    continue
+                batches.append((room, {
+                    'conversation_id': self._conversations.get(room, room),
+                    'typing': sorted(self._typing.get(room, {})),
+                    'changes': [{'user_id': uid, 'is_typing': flag} for uid, flag in changes.items()],
+                    'timestamp': datetime.utcnow().isoformat()
+                }))
+                self.stats['broadcasts'] += 1
+                self.stats['changes_broadcast'] += len(changes)
+            self._pending = {}
+            self._typing = {room: users for room, users in self._typing.items() if users}
+            self._conversations = {room: conv for room, conv in self._conversations.items() if room in self._typing}
+        return batches
+
+    def flush(self):
+        for room, payload in self._collect():
+            self.socketio.emit(self.event, payload, room=room)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error broadcasting typing updates: {e}")
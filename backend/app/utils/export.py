@@ -0,0 +1,195 @@
+"""
+Streamed CSV and XLSX files built from an iterable of rows.
+
+Both writers are generators of bytes that hold at most one buffer of
+output at a time, so a response built from them uses the same memory for
+ten rows as for ten million. The XLSX writer emits the zip parts directly
+(inline strings, no shared-string table) instead of going through openpyxl,
+whose workbooks can only be saved once complete; a sheet that reaches
+Excel's row limit continues on a new one.
+"""
+from flask import Response, stream_with_context
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape, quoteattr
+import csv
+import io
+import re
+import zipfile
+
+FLUSH_BYTES = 64 * 1024
+XLSX_MAX_ROWS = 1048576  # Excel's limit per sheet, header included
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+ILLEGAL_XML_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+SPREADSHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELATIONSHIPS_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def stream_csv(header, rows):
+    """Rows go to the csv module as they are (None becomes empty), so dates should arrive as ISO strings"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= FLUSH_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+# ========== XLSX ==========
+class _Pipe(io.RawIOBase):
+    """Write-only, unseekable file that the zip writer fills and the generator drains"""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self.size = 0
+        return data
+
+
+def _column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _cell(reference, value):
+    if value is None or value == '':
+        return ''
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return f'<c r="{reference}"><v>{value}</v></c>'
+    text = escape(ILLEGAL_XML_RE.sub('', _text(value)))
+    return f'<c r="{reference}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _row(number, letters, values):
+    cells = ''.join(_cell(f'{letter}{number}', value) for letter, value in zip(letters, values))
+    return f'<row r="{number}">{cells}</row>'
+
+
+def stream_xlsx(header, rows, sheet_name='Sheet'):
+    pipe = _Pipe()
+    letters = [_column_letter(i) for i in range(len(header))]
+    sheets = []
+
+    with zipfile.ZipFile(pipe, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        rows = iter(rows)
+        exhausted = False
+        while not exhausted:
+            sheets.append(sheet_name if not sheets else f'{sheet_name} {len(sheets) + 1}')
+            with archive.open(f'xl/worksheets/sheet{len(sheets)}.xml', 'w', force_zip64=True) as sheet:
+                sheet.write(f'{XML_HEADER}<worksheet xmlns="{SPREADSHEET_NS}"><sheetData>'.encode())
+                sheet.write(_row(1, letters, header).encode())
+                number = 1
+                exhausted = True
+                for values in rows:
+                    number += 1
+                    sheet.write(_row(number, letters, values).encode('utf-8'))
+                    if pipe.size >= FLUSH_BYTES:
+                        yield pipe.drain()
+                    if number == XLSX_MAX_ROWS:
+                        exhausted = False
+                        break
+                sheet.write(b'</sheetData></worksheet>')
+            yield pipe.drain()
+
+        for name, content in _workbook_parts(sheets):
+            archive.writestr(name, content)
+    yield pipe.drain()
+
+
+def _workbook_parts(sheets):
+    """Everything but the worksheets; written last, once the number of sheets is known"""
+    numbered = list(enumerate(sheets, start=1))
+    sheet_types = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i, _ in numbered
+    )
+    yield '[Content_Types].xml', (
+        f'{XML_HEADER}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        f'{sheet_types}</Types>'
+    )
+    yield '_rels/.rels', (
+        f'{XML_HEADER}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{RELATIONSHIPS_NS}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    )
+    yield 'xl/workbook.xml', (
+        f'{XML_HEADER}<workbook xmlns="{SPREADSHEET_NS}" xmlns:r="{RELATIONSHIPS_NS}"><sheets>'
+        + ''.join(f'<sheet name={quoteattr(name[:31])} sheetId="{i}" r:id="rId{i}"/>' for i, name in numbered)
+        + '</sheets></workbook>'
+    )
+    yield 'xl/_rels/workbook.xml.rels', (
+        f'{XML_HEADER}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        + ''.join(f'<Relationship Id="rId{i}" Type="{RELATIONSHIPS_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+                  for i, _ in numbered)
+        + f'<Relationship Id="rId{len(sheets) + 1}" Type="{RELATIONSHIPS_NS}/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    )
+    yield 'xl/styles.xml', (
+        f'{XML_HEADER}<styleSheet xmlns="{SPREADSHEET_NS}">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    )
+
+
+# ========== RESPONSES ==========
+EXPORT_FORMATS = {
+    'csv': ('text/csv', stream_csv),  # Werkzeug adds the charset
+    'xlsx': (XLSX_MIMETYPE, stream_xlsx),
+}
+
+
+def export_response(header, rows, file_format, filename, sheet_name='Sheet'):
+    """A streamed download of `rows`; the generator keeps the request (and its DB session) open until done"""
+    mimetype, writer = EXPORT_FORMATS[file_format]
+    body = writer(header, rows) if file_format == 'csv' else writer(header, rows, sheet_name)
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}.{file_format}"',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no',  # let nginx pass chunks through as they are produced
+        }
+    )
@@ -0,0 +1,70 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Clamp a requested page size to [1, maximum]"""
+    try:
+        limit = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(timestamp, row_id):
+    """Encode a (timestamp, id) position as an opaque URL-safe token"""
+    raw = json.dumps([timestamp.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a token produced by encode_cursor back into (timestamp, id)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, TypeError, json.JSONDecodeError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def keyset_before(timestamp_column, id_column, cursor):
+    """Rows that sort strictly after the cursor in (timestamp DESC, id DESC) order"""
+    timestamp, row_id = decode_cursor(cursor)
+    return or_(
+        timestamp_column < timestamp,
+        and_(timestamp_column == timestamp, id_column < row_id)
+    )
+
+
+def keyset_after(timestamp_column, id_column, cursor):
+    """Rows that sort strictly after the cursor in (timestamp ASC, id ASC) order"""
+    timestamp, row_id = decode_cursor(cursor)
+    return or_(
+        timestamp_column > timestamp,
+        and_(timestamp_column == timestamp, id_column > row_id)
+    )
+
+
+def paginate_keyset(query, limit, timestamp_attr='created_at'):
+    """
+    Fetch one page from a query already ordered on (timestamp, id).
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, timestamp_attr), last.id)
+    return rows, next_cursor
@@ -1,9 +1,21 @@
 #backend/main.py
-from app import create_app
+import os
+
+# Cooperative servers must patch the standard library before anything else is imported
+if os.getenv('SOCKETIO_ASYNC_MODE') == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif os.getenv('SOCKETIO_ASYNC_MODE') == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from app import create_app, socketio
 
 
 app = create_app()
 
 if __name__ == '__main__':
     
-    app.run(debug=True, port=5000, host='0.0.0.0')
\ No newline at end of file
+    # socketio.run picks the server matching the async mode (eventlet, gevent or Werkzeug)
+    socketio.run(app, debug=True, port=int(os.getenv('PORT', 5000)), host='0.0.0.0',
+                 allow_unsafe_werkzeug=True)
@@ -0,0 +1,32 @@
+"""Add composite indexes for keyset order listing
+
+Revision ID: 3f1a7c2d9b40
+Revises: c9484859c808
+Create Date: 2026-10-18 09:12:03.418221
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1a7c2d9b40'
+down_revision = 'c9484859c808'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.create_index('idx_orders_created_id', ['created_at', 'id'], unique=False)
+        batch_op.create_index('idx_orders_status_created_id', ['status', 'created_at', 'id'], unique=False)
+        batch_op.create_index('idx_orders_payment_created_id', ['payment_method', 'created_at', 'id'], unique=False)
+        batch_op.create_index('idx_orders_customer_created_id', ['customer_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index('idx_orders_customer_created_id')
+        batch_op.drop_index('idx_orders_payment_created_id')
+        batch_op.drop_index('idx_orders_status_created_id')
+        batch_op.drop_index('idx_orders_created_id')
@@ -0,0 +1,73 @@
+"""Add conversation_participants; give conversations a title, type and created_at
+
+Revision ID: 5e91b3c07a2d
+Revises: d47c90e3f215
+Create Date: 2026-10-18 13:24:09.311842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e91b3c07a2d'
+down_revision = 'd47c90e3f215'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # conversations, messages and support_qa already exist (created by db.create_all())
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('title', sa.String(length=200), nullable=True))
+        batch_op.add_column(sa.Column('conversation_type', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+        # Conversations are now defined by their participants; these are kept for old rows
+        batch_op.alter_column('retailer_id', existing_type=sa.String(length=100), nullable=True)
+        batch_op.alter_column('retailer_name', existing_type=sa.String(length=200), nullable=True)
+        batch_op.alter_column('customer_id', existing_type=sa.String(length=100), nullable=True)
+        batch_op.alter_column('customer_name', existing_type=sa.String(length=200), nullable=True)
+
+    op.execute("UPDATE conversations SET conversation_type = 'direct', created_at = timestamp")
+
+    op.create_table('conversation_participants',
+        sa.Column('conversation_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.String(length=100), nullable=False),
+        sa.Column('joined_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ),
+        sa.PrimaryKeyConstraint('conversation_id', 'user_id')
+    )
+    with op.batch_alter_table('conversation_participants', schema=None) as batch_op:
+        batch_op.create_index('idx_participant_user', ['user_id'], unique=False)
+
+    # Existing conversations keep their retailer and customer as participants
+    op.execute("""
+        INSERT INTO conversation_participants (conversation_id, user_id, joined_at)
+        SELECT id, retailer_id, timestamp FROM conversations WHERE retailer_id IS NOT NULL
+    """)
+    op.execute("""
+        INSERT INTO conversation_participants (conversation_id, user_id, joined_at)
+        SELECT id, customer_id, timestamp FROM conversations
+        WHERE customer_id IS NOT NULL AND (retailer_id IS NULL OR customer_id != retailer_id)
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('conversation_participants', schema=None) as batch_op:
+        batch_op.drop_index('idx_participant_user')
+
+    op.drop_table('conversation_participants')
+
+    op.execute("""
+        UPDATE conversations
+        SET retailer_id = COALESCE(retailer_id, ''), retailer_name = COALESCE(retailer_name, ''),
+            customer_id = COALESCE(customer_id, ''), customer_name = COALESCE(customer_name, '')
+    """)
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.alter_column('customer_name', existing_type=sa.String(length=200), nullable=False)
+        batch_op.alter_column('customer_id', existing_type=sa.String(length=100), nullable=False)
+        batch_op.alter_column('retailer_name', existing_type=sa.String(length=200), nullable=False)
+        batch_op.alter_column('retailer_id', existing_type=sa.String(length=100), nullable=False)
+        batch_op.drop_column('created_at')
+        batch_op.drop_column('conversation_type')
+        batch_op.drop_column('title')
@@ -0,0 +1,30 @@
+"""Add catalogue_version counter for product listing ETags
+
+Revision ID: 7c1f3e8a2d64
+Revises: e6d2a9f4c815
+Create Date: 2026-10-18 18:05:52.120447
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1f3e8a2d64'
+down_revision = 'e6d2a9f4c815'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    catalogue_version = op.create_table('catalogue_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(catalogue_version, [{'id': 1, 'version': 1}])
+
+
+def downgrade():
+    op.drop_table('catalogue_version')
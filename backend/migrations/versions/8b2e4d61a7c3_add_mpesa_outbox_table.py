@@ -0,0 +1,47 @@
+"""Add mpesa_outbox table for asynchronous STK push dispatch
+
+Revision ID: 8b2e4d61a7c3
+Revises: 3f1a7c2d9b40
+Create Date: 2026-10-18 10:02:47.590113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4d61a7c3'
+down_revision = '3f1a7c2d9b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('mpesa_outbox',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('order_id', sa.Integer(), nullable=False),
+        sa.Column('phone_number', sa.String(length=20), nullable=False),
+        sa.Column('amount', sa.Integer(), nullable=False),
+        sa.Column('account_reference', sa.String(length=50), nullable=False),
+        sa.Column('transaction_desc', sa.String(length=100), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.String(length=255), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('mpesa_outbox', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_mpesa_outbox_order_id'), ['order_id'], unique=False)
+        batch_op.create_index('idx_outbox_status_next_attempt', ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('mpesa_outbox', schema=None) as batch_op:
+        batch_op.drop_index('idx_outbox_status_next_attempt')
+        batch_op.drop_index(batch_op.f('ix_mpesa_outbox_order_id'))
+
+    op.drop_table('mpesa_outbox')
@@ -0,0 +1,57 @@
+"""Add per-participant inbox columns (last_message_at, unread_count) and index
+
+Revision ID: a3c58e1f6b27
+Revises: 5e91b3c07a2d
+Create Date: 2026-10-18 14:02:31.774015
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c58e1f6b27'
+down_revision = '5e91b3c07a2d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('conversation_participants', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_message_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('unread_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('last_read_message_id', sa.Integer(), nullable=True))
+
+    # Backfill from the conversations and messages already stored
+    op.execute("""
+        UPDATE conversation_participants
+        SET last_message_at = COALESCE(
+                (SELECT conversations.timestamp FROM conversations
+                 WHERE conversations.id = conversation_participants.conversation_id),
+                conversation_participants.joined_at,
+                CURRENT_TIMESTAMP),
+            unread_count = (SELECT COUNT(*) FROM messages
+                            WHERE messages.conversation_id = conversation_participants.conversation_id
+                              AND messages.sender_id != conversation_participants.user_id
+                              AND messages.read = false)
+    """)
+    op.execute("""
+        UPDATE conversations
+        SET unread_count = (SELECT COUNT(*) FROM messages
+                            WHERE messages.conversation_id = conversations.id
+                              AND messages.read = false)
+    """)
+
+    with op.batch_alter_table('conversation_participants', schema=None) as batch_op:
+        batch_op.alter_column('last_message_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.drop_index('idx_participant_user')
+        batch_op.create_index('idx_participant_inbox', ['user_id', 'last_message_at', 'conversation_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('conversation_participants', schema=None) as batch_op:
+        batch_op.drop_index('idx_participant_inbox')
+        batch_op.create_index('idx_participant_user', ['user_id'], unique=False)
+        batch_op.drop_column('last_read_message_id')
+        batch_op.drop_column('unread_count')
+        batch_op.drop_column('last_message_at')
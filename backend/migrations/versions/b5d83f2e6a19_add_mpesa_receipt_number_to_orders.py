@@ -0,0 +1,26 @@
+"""Add mpesa_receipt_number to orders
+
+Revision ID: b5d83f2e6a19
+Revises: 7c1f3e8a2d64
+Create Date: 2026-10-18 19:42:16.503318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d83f2e6a19'
+down_revision = '7c1f3e8a2d64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('mpesa_receipt_number', sa.String(length=50), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('mpesa_receipt_number')
@@ -0,0 +1,26 @@
+"""Add host to import_jobs
+
+Revision ID: c2e7a4d9f183
+Revises: b5d83f2e6a19
+Create Date: 2026-10-18 20:14:37.281946
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e7a4d9f183'
+down_revision = 'b5d83f2e6a19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('import_jobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('host', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('import_jobs', schema=None) as batch_op:
+        batch_op.drop_column('host')
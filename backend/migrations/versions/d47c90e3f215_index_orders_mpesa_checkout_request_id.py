@@ -0,0 +1,26 @@
+"""Index orders.mpesa_checkout_request_id for callback settlement
+
+Revision ID: d47c90e3f215
+Revises: 8b2e4d61a7c3
+Create Date: 2026-10-18 11:20:31.207745
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd47c90e3f215'
+down_revision = '8b2e4d61a7c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_orders_mpesa_checkout_request_id'), ['mpesa_checkout_request_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_orders_mpesa_checkout_request_id'))
@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the background workers out of the test process
+os.environ.setdefault('MPESA_OUTBOX_WORKERS', '0')
+os.environ.setdefault('MPESA_RECONCILE_INTERVAL', '0')
+os.environ.setdefault('IMPORT_JOB_WORKERS', '0')
+
+
+@pytest.fixture
+def app(monkeypatch):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(db_fd)
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{db_path}')
+
+    from app import create_app, db
+    from app.services import auth_service, mpesa_settlement
+
+    app = create_app()
+    app.config['TESTING'] = True
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    auth_service.token_cache.clear()
+    auth_service.user_cache.clear()
+    mpesa_settlement._ingestor = None  # the next app gets its own
+    os.remove(db_path)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    from app import db
+    from app.models.User import User
+
+    def make_user(email, role='customer'):
+        with app.app_context():
+            user = User(first_name='Test', last_name='User', email=email, phone_number='0712345678', role=role)
+            user.set_password('Password1')
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+    return make_user
+
+
+@pytest.fixture
+def login(client):
+    def login(email):
+        response = client.post('/api/auth/login', json={'email': email, 'password': 'Password1'})
+        assert response.status_code == 200, response.get_json()
+        return client
+    return login
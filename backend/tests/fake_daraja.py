@@ -0,0 +1,268 @@
+"""
+Local stand-in for the Safaricom Daraja API, for tests and local runs only.
+
+Point MpesaService at it with MPESA_BASE_URL=http://127.0.0.1:<port> to
+exercise the STK push flow without network access or sandbox credentials
+(run from backend/):
+
+    python tests/fake_daraja.py serve --port 8089 --callback-delay 2
+
+It can also replay STK result callbacks against our callback endpoint to
+load-test settlement (the URL ends in MPESA_CALLBACK_TOKEN; exits non-zero
+if any callback is refused):
+
+    python tests/fake_daraja.py replay http://127.0.0.1:5000/api/mpesa-callback/<token> \
+        --count 5000 --duplicate-ratio 0.2
+
+tests/test_mpesa_callbacks.py runs the same burst in-process and asserts
+that every order is settled exactly once; tests/test_mpesa_outbox.py drives
+the outbox dispatcher against the fake server.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+
+def build_stk_callback(checkout_request_id, merchant_request_id=None, result_code=0,
+                       amount=1, phone_number="254700000000"):
+    """Body Daraja posts to CallBackURL once the customer answers the STK prompt"""
+    callback = {
+        "MerchantRequestID": merchant_request_id or f"{uuid.uuid4().int % 10 ** 5}-{uuid.uuid4().int % 10 ** 8}-1",
+        "CheckoutRequestID": checkout_request_id,
+        "ResultCode": result_code,
+        "ResultDesc": "The service request is processed successfully." if result_code == 0
+                      else "Request cancelled by user"
+    }
+    if result_code == 0:
+        callback["CallbackMetadata"] = {"Item": [
+            {"Name": "Amount", "Value": amount},
+            {"Name": "MpesaReceiptNumber", "Value": uuid.uuid4().hex[:10].upper()},
+            {"Name": "TransactionDate", "Value": int(time.strftime('%Y%m%d%H%M%S'))},
+            {"Name": "PhoneNumber", "Value": int(phone_number)}
+        ]}
+    return {"Body": {"stkCallback": callback}}
+
+
+def replay_callbacks(callback_url, callbacks, concurrency=16):
+    """POST callbacks concurrently over pooled connections; returns throughput figures"""
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    statuses = {}
+    lock = threading.Lock()
+
+    def post(body):
+        try:
+            status = session.post(callback_url, json=body, timeout=10).status_code
+        except requests.RequestException:
+            status = "error"
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(post, callbacks))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "sent": len(callbacks),
+        "statuses": statuses,
+        "elapsed_seconds": round(elapsed, 3),
+        "per_second": round(len(callbacks) / elapsed, 1) if elapsed else None
+    }
+
+
+class FakeDarajaServer:
+    """Threaded HTTP server answering the Daraja endpoints MpesaService uses"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, fail_first=0, stall_first=0, stall_seconds=5.0,
+                 token_ttl=3599, callback_delay=None, callback_result_code=0, query_result_code=0):
+        self.latency = latency          # seconds added to every response
+        self.fail_first = fail_first    # number of STK pushes to reject with an error
+        # Number of STK pushes (after the rejected ones) accepted but answered only after stall_seconds
+        self.stall_first = stall_first
+        self.stall_seconds = stall_seconds
+        self.token_ttl = token_ttl
+        self.callback_delay = callback_delay  # seconds until the result callback; None disables it
+        self.callback_result_code = callback_result_code
+        # STK Query answer for any checkout id not in query_results; None means "still processing"
+        self.query_result_code = query_result_code
+        self.query_results = {}
+        self.requests = {"oauth": 0, "stk_push": 0, "stk_query": 0}
+        self.stk_pushes = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-daraja", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---------- endpoint behaviour ----------
+    def _count(self, key):
+        with self._lock:
+            self.requests[key] += 1
+            return self.requests[key]
+
+    def handle_oauth(self):
+        self._count("oauth")
+        return 200, {"access_token": f"fake-{uuid.uuid4().hex}", "expires_in": str(self.token_ttl)}
+
+    def handle_stk_push(self, payload):
+        attempt = self._count("stk_push")
+        if attempt <= self.fail_first:
+            return 500, {"errorCode": "500.001.1001", "errorMessage": "Service is currently unreachable"}
+        if attempt <= self.fail_first + self.stall_first:
+            time.sleep(self.stall_seconds)  # accepted below, but the caller has likely given up
+
+        response = {
+            "MerchantRequestID": f"{uuid.uuid4().int % 10 ** 5}-{uuid.uuid4().int % 10 ** 8}-1",
+            "CheckoutRequestID": f"ws_CO_{time.strftime('%d%m%Y%H%M%S')}{uuid.uuid4().hex[:12]}",
+            "ResponseCode": "0",
+            "ResponseDescription": "Success. Request accepted for processing",
+            "CustomerMessage": "Success. Request accepted for processing"
+        }
+        with self._lock:
+            self.stk_pushes.append({"request": payload, "response": response})
+
+        if self.callback_delay is not None and payload.get("CallBackURL"):
+            body = build_stk_callback(
+                response["CheckoutRequestID"], response["MerchantRequestID"],
+                result_code=self.callback_result_code,
+                amount=payload.get("Amount", 1), phone_number=str(payload.get("PhoneNumber", "254700000000"))
+            )
+            timer = threading.Timer(self.callback_delay, self._send_callback, (payload["CallBackURL"], body))
+            timer.daemon = True
+            timer.start()
+        return 200, response
+
+    def handle_stk_query(self, payload):
+        self._count("stk_query")
+        checkout_request_id = payload.get("CheckoutRequestID")
+        result_code = self.query_results.get(checkout_request_id, self.query_result_code)
+        if result_code is None:
+            return 500, {"errorCode": "500.001.1001", "errorMessage": "The transaction is being processed"}
+
+        return 200, {
+            "ResponseCode": "0",
+            "ResponseDescription": "The service request has been accepted successsfully",
+            "MerchantRequestID": f"{uuid.uuid4().int % 10 ** 5}-{uuid.uuid4().int % 10 ** 8}-1",
+            "CheckoutRequestID": checkout_request_id,
+            "ResultCode": str(result_code),
+            "ResultDesc": "The service request is processed successfully." if result_code == 0
+                          else "Request cancelled by user"
+        }
+
+    def _send_callback(self, url, body):
+        try:
+            requests.post(url, json=body, timeout=10)
+        except requests.RequestException as e:
+            print(f"Fake Daraja callback to {url} failed: {e}")
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, body):
+                if server.latency:
+                    time.sleep(server.latency)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _json_body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_GET(self):
+                if self.path.startswith("/oauth/v1/generate"):
+                    return self._reply(*server.handle_oauth())
+                self._reply(404, {"errorMessage": "Not found"})
+
+            def do_POST(self):
+                if self.path.startswith("/mpesa/stkpush/v1/processrequest"):
+                    return self._reply(*server.handle_stk_push(self._json_body()))
+                if self.path.startswith("/mpesa/stkpushquery/v1/query"):
+                    return self._reply(*server.handle_stk_query(self._json_body()))
+                self._reply(404, {"errorMessage": "Not found"})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake Daraja API and callback replayer")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the fake Daraja API")
+    serve.add_argument("--port", type=int, default=8089)
+    serve.add_argument("--latency", type=float, default=0.0)
+    serve.add_argument("--fail-first", type=int, default=0)
+    serve.add_argument("--callback-delay", type=float, default=None)
+
+    replay = commands.add_parser("replay", help="POST STK result callbacks at a callback URL")
+    replay.add_argument("url")
+    replay.add_argument("--count", type=int, default=1000)
+    replay.add_argument("--checkout-ids-file", help="one CheckoutRequestID per line (default: random ids)")
+    replay.add_argument("--duplicate-ratio", type=float, default=0.0)
+    replay.add_argument("--failure-ratio", type=float, default=0.0)
+    replay.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        fake = FakeDarajaServer(port=args.port, latency=args.latency, fail_first=args.fail_first,
+                                callback_delay=args.callback_delay)
+        print(f"Fake Daraja listening on {fake.url}")
+        fake.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            fake.stop()
+    else:
+        if args.checkout_ids_file:
+            with open(args.checkout_ids_file) as f:
+                checkout_ids = [line.strip() for line in f if line.strip()][:args.count]
+        else:
+            checkout_ids = [f"ws_CO_{uuid.uuid4().hex}" for _ in range(args.count)]
+
+        callbacks = [
+            build_stk_callback(cid, result_code=1032 if random.random() < args.failure_ratio else 0)
+            for cid in checkout_ids
+        ]
+        # Duplicates are re-sent copies shuffled in, so some arrive out of order
+        callbacks += random.sample(callbacks, int(len(callbacks) * args.duplicate_ratio))
+        random.shuffle(callbacks)
+
+        report = replay_callbacks(args.url, callbacks, args.concurrency)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if set(report["statuses"]) == {200} else 1)
@@ -0,0 +1,48 @@
+"""
+The per-process user cache behind token_required: a change to a user is
+seen by the next request once it commits, and a row read before that
+commit is never put back into the cache.
+"""
+from app import db
+from app.models.User import User
+from app.services import auth_service
+
+
+def test_deactivation_applies_once_committed(app, make_user, login):
+    user_id = make_user('customer@example.com')
+    client = login('customer@example.com')
+    assert client.get('/api/auth/me').status_code == 200  # cached now
+
+    with app.app_context():
+        db.session.get(User, user_id).is_active = False
+        db.session.flush()
+        assert auth_service.user_cache.get(user_id) is not None  # not committed yet
+        db.session.commit()
+        assert auth_service.user_cache.get(user_id) is None
+
+    assert client.get('/api/auth/me').status_code == 401
+
+
+def test_rolled_back_change_keeps_the_cache(app, make_user, login):
+    user_id = make_user('customer@example.com')
+    client = login('customer@example.com')
+    client.get('/api/auth/me')
+
+    with app.app_context():
+        db.session.get(User, user_id).role = 'admin'
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+        assert auth_service.user_cache.get(user_id) is not None
+
+
+def test_row_read_before_an_invalidation_is_not_cached(app, make_user):
+    user_id = make_user('customer@example.com')
+    seen = auth_service.user_cache.invalidations
+    auth_service.invalidate_user(user_id)  # a change committed while the row was being read
+
+    auth_service.user_cache.set_unless_invalidated(user_id, {'id': user_id}, seen)
+    assert auth_service.user_cache.get(user_id) is None
+
+    auth_service.user_cache.set_unless_invalidated(user_id, {'id': user_id}, auth_service.user_cache.invalidations)
+    assert auth_service.user_cache.get(user_id) is not None
@@ -0,0 +1,135 @@
+"""
+Stock reservation and release around placing and cancelling orders.
+"""
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models.Order import Order
+from app.models.products import Product
+from app.services.catalogue_version import get_catalogue_version
+from app.services.inventory_service import StockError, reserve_stock
+
+
+def make_product(app, stock=10, sku='RICE-1'):
+    with app.app_context():
+        product = Product(name='Rice', sku=sku, unit='kg', price=Decimal('10.00'), stock=stock)
+        db.session.add(product)
+        db.session.commit()
+        return product.id
+
+
+def stock_of(app, product_id):
+    with app.app_context():
+        return db.session.get(Product, product_id).stock
+
+
+def catalogue_version(app):
+    with app.app_context():
+        return get_catalogue_version()
+
+
+@pytest.fixture
+def customer(make_user, login):
+    make_user('customer@example.com')
+    return login('customer@example.com')
+
+
+def place_order(client, product_id, quantity=1, path='/api/orders/cash-on-delivery'):
+    body = {'items': [{'product_id': product_id, 'quantity': quantity, 'price': '10.00'}], 'amount': 10 * quantity}
+    if 'mpesa' in path:
+        body['phone_number'] = '0712345678'
+    return client.post(path, json=body)
+
+
+def test_placing_orders_leaves_the_catalogue_version_alone(app, customer):
+    product_id = make_product(app)
+    version = catalogue_version(app)
+
+    assert place_order(customer, product_id).status_code == 201
+    assert place_order(customer, product_id, path='/api/orders/mpesa-stk-push').status_code == 201
+
+    assert stock_of(app, product_id) == 8
+    assert catalogue_version(app) == version
+
+
+def reserve(app, items):
+    with app.app_context():
+        try:
+            products = reserve_stock(items)
+            db.session.commit()
+            return products
+        except StockError:
+            db.session.rollback()
+            raise
+
+
+def test_insufficient_stock_is_rejected(app):
+    product_id = make_product(app, stock=5)
+
+    with pytest.raises(StockError) as error:
+        reserve(app, [{'product_id': product_id, 'quantity': 6}])
+
+    assert error.value.status_code == 400
+    assert error.value.message == 'Insufficient stock for Rice'
+    assert stock_of(app, product_id) == 5
+
+
+def test_duplicate_lines_are_summed_before_the_check(app):
+    product_id = make_product(app, stock=10)
+
+    # 6 and 6 each fit, together they don't
+    with pytest.raises(StockError):
+        reserve(app, [{'product_id': product_id, 'quantity': 6}, {'product_id': product_id, 'quantity': 6}])
+    assert stock_of(app, product_id) == 10
+
+    reserve(app, [{'product_id': product_id, 'quantity': 4}, {'product_id': str(product_id), 'quantity': '5'}])
+    assert stock_of(app, product_id) == 1
+
+
+def test_stock_taken_after_the_check_is_a_conflict(app):
+    rice = make_product(app, stock=10)
+    sugar = make_product(app, stock=10, sku='SUGAR-1')
+    basket = [{'product_id': rice, 'quantity': 3}, {'product_id': sugar, 'quantity': 3}]
+
+    # Another checkout takes most of the sugar between our read and our UPDATE
+    taken = []
+
+    def concurrent_checkout(orm_execute_state):
+        if orm_execute_state.is_update and not taken:
+            taken.append(True)
+            with db.engine.begin() as connection:
+                connection.execute(update(Product).where(Product.id == sugar).values(stock=2))
+
+    event.listen(Session, 'do_orm_execute', concurrent_checkout)
+    try:
+        with pytest.raises(StockError) as error:
+            reserve(app, basket)
+    finally:
+        event.remove(Session, 'do_orm_execute', concurrent_checkout)
+
+    assert error.value.status_code == 409
+    # The whole basket is rolled back, rice included
+    assert (stock_of(app, rice), stock_of(app, sugar)) == (10, 2)
+
+
+def test_admin_cancel_returns_stock_once(app, make_user, customer, login):
+    product_id = make_product(app, stock=10)
+    response = place_order(customer, product_id, quantity=3)
+    order_id = response.get_json()['order']['id']
+    assert stock_of(app, product_id) == 7
+
+    make_user('admin@example.com', role='admin')
+    admin = login('admin@example.com')
+    assert admin.put(f'/api/admin/orders/{order_id}/status', json={'status': 'cancelled'}).status_code == 200
+    assert stock_of(app, product_id) == 10
+
+    # Cancelling again, by either route, returns nothing more
+    assert admin.put(f'/api/admin/orders/{order_id}/status', json={'status': 'cancelled'}).status_code == 200
+    assert admin.put(f'/api/admin/orders/{order_id}', json={'status': 'cancelled'}).status_code == 200
+    assert stock_of(app, product_id) == 10
+    with app.app_context():
+        assert db.session.get(Order, order_id).status == 'cancelled'
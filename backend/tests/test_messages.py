@@ -0,0 +1,36 @@
+"""
+The batching message writer: one bad message must not fail the others in its batch.
+"""
+from app import db
+from app.models.messages import Message
+from app.services.message_store import MessageWriter, create_conversation
+
+
+def make_conversation(app):
+    with app.app_context():
+        return create_conversation(['customer_1', 'retailer_1'], 'Support').id
+
+
+def test_bad_message_fails_alone(app):
+    conversation_id = make_conversation(app)
+    writer = MessageWriter(app, max_wait=0.2)
+
+    good = writer.submit(conversation_id, 'customer_1', 'Hello')
+    bad = writer.submit(conversation_id, 'retailer_1', None)  # content is NOT NULL
+
+    assert good.result(5)['content'] == 'Hello'
+    assert bad.exception(5) is not None
+    assert writer.get_stats()['errors'] == 1
+    with app.app_context():
+        assert [m.content for m in Message.query.all()] == ['Hello']
+
+
+def test_send_message_requires_sender_and_content(app, client):
+    conversation_id = make_conversation(app)
+
+    for body in ({'sender_id': 'customer_1'}, {'sender_id': 'customer_1', 'content': '  '}, {'content': 'Hi'}):
+        body['conversation_id'] = conversation_id
+        response = client.post('/api/send-message', json=body)
+        assert response.status_code == 400, body
+    with app.app_context():
+        assert db.session.query(Message).count() == 0
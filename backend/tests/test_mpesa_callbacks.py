@@ -0,0 +1,136 @@
+"""
+Load test for STK callback settlement: a burst of callbacks, with
+duplicates shuffled in, must settle every order exactly once.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import random
+import time
+
+import pytest
+
+from app import db
+from app.models.Order import Order, OrderItem
+from app.models.products import Product
+from app.services import mpesa_settlement
+from fake_daraja import build_stk_callback
+from app.services.mpesa_service import get_mpesa_service
+
+TOKEN = 'test-callback-token'
+CALLBACK_URL = f'/api/mpesa-callback/{TOKEN}'
+STOCK = 1000
+
+
+@pytest.fixture(autouse=True)
+def callback_token(monkeypatch):
+    monkeypatch.setattr(get_mpesa_service(), 'callback_token', TOKEN)
+
+
+def make_orders(app, make_user, count):
+    """`count` processing orders of one unit (10.00) each, their stock already reserved"""
+    customer_id = make_user('customer@example.com')
+    with app.app_context():
+        product = Product(name='Rice', sku='RICE-1', unit='kg', price=Decimal('10.00'), stock=STOCK - count)
+        db.session.add(product)
+        for i in range(count):
+            order = Order(customer_id=customer_id, status='processing', mpesa_checkout_request_id=f'ws_CO_{i}')
+            order.items = [OrderItem(product=product, quantity=1, price=product.price)]
+            order.calculate_totals()
+            db.session.add(order)
+        db.session.commit()
+        return product.id
+
+
+def post_all(app, callbacks, concurrency=8):
+    def post(body):
+        return app.test_client().post(CALLBACK_URL, json=body).status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(post, callbacks))
+
+
+def wait_for_settlement(app, expected, timeout=30):
+    ingestor = mpesa_settlement.get_callback_ingestor(app)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = ingestor.get_stats()
+        if stats['settled'] >= expected and stats['queued'] == 0 and not stats['awaiting_order']:
+            return stats
+        time.sleep(0.05)
+    pytest.fail(f"Callbacks not settled in {timeout}s: {ingestor.get_stats()}")
+
+
+def test_every_order_settles_exactly_once(app, make_user):
+    count = 300
+    product_id = make_orders(app, make_user, count)
+    failed_ids = {f'ws_CO_{i}' for i in range(0, count, 3)}
+
+    callbacks = [
+        build_stk_callback(f'ws_CO_{i}', result_code=1032 if f'ws_CO_{i}' in failed_ids else 0, amount=10)
+        for i in range(count)
+    ]
+    duplicates = random.Random(7).sample(callbacks, count // 3)
+    burst = callbacks + duplicates
+    random.Random(11).shuffle(burst)
+
+    assert set(post_all(app, burst)) == {200}
+    wait_for_settlement(app, count)
+    time.sleep(0.3)  # let any stray duplicate finish
+    stats = mpesa_settlement.get_callback_ingestor(app).get_stats()
+
+    assert stats['settled'] == count
+    assert stats['duplicates'] == len(duplicates)
+    with app.app_context():
+        orders = Order.query.all()
+        assert all(order.mpesa_result_code is not None for order in orders)
+        for order in orders:
+            if order.mpesa_checkout_request_id in failed_ids:
+                assert order.status == 'cancelled'
+            else:
+                assert order.status == 'completed'
+                assert order.mpesa_receipt_number
+        # Each cancelled order returned its unit of stock once
+        assert db.session.get(Product, product_id).stock == STOCK - count + len(failed_ids)
+
+
+def test_callback_without_token_is_rejected(app, make_user):
+    make_orders(app, make_user, 1)
+    body = build_stk_callback('ws_CO_0', amount=10)
+
+    assert app.test_client().post('/api/mpesa-callback', json=body).status_code == 403
+    assert app.test_client().post('/api/mpesa-callback/wrong', json=body).status_code == 403
+    with app.app_context():
+        assert Order.query.one().status == 'processing'
+
+
+def test_amount_mismatch_is_recorded_but_not_completed(app, make_user):
+    make_orders(app, make_user, 1)
+
+    post_all(app, [build_stk_callback('ws_CO_0', amount=1)])
+    wait_for_settlement(app, 1)
+
+    with app.app_context():
+        order = Order.query.one()
+        assert order.status == 'processing'
+        assert order.mpesa_result_code == '0'
+        assert order.mpesa_result_desc == 'Amount mismatch: paid 1, expected 10'
+
+
+def test_batch_that_fails_to_save_is_retried(app, make_user, monkeypatch):
+    make_orders(app, make_user, 5)
+    real_settle_results = mpesa_settlement.settle_results
+    calls = []
+
+    def flaky_settle_results(results):
+        calls.append(len(results))
+        if len(calls) == 1:
+            raise RuntimeError("database unavailable")
+        return real_settle_results(results)
+
+    monkeypatch.setattr(mpesa_settlement, 'settle_results', flaky_settle_results)
+    post_all(app, [build_stk_callback(f'ws_CO_{i}', amount=10) for i in range(5)], concurrency=1)
+    stats = wait_for_settlement(app, 5)
+
+    assert stats['settle_errors'] == 1
+    with app.app_context():
+        assert {order.status for order in Order.query.all()} == {'completed'}
@@ -0,0 +1,134 @@
+"""
+The STK push outbox against the fake Daraja server: a push is sent once,
+retried only when Daraja rejects it, and parked (never re-sent) when a
+timeout leaves its fate unknown.
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from app import db
+from app.models.mpesa_outbox import MpesaOutbox
+from app.models.Order import Order, OrderItem
+from app.models.products import Product
+from app.services.mpesa_outbox import OutboxDispatcher, enqueue_stk_push
+from app.services.mpesa_service import MpesaService
+from fake_daraja import FakeDarajaServer
+
+STOCK = 10
+
+
+@pytest.fixture
+def fake_daraja():
+    with FakeDarajaServer() as server:
+        yield server
+
+
+@pytest.fixture
+def mpesa(fake_daraja, monkeypatch):
+    monkeypatch.setenv('MPESA_BASE_URL', fake_daraja.url)
+    return MpesaService()
+
+
+def dispatcher(app, mpesa, **options):
+    options.setdefault('backoff_seconds', 0)  # retries are due at once
+    return OutboxDispatcher(app, workers=1, mpesa_service=mpesa, **options)
+
+
+def queue_order(app, make_user):
+    """A pending M-Pesa order for one unit, its stock reserved and its push in the outbox"""
+    customer_id = make_user('customer@example.com')
+    with app.app_context():
+        product = Product(name='Rice', sku='RICE-1', unit='kg', price=Decimal('10.00'), stock=STOCK - 1)
+        order = Order(customer_id=customer_id, payment_method='mpesa', status='pending',
+                      mpesa_phone_number='254712345678')
+        order.items = [OrderItem(product=product, quantity=1, price=product.price)]
+        order.calculate_totals()
+        db.session.add(order)
+        enqueue_stk_push(order, '254712345678', 10, f'ORDER{order.id}', 'Payment')
+        db.session.commit()
+        return order.id, product.id
+
+
+def outbox_and_order(app, order_id):
+    with app.app_context():
+        entry = MpesaOutbox.query.filter_by(order_id=order_id).one()
+        order = db.session.get(Order, order_id)
+        return entry.to_dict(), {'status': order.status, 'checkout': order.mpesa_checkout_request_id}
+
+
+def test_push_is_sent_once(app, make_user, fake_daraja, mpesa):
+    order_id, _ = queue_order(app, make_user)
+    outbox = dispatcher(app, mpesa)
+
+    assert outbox.process_due() == 1
+    assert outbox.process_due() == 0
+
+    entry, order = outbox_and_order(app, order_id)
+    assert entry['status'] == 'sent'
+    assert order['status'] == 'processing'
+    assert order['checkout'] == fake_daraja.stk_pushes[0]['response']['CheckoutRequestID']
+    assert fake_daraja.requests['stk_push'] == 1
+    assert fake_daraja.stk_pushes[0]['request']['CallBackURL'].endswith(f'order={order_id}')
+
+
+def test_rejected_push_is_retried(app, make_user, fake_daraja, mpesa):
+    fake_daraja.fail_first = 1
+    order_id, _ = queue_order(app, make_user)
+    outbox = dispatcher(app, mpesa)
+
+    assert outbox.process_due() == 1
+    entry, order = outbox_and_order(app, order_id)
+    assert (entry['status'], entry['attempts']) == ('pending', 1)
+    assert entry['last_error'] == 'Service is currently unreachable'
+    assert order['status'] == 'pending'
+
+    assert outbox.process_due() == 1
+    entry, order = outbox_and_order(app, order_id)
+    assert (entry['status'], entry['attempts']) == ('sent', 2)
+    assert order['status'] == 'processing'
+    assert fake_daraja.requests['stk_push'] == 2
+    assert outbox.stats['retried'] == 1
+
+
+def test_rejected_push_backs_off(app, make_user, fake_daraja, mpesa):
+    fake_daraja.fail_first = 1
+    order_id, _ = queue_order(app, make_user)
+    outbox = dispatcher(app, mpesa, backoff_seconds=60)
+
+    outbox.process_due()
+    entry, _ = outbox_and_order(app, order_id)
+    assert datetime.fromisoformat(entry['next_attempt_at']) > datetime.utcnow() + timedelta(seconds=40)
+    assert outbox.process_due() == 0
+    assert fake_daraja.requests['stk_push'] == 1
+
+
+def test_timed_out_push_is_parked_not_resent(app, make_user, fake_daraja, mpesa):
+    fake_daraja.stall_first, fake_daraja.stall_seconds = 1, 1.0
+    mpesa.timeout = 0.3
+    order_id, product_id = queue_order(app, make_user)
+    outbox = dispatcher(app, mpesa)
+
+    assert outbox.process_due() == 1
+    entry, order = outbox_and_order(app, order_id)
+    assert entry['status'] == 'unknown'
+    assert order['status'] == 'pending'
+
+    assert outbox.process_due() == 0
+    assert fake_daraja.requests['stk_push'] == 1
+
+    # No callback within unknown_expiry: the order is cancelled and its stock returned, once
+    with app.app_context():
+        db.session.query(MpesaOutbox).update({'updated_at': datetime.utcnow() - timedelta(seconds=60)})
+        db.session.commit()
+    expiring = dispatcher(app, mpesa, unknown_expiry=30)
+    expiring.process_due()
+    expiring.process_due()
+
+    entry, order = outbox_and_order(app, order_id)
+    assert entry['status'] == 'failed'
+    assert order['status'] == 'cancelled'
+    assert fake_daraja.requests['stk_push'] == 1
+    with app.app_context():
+        assert db.session.get(Product, product_id).stock == STOCK
@@ -0,0 +1,73 @@
+"""
+The order listings and the dashboard must load a page of orders with a
+fixed number of SQL statements, however many orders there are (no N+1
+over items, products or customers).
+"""
+from contextlib import contextmanager
+from decimal import Decimal
+
+from sqlalchemy import event
+
+from app import db
+from app.models.Order import Order, OrderItem
+from app.models.products import Product
+
+ENDPOINTS = ['/api/orders', '/api/admin/orders', '/api/dashboard']
+
+
+@contextmanager
+def count_queries(app):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def add_orders(app, customer_id, count):
+    with app.app_context():
+        products = [
+            Product(name=f'Product {i}', sku=f'SKU-{customer_id}-{count}-{i}', unit='pcs',
+                    price=Decimal('10.00'), stock=100, category=f'Category {i % 3}')
+            for i in range(3)
+        ]
+        db.session.add_all(products)
+        for _ in range(count):
+            order = Order(customer_id=customer_id, payment_method='mpesa', status='pending')
+            order.items = [OrderItem(product=product, quantity=2, price=product.price) for product in products]
+            order.calculate_totals()
+            db.session.add(order)
+        db.session.commit()
+
+
+def statements_per_endpoint(app, client):
+    counts = {}
+    for url in ENDPOINTS:
+        client.get(url)  # warm the auth cache so both runs start from the same state
+        with count_queries(app) as statements:
+            response = client.get(url)
+        assert response.status_code == 200, response.get_json()
+        counts[url] = len(statements)
+    return counts
+
+
+def test_order_queries_do_not_grow_with_orders(app, make_user, login):
+    # An admin can call all three endpoints, and their own orders feed the customer ones
+    user_id = make_user('admin@example.com', role='admin')
+    client = login('admin@example.com')
+
+    add_orders(app, user_id, 5)
+    with_5 = statements_per_endpoint(app, client)
+
+    add_orders(app, user_id, 45)
+    with_50 = statements_per_endpoint(app, client)
+
+    assert all(with_5.values())
+    assert with_50 == with_5
@@ -38,8 +38,10 @@ const InventoryManagement = () => {
   const fetchProducts = async () => {
     try {
       setIsLoading(true);
+      // Stock lists may be cached briefly; revalidate so edits made here show up at once
       const response = await fetch(API_BASE_URL, {
         method: 'GET',
+        cache: 'no-cache',
         credentials: 'include',
         headers: {
           'Content-Type': 'application/json',
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import {
   useReactTable,
   createColumnHelper,
@@ -33,16 +33,45 @@ const OrdersManagement = () => {
   const [editingOrder, setEditingOrder] = useState(null);
   const [editForm, setEditForm] = useState({});
   const [loading, setLoading] = useState(true);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [hasMore, setHasMore] = useState(false);
+  const [statusCounts, setStatusCounts] = useState({});
+  const [paymentFilter, setPaymentFilter] = useState('');
+  const [customerFilter, setCustomerFilter] = useState('');
+  const [dateFrom, setDateFrom] = useState('');
+  const [dateTo, setDateTo] = useState('');
 
-  // Fetch real data from API
+  const PAGE_SIZE = 100;
+  const latestRequest = useRef(0);
+
+  // The API returns one page at a time and filters on the server; wait for typing to pause before asking
   useEffect(() => {
-    fetchOrders();
-  }, []);
+    const timer = setTimeout(() => fetchOrders(), customerFilter ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [statusFilter, paymentFilter, customerFilter, dateFrom, dateTo]);
+
+  // The server-side filters, shared by the listing and the export
+  const filterParams = () => {
+    const params = new URLSearchParams();
+    if (statusFilter) params.set('status', statusFilter);
+    if (paymentFilter) params.set('payment_method', paymentFilter);
+    if (customerFilter.trim()) params.set('customer', customerFilter.trim());
+    if (dateFrom) params.set('date_from', dateFrom);
+    if (dateTo) params.set('date_to', dateTo);
+    return params;
+  };
+
+  // Without a cursor this loads the first page and replaces the list; with one it appends the next page
+  const fetchOrders = async (cursor = null) => {
+    const requestId = ++latestRequest.current;
+    const params = filterParams();
+    params.set('limit', PAGE_SIZE);
+    if (cursor) params.set('cursor', cursor);
 
-  const fetchOrders = async () => {
     try {
-      setLoading(true);
-      const response = await fetch('http://localhost:5000/api/admin/orders', {
+      if (cursor) setIsLoadingMore(true);
+      const response = await fetch(`http://localhost:5000/api/admin/orders?${params}`, {
         method: 'GET',
         headers: {
           'Content-Type': 'application/json',
@@ -52,18 +81,37 @@ const OrdersManagement = () => {
 
       if (response.ok) {
         const result = await response.json();
-        setData(result.orders || []);
+        if (requestId !== latestRequest.current) return; // the filters have changed since
+        setData(prev => cursor ? [...prev, ...(result.orders || [])] : (result.orders || []));
+        setNextCursor(result.next_cursor);
+        setHasMore(Boolean(result.has_more));
+        // Counted over every matching order; only the first page carries them
+        if (!cursor) setStatusCounts(result.status_counts || {});
       } else {
-        throw new Error('Failed to fetch orders');
+        const result = await response.json().catch(() => ({}));
+        throw new Error(result.message || 'Failed to fetch orders');
       }
     } catch (error) {
       console.error('Error fetching orders:', error);
-      showMessage('Failed to fetch orders', 'red');
+      showMessage(error.message || 'Failed to fetch orders', 'red');
     } finally {
-      setLoading(false);
+      if (requestId === latestRequest.current) {
+        setLoading(false);
+        setIsLoadingMore(false);
+      }
     }
   };
 
+  // Keep the server's per-status totals in step with a status change made here
+  const moveStatusCount = (from, to) => {
+    if (!from || !to || from === to) return;
+    setStatusCounts(prev => ({
+      ...prev,
+      [from]: Math.max(0, (prev[from] || 0) - 1),
+      [to]: (prev[to] || 0) + 1,
+    }));
+  };
+
   // Update order status
   const updateOrderStatus = async (orderId, newStatus) => {
     try {
@@ -79,6 +127,7 @@ const OrdersManagement = () => {
       if (response.ok) {
         const result = await response.json();
         // Update local state
+        moveStatusCount(data.find(order => order.id === orderId)?.status, newStatus);
         setData(prevData =>
           prevData.map(order =>
             order.id === orderId ? { ...order, status: newStatus } : order
@@ -132,6 +181,7 @@ const OrdersManagement = () => {
 
         if (response.ok) {
           const result = await response.json();
+          moveStatusCount(editingOrder.status, editForm.status);
           setData(prevData =>
             prevData.map(item =>
               item.id === editingOrder.id ? { ...editForm } : item
@@ -410,11 +460,8 @@ const OrdersManagement = () => {
     }),
   ];
 
-  // Filter data based on status
-  const filteredData = React.useMemo(() => {
-    if (!statusFilter) return data;
-    return data.filter(order => order.status === statusFilter);
-  }, [data, statusFilter]);
+  // Status and the other filters are applied by the API; the search box narrows the loaded rows
+  const filteredData = data;
 
   const table = useReactTable({
     data: filteredData,
@@ -603,36 +650,35 @@ const OrdersManagement = () => {
     setEditingOrder(order);
   };
 
-  const handleExportCSV = () => {
-    const headers = ['ID', 'Customer Name', 'Customer Email', 'Phone', 'Total Quantity', 'Total Amount', 'Payment Method', 'Status', 'Date'];
-    const csvData = filteredData.map(order => [
-      order.id,
-      order.customer_name || 'N/A',
-      order.customer_email || 'N/A',
-      order.customer_phone || order.mpesa_phone_number || 'N/A',
-      order.total_quantity,
-      parseFloat(order.total_amount).toFixed(2),
-      order.payment_method,
-      order.status,
-      new Date(order.created_at).toLocaleDateString('en-KE')
-    ]);
-    
-    const csvContent = [
-      headers.join(','),
-      ...csvData.map(row => row.map(field => `"${field}"`).join(','))
-    ].join('\n');
-    
-    const blob = new Blob([csvContent], { type: 'text/csv' });
-    const url = window.URL.createObjectURL(blob);
-    const a = document.createElement('a');
-    a.href = url;
-    a.download = `orders-export-${new Date().toISOString().split('T')[0]}.csv`;
-    document.body.appendChild(a);
-    a.click();
-    document.body.removeChild(a);
-    window.URL.revokeObjectURL(url);
-    
-    showMessage(`Exported ${filteredData.length} orders to CSV file.`, 'green');
+  // The server streams every order matching the filters, not just the pages loaded here
+  const handleExportCSV = async () => {
+    try {
+      const params = filterParams();
+      params.set('format', 'csv');
+      const response = await fetch(`http://localhost:5000/api/admin/orders/export?${params}`, {
+        method: 'GET',
+        credentials: 'include',
+      });
+      if (!response.ok) {
+        const result = await response.json().catch(() => ({}));
+        throw new Error(result.message || 'Failed to export orders');
+      }
+
+      const blob = await response.blob();
+      const url = window.URL.createObjectURL(blob);
+      const a = document.createElement('a');
+      a.href = url;
+      a.download = `orders-export-${new Date().toISOString().split('T')[0]}.csv`;
+      document.body.appendChild(a);
+      a.click();
+      document.body.removeChild(a);
+      window.URL.revokeObjectURL(url);
+
+      showMessage('Exported all matching orders to CSV file.', 'green');
+    } catch (error) {
+      console.error('Error exporting orders:', error);
+      showMessage(error.message || 'Failed to export orders', 'red');
+    }
   };
 
   if (loading) {
@@ -668,7 +714,9 @@ const OrdersManagement = () => {
               </div>
               <div className="ml-4">
                 <p className="text-sm font-medium text-gray-600">Total Orders</p>
-                <p className="text-2xl font-bold text-gray-900">{data.length}</p>
+                <p className="text-2xl font-bold text-gray-900">
+                  {Object.values(statusCounts).reduce((sum, count) => sum + count, 0)}
+                </p>
               </div>
             </div>
           </div>
@@ -683,7 +731,7 @@ const OrdersManagement = () => {
               <div className="ml-4">
                 <p className="text-sm font-medium text-gray-600">Completed</p>
                 <p className="text-2xl font-bold text-gray-900">
-                  {data.filter(order => order.status === 'completed').length}
+                  {statusCounts.completed || 0}
                 </p>
               </div>
             </div>
@@ -699,7 +747,7 @@ const OrdersManagement = () => {
               <div className="ml-4">
                 <p className="text-sm font-medium text-gray-600">Pending</p>
                 <p className="text-2xl font-bold text-gray-900">
-                  {data.filter(order => order.status === 'pending').length}
+                  {statusCounts.pending || 0}
                 </p>
               </div>
             </div>
@@ -715,7 +763,7 @@ const OrdersManagement = () => {
               <div className="ml-4">
                 <p className="text-sm font-medium text-gray-600">Cancelled</p>
                 <p className="text-2xl font-bold text-gray-900">
-                  {data.filter(order => order.status === 'cancelled').length}
+                  {statusCounts.cancelled || 0}
                 </p>
               </div>
             </div>
@@ -753,6 +801,16 @@ const OrdersManagement = () => {
                   <option value="shipped">Shipped</option>
                   <option value="cancelled">Cancelled</option>
                 </select>
+
+                <select
+                  value={paymentFilter}
+                  onChange={(e) => setPaymentFilter(e.target.value)}
+                  className="border border-gray-300 rounded-md px-3 py-2 text-sm focus:outline-none focus:ring-1 focus:ring-blue-500 focus:border-blue-500"
+                >
+                  <option value="">All Payments</option>
+                  <option value="mpesa">M-Pesa</option>
+                  <option value="cash_on_delivery">Cash on Delivery</option>
+                </select>
                 
                 <button 
                   onClick={handleExportCSV}
@@ -763,6 +821,34 @@ const OrdersManagement = () => {
                 </button>
               </div>
             </div>
+
+            <div className="flex flex-col sm:flex-row sm:items-center gap-3 mt-4">
+              <input
+                type="text"
+                placeholder="Customer email, name or phone..."
+                value={customerFilter}
+                onChange={(e) => setCustomerFilter(e.target.value)}
+                className="border border-gray-300 rounded-md px-3 py-2 text-sm focus:outline-none focus:ring-1 focus:ring-blue-500 focus:border-blue-500"
+              />
+              <label className="flex items-center space-x-2 text-sm text-gray-600">
+                <span>From</span>
+                <input
+                  type="date"
+                  value={dateFrom}
+                  onChange={(e) => setDateFrom(e.target.value)}
+                  className="border border-gray-300 rounded-md px-3 py-2 text-sm focus:outline-none focus:ring-1 focus:ring-blue-500 focus:border-blue-500"
+                />
+              </label>
+              <label className="flex items-center space-x-2 text-sm text-gray-600">
+                <span>To</span>
+                <input
+                  type="date"
+                  value={dateTo}
+                  onChange={(e) => setDateTo(e.target.value)}
+                  className="border border-gray-300 rounded-md px-3 py-2 text-sm focus:outline-none focus:ring-1 focus:ring-blue-500 focus:border-blue-500"
+                />
+              </label>
+            </div>
           </div>
 
           {/* Table */}
@@ -834,8 +920,17 @@ const OrdersManagement = () => {
                       filteredData.length
                     )}
                   </span>{' '}
-                  of <span className="font-medium">{filteredData.length}</span> results
+                  of <span className="font-medium">{filteredData.length}</span> loaded results
                 </span>
+                {hasMore && (
+                  <button
+                    onClick={() => fetchOrders(nextCursor)}
+                    disabled={isLoadingMore}
+                    className="px-3 py-1 border border-gray-300 rounded-md text-sm font-medium text-gray-700 bg-white hover:bg-gray-50 disabled:opacity-50 disabled:cursor-not-allowed transition-colors"
+                  >
+                    {isLoadingMore ? 'Loading...' : 'Load more'}
+                  </button>
+                )}
               </div>
               
               <div className="flex items-center space-x-2">
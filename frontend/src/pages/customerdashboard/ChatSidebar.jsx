@@ -221,11 +221,13 @@ const ChatSidebar = ({ show, onClose }) => {
           'Content-Type': 'application/json',
         },
         credentials: 'include',
-        body: JSON.stringify({
-          product_id: orderData.product.id,
-          quantity: orderData.quantity,
-          total_amount: orderData.totalAmount
-        })
+        body: JSON.stringify(orderData.items
+          ? { items: orderData.items }
+          : {
+              product_id: orderData.product.id,
+              quantity: orderData.quantity,
+              total_amount: orderData.totalAmount
+            })
       });
 
       if (response.ok) {
@@ -286,8 +288,8 @@ const ChatSidebar = ({ show, onClose }) => {
   };
 
   // Handle order confirmation
-  const handleOrderConfirmation = async (confirmed) => {
-    if (!confirmed || !currentOrder) {
+  const handleOrderConfirmation = async (confirmed, order = currentOrder) => {
+    if (!confirmed || !order) {
       addBotMessage(selectedLanguage === 'sw' ? 'Agizo limeghairiwa.' : 'Order cancelled.');
       setCurrentOrder(null);
       return;
@@ -297,7 +299,7 @@ const ChatSidebar = ({ show, onClose }) => {
     addBotMessage(translations[selectedLanguage].orderConfirmed);
 
     try {
-      const result = await confirmOrder(currentOrder);
+      const result = await confirmOrder(order);
       
       if (result.success) {
         addBotMessage(
@@ -368,6 +370,24 @@ const ChatSidebar = ({ show, onClose }) => {
             addBotMessage(analysis.confirmation_message, true);
             break;
 
+          case 'basket':
+            // Several products in one message: one order, one payment prompt
+            if (analysis.can_order) {
+              setCurrentOrder({
+                items: analysis.items.map(item => ({ product_id: item.product_id, quantity: item.quantity })),
+                totalAmount: analysis.total_amount
+              });
+              addBotMessage(analysis.confirmation_message, true);
+            } else {
+              addBotMessage(analysis.message);
+            }
+            break;
+
+          case 'confirm_order':
+            // A typed "yes" to the last suggestion; the server remembers what was suggested
+            await handleOrderConfirmation(true, { items: analysis.items });
+            break;
+
           case 'need_quantity':
             setAwaitingQuantity(analysis.product);
             addBotMessage(analysis.message);
@@ -585,20 +585,17 @@ const Messages = () => {
             }
         });
 
-        socket.on('user_typing', (data) => {
+        // The server batches typing changes per conversation; `typing` is everyone typing right now
+        socket.on('typing_update', (data) => {
             if (selectedConversation && selectedConversation.id === data.conversation_id) {
-                if (data.is_typing) {
-                    setTypingUsers(prev => [...prev.filter(u => u !== data.user_id), data.user_id]);
-                } else {
-                    setTypingUsers(prev => prev.filter(u => u !== data.user_id));
-                }
+                setTypingUsers(data.typing);
             }
         });
 
         return () => {
             if (socket) {
                 socket.off('new_message');
-                socket.off('user_typing');
+                socket.off('typing_update');
             }
         };
     }, [socket, selectedConversation]);
@@ -1,5 +1,5 @@
 // Products.js
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { 
   FiPackage, FiImage, FiFilter, FiBox, FiDollarSign, FiCalendar, 
@@ -11,6 +11,8 @@ const Products = () => {
   const navigate = useNavigate();
   const [products, setProducts] = useState([]);
   const [isLoading, setIsLoading] = useState(false);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
   const [searchTerm, setSearchTerm] = useState('');
   const [categoryFilter, setCategoryFilter] = useState('all');
   const [categories, setCategories] = useState([]);
@@ -18,44 +20,71 @@ const Products = () => {
   const [showCartModal, setShowCartModal] = useState(false);
 
   const API_BASE_URL = 'http://localhost:5000/api/products';
+  const PAGE_SIZE = 48;
+  // Only what the product cards and cart use
+  const PRODUCT_FIELDS = 'id,name,sku,description,category,unit,price,stock,threshold,expiry_date,image_filename,image_url';
+  const latestRequest = useRef(0);
 
   useEffect(() => {
-    fetchProducts();
+    fetchCategories();
   }, []);
 
+  // Search and category filtering run on the server; wait for typing to pause before asking
   useEffect(() => {
-    if (products.length > 0) {
-      const uniqueCategories = [...new Set(products
-        .map(product => product.category)
-        .filter(category => category && category.trim() !== '')
-      )].sort();
-      setCategories(uniqueCategories);
+    const timer = setTimeout(() => fetchProducts(), searchTerm ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [searchTerm, categoryFilter]);
+
+  const fetchCategories = async () => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/categories`, {
+        method: 'GET',
+        credentials: 'include',
+      });
+      if (!response.ok) throw new Error(`Failed to fetch categories: ${response.status}`);
+
+      const result = await response.json();
+      if (result.success) {
+        setCategories(result.categories);
+      }
+    } catch (error) {
+      console.error('Error fetching categories:', error);
     }
-  }, [products]);
+  };
+
+  // Without a cursor this loads the first page and replaces the list; with one it appends the next page
+  const fetchProducts = async (cursor = null) => {
+    const requestId = ++latestRequest.current;
+    const params = new URLSearchParams({ limit: PAGE_SIZE, fields: PRODUCT_FIELDS });
+    if (searchTerm.trim()) params.set('q', searchTerm.trim());
+    if (categoryFilter !== 'all') params.set('category', categoryFilter);
+    if (cursor) params.set('cursor', cursor);
 
-  const fetchProducts = async () => {
     try {
-      setIsLoading(true);
-      const response = await fetch(API_BASE_URL, {
+      cursor ? setIsLoadingMore(true) : setIsLoading(true);
+      // Reused from the browser cache for up to PRODUCT_STOCK_MAX_AGE, then revalidated with If-None-Match
+      const response = await fetch(`${API_BASE_URL}?${params}`, {
         method: 'GET',
         credentials: 'include',
-        headers: {
-          'Content-Type': 'application/json',
-        },
       });
 
       if (!response.ok) throw new Error(`Failed to fetch products: ${response.status}`);
       
       const result = await response.json();
+      if (requestId !== latestRequest.current) return; // a newer search has been sent since
       if (result.success) {
-        setProducts(result.products);
+        setProducts(prev => cursor ? [...prev, ...result.products] : result.products);
+        setNextCursor(result.next_cursor);
       } else {
         throw new Error(result.message || 'Failed to fetch products');
       }
     } catch (error) {
       console.error('Error fetching products:', error);
     } finally {
-      setIsLoading(false);
+      if (requestId === latestRequest.current) {
+        setIsLoading(false);
+        setIsLoadingMore(false);
+      }
     }
   };
 
@@ -110,16 +139,6 @@ const Products = () => {
     navigate('/customer-dashboard/orders');
   };
 
-  const filteredProducts = products.filter(product => {
-    const matchesCategory = categoryFilter === 'all' || product.category === categoryFilter;
-    const matchesSearch = product.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                         product.sku.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                         (product.description && product.description.toLowerCase().includes(searchTerm.toLowerCase())) ||
-                         (product.category && product.category.toLowerCase().includes(searchTerm.toLowerCase()));
-    
-    return matchesCategory && matchesSearch;
-  });
-
   const formatPrice = (price) => `$${Number(price).toFixed(2)}`;
   const formatDate = (dateString) => dateString ? new Date(dateString).toLocaleDateString() : 'N/A';
 
@@ -235,7 +254,7 @@ const Products = () => {
         {/* Products Grid */}
         {!isLoading && (
           <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-4">
-            {filteredProducts.map((product) => {
+            {products.map((product) => {
               const stockStatus = getStockStatus(product.stock, product.threshold);
               const categoryColor = getCategoryColor(product.category);
 
@@ -368,7 +387,7 @@ const Products = () => {
         )}
 
         {/* Empty State */}
-        {!isLoading && filteredProducts.length === 0 && (
+        {!isLoading && products.length === 0 && (
           <div className="text-center py-12">
             <FiPackage className="mx-auto text-gray-300 text-4xl mb-3" />
             <p className="text-gray-500 text-sm">
@@ -380,10 +399,19 @@ const Products = () => {
         )}
 
         {/* Results Count */}
-        {!isLoading && filteredProducts.length > 0 && (
+        {!isLoading && products.length > 0 && (
           <div className="mt-6 text-center">
+            {nextCursor && (
+              <button
+                onClick={() => fetchProducts(nextCursor)}
+                disabled={isLoadingMore}
+                className="mb-3 px-4 py-2 rounded-lg text-sm font-medium bg-white text-gray-600 border border-gray-200 hover:bg-gray-50 disabled:opacity-50"
+              >
+                {isLoadingMore ? 'Loading...' : 'Load more'}
+              </button>
+            )}
             <p className="text-gray-500 text-sm">
-              Showing {filteredProducts.length} of {products.length} products
+              Showing {products.length} products
             </p>
           </div>
         )}